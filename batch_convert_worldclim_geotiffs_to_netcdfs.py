@@ -1,23 +1,19 @@
 #!/bin/env python
 
-import matplotlib.pyplot as plt
-import numpy as np
-import xarray as xr
-import rasterio
 import os
-import cartopy.crs as ccrs
-from rasterio.warp import transform
 from collections import OrderedDict
-import netCDF4
 import configparser
 
+# lon/lat grids are computed once per unique grid and shared by all files on it
+from regridding.geotiff_grids import convert_geotiff
+
 config = configparser.ConfigParser()
 config.read('regridding.cfg')
 
 # directory for World Clim data
 # downloaded from World Clim site, http://worldclim.org/version2, 10min global data, 
 # 1 file for each month, 1970-2000 averages
-direc = config['WorldClim'['geotiff_dir']
+direc = config['WorldClim']['geotiff_dir']
 netcdf_direc = config['WorldClim']['netcdf_dir']
 
 # dict of temp and precip files to process
@@ -35,50 +31,7 @@ for key, items in d.items():
 		subdir = "wc2.0_10m_%s" %key
 		file = os.path.join(direc, subdir, filename)
 			
-		# open as DataArray
-		da = xr.open_rasterio(file)
-	
-		# compute lon/lat coords with rasterio.warp.transform
-		ny, nx = len(da['y']), len(da['x'])
-		x, y = np.meshgrid(da['x'], da['y'])
-
-		# work with 1-D arrays 
-		lon, lat = transform(da.crs, {'init': 'EPSG:4326'},
-                     			     x.flatten(), y.flatten())
-		lon = np.asarray(lon).reshape((ny, nx))
-		lat = np.asarray(lat).reshape((ny, nx))
-		da.coords['lon'] = (('y', 'x'), lon)
-		da.coords['lat'] = (('y', 'x'), lat)
-
-		# open as file object to get data
-		dataset = rasterio.open(file)
-		band = dataset.read(1)
-
-		# create dataset to write to
-		ds = xr.Dataset()
-		ds['xc'] = xr.DataArray(lon, dims=('nj', 'ni'))
-		ds['yc'] = xr.DataArray(lat, dims=('nj', 'ni'))
-		ds[key] = xr.DataArray(band, dims=('nj', 'ni'), 
-                                 	 coords={'lon': ds['xc'], 
-                                         'lat': ds['yc']})
 		# write dataset to netcdf
 		netcdf_filename = "%s_%s.nc" %(key, month_num)
 		savepath = os.path.join(netcdf_direc, netcdf_filename)
-		ds.to_netcdf(savepath, encoding={key: {'dtype': 'float'}},
-             		     format='NETCDF4')
-		
-		
-		# adjust file for using CDO
-		fh = netCDF4.Dataset(savepath, 'r+')
-
-		# fix xc attributes
-		fh.variables['xc'].long_name = "longitude of grid cell center"
-		fh.variables['xc'].units = "degrees_east"
-
-		# fix yc attributes
-		fh.variables['yc'].long_name = "latitude of grid cell center"
-		fh.variables['yc'].units = "degrees_north"
-
-		fh.variables[key].coordinates = "xc yc"
-
-		fh.close()
+		convert_geotiff(file, key, savepath)
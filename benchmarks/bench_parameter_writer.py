@@ -0,0 +1,75 @@
+#!/bin/env python
+
+'''
+benchmark of the compact parameter file writer (`write_parameters(..., compact=True)`: zlib with
+shuffle, one chunk per (nj, ni) field, float32 for COMPACT_FLOAT32) against the current
+writer (`parameter_encoding`, uncompressed). reports file size and write time of both and the
+largest change of any value.
+
+rewrites an existing parameter file if one is given, otherwise a synthetic parameter file with
+piecewise constant fields and ~40% masked (ocean) gridcells.
+
+usage: python benchmarks/bench_parameter_writer.py [parameter_file.nc | nj ni]
+'''
+
+import os
+import sys
+import tempfile
+import numpy as np
+import xarray as xr
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+from parameter_functions import (create_parameter_dataset, fill_parameter, write_parameters,
+                                 compact_parameter_encoding, PARAMETER_SCHEMA)
+
+def synthetic_parameters(nj, ni, num_veg=17):
+    rng = np.random.default_rng(0)
+    yc, xc = np.meshgrid(np.linspace(50, 85, nj), np.linspace(-180, 180, ni), indexing='ij')
+    mask = (np.sin(np.deg2rad(xc) * 3) + np.cos(np.deg2rad(yc) * 5) > -0.4).astype(np.int32)
+    corners = np.stack([xc] * 4, axis=-1), np.stack([yc] * 4, axis=-1)
+    domain = xr.Dataset({'mask': (('nj', 'ni'), mask), 'xc': (('nj', 'ni'), xc), 'yc': (('nj', 'ni'), yc),
+                         'xv': (('nj', 'ni', 'nv'), corners[0]), 'yv': (('nj', 'ni', 'nv'), corners[1])})
+    old_params = xr.Dataset({'month': ('month', np.arange(1, 13))})
+    params = create_parameter_dataset(domain, old_params, nj, ni, num_veg, True, True, True)
+    for name in params.data_vars:
+        if name not in PARAMETER_SCHEMA:
+            continue
+        # nearest neighbour regridded inputs are piecewise constant, blocks of 4 x 4 gridcells
+        shape = params[name].shape
+        coarse = rng.uniform(0, 100, shape[:-2] + (-(-nj // 4), -(-ni // 4)))
+        values = np.repeat(np.repeat(coarse, 4, axis=-2), 4, axis=-1)[..., :nj, :ni]
+        if PARAMETER_SCHEMA[name].dtype.startswith('i'):
+            values = np.round(values)
+        fill_parameter(params, name, np.where(mask == 1, values, np.nan))
+    fill_parameter(params, 'xc', xc)
+    fill_parameter(params, 'yc', yc)
+    return(params)
+
+if len(sys.argv) == 2:
+    params = xr.open_dataset(sys.argv[1], mask_and_scale=True).load()
+    print("rewriting %s" % sys.argv[1])
+else:
+    nj = int(sys.argv[1]) if len(sys.argv) > 2 else 205
+    ni = int(sys.argv[2]) if len(sys.argv) > 2 else 275
+    params = synthetic_parameters(nj, ni)
+    print("synthetic parameters on %d x %d grid" % (nj, ni))
+
+with tempfile.TemporaryDirectory() as tmp_dir:
+    legacy_file = os.path.join(tmp_dir, 'legacy.nc')
+    compact_file = os.path.join(tmp_dir, 'compact.nc')
+    legacy_size, legacy_time = write_parameters(params, legacy_file)
+    compact_size, compact_time = write_parameters(params, compact_file, compact=True)
+    print("current writer: %8.1f MB in %.2f s" % (legacy_size / 1e6, legacy_time))
+    print("compact writer: %8.1f MB in %.2f s" % (compact_size / 1e6, compact_time))
+    print("size ratio %.1fx, write time ratio %.1fx" % (legacy_size / compact_size, legacy_time / compact_time))
+
+    encoding = compact_parameter_encoding(params)
+    print("stored as float32: %s" % ", ".join(name for name, enc in encoding.items()
+                                              if name in PARAMETER_SCHEMA and enc['dtype'] == 'float32'
+                                              and PARAMETER_SCHEMA[name].dtype == 'f8'))
+    with xr.open_dataset(legacy_file) as legacy, xr.open_dataset(compact_file) as compact:
+        worst = max((float(np.nanmax(np.abs(compact[name].values - legacy[name].values) /
+                                     np.maximum(np.nanmax(np.abs(legacy[name].values)), 1e-300)))
+                     if np.isfinite(legacy[name].values).any() else 0.0, name)
+                    for name in legacy.data_vars if name in PARAMETER_SCHEMA)
+        print("largest change relative to the largest value: %.2g (%s)" % worst)
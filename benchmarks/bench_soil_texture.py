@@ -0,0 +1,45 @@
+#!/bin/env python
+
+'''
+benchmark of the vectorized soil texture classifier (`classify_soil_texture_array`) against the
+per-cell `classify_soil_texture` driven through np.vectorize, which is what
+xr.apply_ufunc(..., vectorize=True) does in initial_parameters.ipynb.
+
+usage: python benchmarks/bench_soil_texture.py [nj] [ni]
+'''
+
+import os
+import sys
+import time
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+from parameter_functions import classify_soil_texture, classify_soil_texture_array
+
+nlayer = 7
+nj = int(sys.argv[1]) if len(sys.argv) > 1 else 205
+ni = int(sys.argv[2]) if len(sys.argv) > 2 else 275
+
+# synthetic soil texture cubes that sum to 100 percent, with ~20% missing (ocean) cells
+rng = np.random.default_rng(0)
+fractions = rng.dirichlet((1.0, 1.0, 1.0), size=(nlayer, nj, ni)) * 100
+sand, clay, silt = [np.round(fractions[..., i]) for i in range(3)]
+ocean = rng.random((nj, ni)) < 0.2
+for arr in (sand, clay, silt):
+    arr[:, ocean] = np.nan
+
+print("classifying %d x %d x %d cells" % (nlayer, nj, ni))
+
+start = time.perf_counter()
+old = np.vectorize(classify_soil_texture)(sand, clay, silt)
+t_old = time.perf_counter() - start
+print("classify_soil_texture (np.vectorize): %.3f s" % t_old)
+
+start = time.perf_counter()
+new = classify_soil_texture_array(sand, clay, silt)
+t_new = time.perf_counter() - start
+print("classify_soil_texture_array:          %.3f s" % t_new)
+
+if not np.array_equal(old, new):
+    raise AssertionError("%d cells classified differently" % np.count_nonzero(old != new))
+print("identical classes, speedup %.0fx" % (t_old / t_new))
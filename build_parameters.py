@@ -0,0 +1,1065 @@
+#!/bin/env python
+'''
+builds the VIC 5 parameter file without the notebook, as a graph of stages:
+
+    convert -> regrid -> hydroclimate -> baseflow
+                      -> soil, veg, climate
+    soil, veg, climate, baseflow -> assemble -> write
+
+stages whose requirements are done run concurrently, and every stage reports its wall time.
+the convert, regrid and hydroclimate stages write their outputs to `output_dir`, so they can be
+skipped (--skip) once their outputs exist. the other stages start once they are done, on the
+regridded inputs opened beforehand (`open_inputs`).
+
+with --dask-workers the regridded inputs are opened in chunks of --chunk-size gridcells along nj
+and ni, and the soil, veg and climate derivations are computed chunk by chunk on a local pool of
+that many processes.
+
+with --land-only the land gridcells of the domain mask are gathered into a 1-D `landcell` dimension
+once, the soil, veg and climate derivations run on the land gridcells only, and the parameters
+are scattered back to (nj, ni) when they are written.
+
+with --memory-budget the domain is tiled into bands of rows (nj): convert, regrid and hydroclimate
+run on the whole domain, then the soil, veg, climate, baseflow and assemble stages run band by
+band (--band-workers bands at a time) and every band is written into its rows of the parameter
+file. the band size is the largest one whose bands fit in the memory budget.
+
+with --incremental the inputs of every parameter stage (regridded files, config options, lookup
+tables) are hashed and the hashes stored in the parameter file. a rebuild only runs the stages
+whose hashes changed and patches their parameters into the existing parameter file in place.
+
+usage: python build_parameters.py [--config regridding/regridding.cfg] [--skip convert regrid]
+                                  [--dask-workers N] [--chunk-size N] [--land-only]
+                                  [--memory-budget MB] [--band-workers N] [--incremental]
+'''
+
+import argparse
+import collections
+import configparser
+import glob
+import hashlib
+import os
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+import dask
+import netCDF4
+import numpy as np
+import pandas as pd
+import xarray as xr
+from xarray.backends.locks import HDF5_LOCK
+
+from parameter_functions import (classify_soil_texture_array, calculate_cv_pft, calculate_nveg,
+                                 calculate_veg_parameters, soil_layer_index, aggregate_soil_layers,
+                                 soil_class_lookup, read_soil_property_table, SOIL_PROPERTY_TABLE,
+                                 calculate_init_moist, calculate_baseflow_parameters, read_vic4_soil_file,
+                                 hydroclimate_class_index, scatter_hydroclimate_values,
+                                 create_parameter_dataset, fill_parameter, finalize_parameter_values,
+                                 validate_parameters, validate_soil_moisture, write_parameters,
+                                 write_parameters_zarr, export_parameters_netcdf, create_parameter_file,
+                                 write_parameter, selected_parameters, landcell_index, gather_landcells,
+                                 scatter_landcells, UNMASKED_PARAMETERS, parameter_bytes)
+import parameter_functions
+from regridding.regrid_datasets import regrid_datasets
+from regridding import regrid_cache
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+REGRID_DIR = os.path.join(REPO_DIR, 'regridding')
+
+CONVERT_SCRIPTS = [os.path.join(REPO_DIR, 'batch_convert_soilgrid_geotiff_to_netcdf.py'),
+                   os.path.join(REPO_DIR, 'batch_convert_worldclim_geotiffs_to_netcdfs.py')]
+HYDROCLIMATE_SCRIPTS = [os.path.join(REGRID_DIR, 'make_hydroclimate_classes.py')]
+
+# VIC layer thicknesses (m) of the first and third layer, the second layer depends on the
+# hydroclimate class (arid, temperate_dry, cold_dry_perma, cold_dry_noperma, cold_wds_ws_perma,
+# cold_wds_ws_noperma, cold_wds_cs_perma, cold_wds_cs_noperma, polar)
+LAYER1_DEPTH = 0.3
+LAYER3_DEPTH = 0.5
+LAYER2_DEPTHS = [2.0, 2.0, 0.5, 0.5, 2.0, 0.5, 1.1, 0.3, 0.3]
+INFILT = [0.05, 0.05, 0.3, 0.5, 0.3, 0.25, 0.3, 0.25, 0.35]
+
+NUM_VEG = 17
+
+# SoilGrids variables and the wildcard of their regridded layers in `output_dir`
+SOIL_DATA_VARS = collections.OrderedDict([('silt', 'silt_sl*'), ('sand', 'sand_sl*'), ('clay', 'clay_sl*'),
+                                          ('bulk_density', 'bulk_density_sl*'),
+                                          ('organic_fract', 'organic_fract_sl*')])
+
+# bytes held per band relative to the bytes of its parameters, for the regridded inputs
+# (veg cubes, soil layers) and the intermediates held alongside them. the measured peak
+# (tracemalloc) of a streamed band of a 20 x 30 domain is about 2.2 to 2.4 times its parameters,
+# 3 leaves a safety margin of about a quarter for larger domains and allocator overhead
+BAND_MEMORY_FACTOR = 3
+
+Stage = collections.namedtuple('Stage', ['name', 'func', 'requires', 'writes_files'])
+
+def load_context(config_file, workers=4, chunk_size=None, compact=False, zarr=False, stream=False,
+                 land_only=False):
+    '''
+    takes in path to the config file, number of workers, the chunk size (gridcells along nj
+    and ni, None to not chunk) of the regridded inputs, whether to write a compact parameter
+    file, whether to write it through a Zarr store, whether to stream the parameters to it and
+    whether to compute on the land gridcells only, and returns dict of everything the stages
+    share: config, domain, grid specs and options
+    '''
+    config = configparser.ConfigParser()
+    if not config.read(config_file):
+        raise IOError("could not read config file %s" % config_file)
+
+    specs = config['Parameter Specs']
+    domain = xr.open_dataset(os.path.join(specs['domain_file_dir'], specs['domain_file']))
+
+    context = {'config': config,
+               'config_dir': os.path.dirname(os.path.abspath(config_file)),
+               'res': specs['res'],
+               'grid': specs['grid'],
+               'output_dir': specs['output_dir'],
+               'organic_fract': config.getboolean('Options', 'organic_fract'),
+               'max_snow_albedo': config.getboolean('Options', 'max_snow_albedo'),
+               'bulk_density_comb': config.getboolean('Options', 'bulk_density_comb'),
+               'workers': workers,
+               'chunks': {'nj': chunk_size, 'ni': chunk_size} if chunk_size else None,
+               'compact': compact,
+               'zarr': zarr,
+               'stream': None,
+               'inputs': None}
+    context.update(domain_context(domain, land_only))
+    if land_only:
+        print("computing on %d land gridcells out of %d" % (len(context['landcells'][0]),
+                                                           context['nj'] * context['ni']))
+    context['old_params'] = xr.open_dataset(os.path.join(config['Other']['dir'],
+                                                         config['Other']['old_param_filename']))
+    if stream:
+        open_stream(context)
+    return(context)
+
+def domain_context(domain, land_only=False, band=None):
+    '''
+    takes in domain DataSet, whether to compute on the land gridcells only and the rows (slice
+    along nj) of a band of the domain, and returns the domain entries of the context of the
+    domain or of its band
+    '''
+    if band is not None:
+        domain = domain.isel(nj=band)
+    # land-only mode: the stages hold the masked parameters on the land gridcells only
+    landcells = landcell_index(domain['mask'].values) if land_only else None
+    masknan_vals = domain['mask'].where(domain['mask'] == 1).values
+    if land_only:
+        masknan_vals = gather_landcells(masknan_vals, landcells)
+    return({'domain': domain,
+            'band': band,
+            'landcells': landcells,
+            'grid_dims': ('landcell',) if land_only else ('nj', 'ni'),
+            'masknan_vals': masknan_vals,
+            'nj': len(domain.nj),
+            'ni': len(domain.ni)})
+
+def select_band(context, values):
+    '''
+    tiled mode: takes in Dataset, DataArray or numpy array (..., nj, ni) on the whole domain and
+    returns the rows of the band of the context. otherwise returns the values
+    '''
+    band = context['band']
+    if band is None:
+        return(values)
+    if isinstance(values, (xr.Dataset, xr.DataArray)):
+        return(values.isel(nj=band))
+    return(np.asarray(values)[..., band, :])
+
+def regridded_file(context, section, option, suffix=None):
+    '''
+    takes in context, config section and option of an input file name and returns path of its
+    regridded file in the output directory
+    '''
+    filename, fileext = os.path.splitext(context['config'][section][option])
+    if suffix is None:
+        return(os.path.join(context['output_dir'], '%s_%s.nc' % (filename, context['grid'])))
+    return(os.path.join(context['output_dir'], '%s_%s_%s.nc' % (filename, context['grid'], suffix)))
+
+def parameter_filename(context):
+    '''
+    path of the parameter file in `output_dir`, named after the grid and the options
+    '''
+    if context['organic_fract'] and context['bulk_density_comb'] and context['max_snow_albedo']:
+        option_name = "all_options"
+    elif (not context['organic_fract']) and context['bulk_density_comb'] and (not context['max_snow_albedo']):
+        option_name = "bulk_density"
+    else:
+        option_name = "no_options"
+    filename = 'new_vic5_params_%s_%s.nc' % (context['grid'], option_name)
+    return(os.path.join(context['output_dir'], filename))
+
+def open_stream(context):
+    '''
+    streaming mode: creates the parameter file (under a temporary name) from the schema up front,
+    the stages then write their parameters to it as soon as they are computed with `stream_parameters`.
+    writes hold the HDF5 lock of xarray, as HDF5 can't write one file while other threads read others
+    '''
+    filename = parameter_filename(context)
+    tmp_file = filename + '.tmp'
+    context['stream'] = {'filename': filename, 'tmp_file': tmp_file, 'lock': HDF5_LOCK,
+                         'written': set(),
+                         'file': create_parameter_file(tmp_file, context['domain'], context['old_params'],
+                                                       context['nj'], context['ni'], NUM_VEG,
+                                                       context['organic_fract'], context['max_snow_albedo'],
+                                                       context['bulk_density_comb'], compact=context['compact'])}
+
+def gather_land(context, values):
+    '''
+    land-only mode: gathers the land gridcells of a DataArray or numpy array (..., nj, ni) to
+    (..., landcell). otherwise, or if the values are already gathered, returns the values
+    '''
+    if context['landcells'] is None or 'landcell' in getattr(values, 'dims', ()):
+        return(values)
+    return(gather_landcells(values, context['landcells']))
+
+def mask_land(context, da):
+    '''
+    takes in DataArray (..., nj, ni) and returns it NaN outside of the domain mask, or only its
+    land gridcells in land-only mode
+    '''
+    if context['landcells'] is not None:
+        return(gather_land(context, da))
+    return(da.where(context['domain'].mask == 1))
+
+def grid_values(context, name, values):
+    '''
+    land-only mode: scatters the gathered values of parameter `name` back to (..., nj, ni), NaN outside
+    of the land gridcells. parameters that keep their values outside of the mask (UNMASKED_PARAMETERS)
+    are held on the full grid throughout and returned as they are
+    '''
+    if context['landcells'] is None or name in UNMASKED_PARAMETERS:
+        return(values)
+    return(scatter_landcells(values, context['landcells'], context['nj'], context['ni']))
+
+def stream_parameters(context, parameters, keep=(), stage=None):
+    '''
+    in streaming mode writes the OrderedDict of parameters of `stage` to the parameter file and
+    returns only the ones in `keep`, so the arrays of the others are released. otherwise returns
+    the parameters. incremental rebuilds only write the parameters of the stages in
+    context['stream']['stages']
+    '''
+    stream = context['stream']
+    if stream is None:
+        return(parameters)
+    mask = context['domain']['mask'].values
+    patch = stream.get('stages') is None or stage in stream['stages']
+    with stream['lock']:
+        for name in list(parameters):
+            if not patch:
+                if name not in keep:
+                    del parameters[name]
+                continue
+            write_parameter(stream['file'], name, grid_values(context, name, parameters[name]), mask,
+                            rows=context['band'])
+            stream['written'].add(name)
+            if name not in keep:
+                del parameters[name]
+    return(parameters)
+
+def open_inputs(context):
+    '''
+    opens the regridded inputs of the soil, veg, climate and baseflow stages, in chunks along nj/ni
+    if context['chunks'] is set, and keeps them in context['inputs']. the inputs are opened lazily
+    on the calling thread once the stages that write files are done, before the other stages run
+    in threads: HDF5 is not thread-safe, and xarray only holds its HDF5 lock to read the values of
+    a file, not to read its attributes when opening it. the stages (and bands) then share the
+    opened inputs
+    '''
+    output_dir = context['output_dir']
+    chunks = context['chunks']
+    inputs = {'soil': {}}
+    # soil data with nlayer = 7 (base resolution of data)
+    for soil_var, soil_wildcard in SOIL_DATA_VARS.items():
+        # nested combine concatenates in the order given, sl1 to sl7
+        soil_files = sorted(glob.glob(os.path.join(output_dir, soil_wildcard)))
+        inputs['soil'][soil_var] = xr.open_mfdataset(soil_files,
+                                                     combine='nested',
+                                                     concat_dim='nlayer',
+                                                     data_vars='all',
+                                                     coords='all',
+                                                     chunks=chunks)[soil_var]
+
+    inputs['pfts'] = xr.open_dataset(regridded_file(context, 'PFTs', 'filename'), chunks=chunks)
+    inputs['lai'] = xr.open_dataset(regridded_file(context, 'Vegetation', 'lai_filename', 'lai'),
+                                    chunks=chunks)
+    inputs['veg_height'] = xr.open_dataset(regridded_file(context, 'Vegetation', 'veg_height_filename',
+                                                          'veg_height'), chunks=chunks)
+
+    inputs['gtopo'] = xr.open_dataset(regridded_file(context, 'GTOPO', 'filename'), chunks=chunks)
+    # nested combine concatenates in the order given, January to December
+    inputs['prec'] = xr.open_mfdataset(sorted(glob.glob(os.path.join(output_dir, 'prec*'))),
+                                       combine='nested',
+                                       concat_dim='time',
+                                       data_vars=['prec'],
+                                       coords='all',
+                                       chunks=chunks)
+    inputs['temp'] = xr.open_mfdataset(sorted(glob.glob(os.path.join(output_dir, 'tavg*'))),
+                                       combine='nested',
+                                       concat_dim='time',
+                                       data_vars='all',
+                                       coords='all',
+                                       chunks=chunks)
+    if context['res'] != "50km":
+        inputs['off_gmt'] = xr.open_dataset(regridded_file(context, 'Other', 'gmt_regrid_filename'),
+                                            chunks=chunks)
+
+    inputs['hydro_classes'] = xr.open_dataset(os.path.join(output_dir, 'hydroclimate_masks_%s.nc'
+                                                           % context['grid']))
+    context['inputs'] = inputs
+    return(inputs)
+
+def compute_values(arrays):
+    '''
+    takes in OrderedDict of (lazy) DataArrays and computes them in one pass, so inputs they share are
+    read once and their chunks run in parallel. returns OrderedDict of numpy arrays
+    '''
+    computed = dask.compute(*arrays.values())
+    return(collections.OrderedDict((name, np.asarray(values)) for name, values in zip(arrays, computed)))
+
+def run_scripts(context, scripts):
+    '''
+    runs python scripts concurrently from the config directory (the scripts read
+    `regridding.cfg` relative to the working directory), raises RuntimeError if any fails
+    '''
+    def run_script(script):
+        start = time.time()
+        returncode = subprocess.call([sys.executable, script], cwd=context['config_dir'])
+        print("   %s finished in %.1f s" % (os.path.basename(script), time.time() - start))
+        return(returncode)
+
+    with ThreadPoolExecutor(max_workers=context['workers']) as executor:
+        returncodes = list(executor.map(run_script, scripts))
+    failed = [os.path.basename(script) for script, returncode in zip(scripts, returncodes)
+              if returncode != 0]
+    if failed:
+        raise RuntimeError("failed scripts: %s" % ", ".join(failed))
+    return({})
+
+def convert_stage(context, results):
+    '''
+    converts the SoilGrids and WorldClim GeoTiffs to NetCDF, nothing to do when the regrid
+    stage reads the GeoTiffs directly (`read_geotiffs` in [Parameter Specs])
+    '''
+    if context['config'].getboolean('Parameter Specs', 'read_geotiffs', fallback=False):
+        print("   GeoTiffs are read directly by the regrid stage, nothing to convert")
+        return({})
+    return(run_scripts(context, CONVERT_SCRIPTS))
+
+def regrid_stage(context, results):
+    '''
+    regrids all input datasets to the domain on a pool of worker processes
+    '''
+    regrid_datasets(context['config'], workers=context['workers'])
+    return({})
+
+def hydroclimate_stage(context, results):
+    '''
+    makes the hydroclimate class masks from Koppen-Geiger and Brown permafrost data. with a regrid
+    cache (`regrid_cache_dir` in [Parameter Specs]) the masks are restored from the cache if the
+    regridded Koppen-Geiger and Brown files, the domain and the script are unchanged, and stored
+    in the cache otherwise
+    '''
+    config = context['config']
+    specs = config['Parameter Specs']
+    cache_dir = specs.get('regrid_cache_dir')
+    if cache_dir is None:
+        return(run_scripts(context, HYDROCLIMATE_SCRIPTS))
+
+    masks_file = os.path.join(context['output_dir'], 'hydroclimate_masks_%s.nc' % context['grid'])
+    domain_file = os.path.join(specs['domain_file_dir'], specs['domain_file'])
+    sources = [regridded_file(context, 'Hydroclimate', 'koppen_filename'),
+               regridded_file(context, 'Hydroclimate', 'brown_filename')]
+    os.makedirs(cache_dir, exist_ok=True)
+    stats = regrid_cache.cache_stats()
+    hashes = regrid_cache.source_hashes(cache_dir, sources + [domain_file])
+    key = regrid_cache.script_key(HYDROCLIMATE_SCRIPTS[0], [hashes[source] for source in sources],
+                                  hashes[domain_file])
+    if regrid_cache.restore_cached(cache_dir, key, masks_file, stats):
+        print("   hydroclimate masks restored from the regrid cache")
+        return({})
+
+    run_scripts(context, HYDROCLIMATE_SCRIPTS)
+    regrid_cache.store_cached(cache_dir, key, masks_file, stats)
+    regrid_cache.evict_cached(cache_dir, config.getfloat('Parameter Specs', 'regrid_cache_size',
+                                                         fallback=regrid_cache.DEFAULT_CACHE_SIZE_GB) * 1e9,
+                              stats)
+    return({})
+
+def soil_property_table(config):
+    '''
+    the soil property table of `property_table` in [Soil Data], SOIL_PROPERTY_TABLE if not set
+    '''
+    if config.has_option('Soil Data', 'property_table'):
+        return(read_soil_property_table(config['Soil Data']['property_table']))
+    return(SOIL_PROPERTY_TABLE)
+
+def soil_stage(context, results):
+    '''
+    classifies the soil texture of the SoilGrids layers and looks up the soil properties
+    of each soil class
+    '''
+    config = context['config']
+
+    # soil data with nlayer = 7 (base resolution of data)
+    soil_data = {}
+    for soil_var, values in context['inputs']['soil'].items():
+        soil_data[soil_var] = gather_land(context, select_band(context, values))
+
+    soil_type = classify_soil_texture_array(mask_land(context, soil_data['sand']),
+                                            mask_land(context, soil_data['clay']),
+                                            mask_land(context, soil_data['silt']))
+
+    soil_properties = soil_class_lookup(soil_type, table=soil_property_table(config))
+    return({'soil_data': soil_data, 'soil_properties': soil_properties})
+
+def veg_stage(context, results):
+    '''
+    derives the vegetation parameters from the CLM PFTs, LAI and vegetation height
+    '''
+    old_params = context['old_params']
+
+    inputs = context['inputs']
+    veg_data = select_band(context, inputs['pfts'])
+    pct_pft = mask_land(context, veg_data['PCT_PFT'])
+    # calculate_cv_pft is elementwise, so it runs on whole chunks
+    cv = xr.apply_ufunc(calculate_cv_pft, pct_pft, dask='parallelized', output_dtypes=[np.float64])
+
+    lazy = collections.OrderedDict()
+    lazy['Cv'] = cv
+    lazy['Nveg'] = calculate_nveg(pct_pft, pft_dim='pft')
+
+    # LAI and veg height have one PFT less than PCT_PFT, the 0th PFT is used for the last one
+    lai_file = select_band(context, inputs['lai'])
+    veg_height_file = select_band(context, inputs['veg_height'])
+    lai = gather_land(context, lai_file['MONTHLY_LAI'])
+    lai = xr.concat([lai, lai.isel(pft=0)], dim='pft')
+    veg_height = gather_land(context, veg_height_file['MONTHLY_HEIGHT_TOP'])
+    veg_height = xr.concat([veg_height, veg_height.isel(pft=0)], dim='pft')
+    veg_rough = 0.123 * veg_height
+    displacement = 0.67 * veg_height
+    displacement = displacement.where(displacement != 0, 1.0)
+
+    for name, values in (('LAI', lai), ('displacement', displacement), ('veg_rough', veg_rough)):
+        values = values.rename({'time': 'month', 'pft': 'veg_class'})
+        lazy[name] = values.transpose('veg_class', 'month', *context['grid_dims'])
+    parameters = compute_values(lazy)
+
+    # uniform veg parameters, bare soil (PFT 0) differs
+    masknan_vals = context['masknan_vals']
+    veg_ones = np.broadcast_to(masknan_vals, (NUM_VEG,) + masknan_vals.shape)
+    for name, value, bare_soil_value in (('trunk_ratio', 0.2, 0.0), ('rarc', 60, 100),
+                                         ('rad_atten', 0.5, 0.0), ('wind_atten', 0.5, 0.0)):
+        parameters[name] = veg_ones * value
+        parameters[name][0] = bare_soil_value
+
+    veg_params = calculate_veg_parameters(xr.DataArray(parameters['Cv'],
+                                                       dims=('veg_class',) + context['grid_dims']),
+                                          old_params)
+    veg_param_vars = ['rmin', 'wind_h', 'RGL', 'overstory', 'root_depth', 'root_fract', 'albedo']
+    if context['max_snow_albedo']:
+        veg_param_vars.append('max_snow_albedo')
+    for name in veg_param_vars:
+        parameters[name] = veg_params[name].values
+    return({'parameters': stream_parameters(context, parameters, stage='veg')})
+
+def climate_stage(context, results):
+    '''
+    elevation from GTOPO, annual precipitation and average temperature from WorldClim and off_gmt
+    '''
+    lazy = collections.OrderedDict()
+
+    inputs = context['inputs']
+    gtopo = select_band(context, inputs['gtopo'])
+    lazy['elev'] = gather_land(context, gtopo['Band1'])
+
+    lazy['avg_T'] = gather_land(context, select_band(context, inputs['temp']['tavg'])).mean('time')
+    lazy['annual_prec'] = gather_land(context, select_band(context, inputs['prec']['prec'])).sum('time')
+
+    if context['res'] == "50km":
+        lazy['off_gmt'] = select_band(context, context['old_params']['off_gmt'])
+    else:
+        off_gmt = select_band(context, inputs['off_gmt'])
+        lazy['off_gmt'] = off_gmt['off_gmt']
+    return({'parameters': stream_parameters(context, compute_values(lazy), stage='climate')})
+
+def baseflow_stage(context, results):
+    '''
+    baseflow parameters, infiltration and soil layer depths from the hydroclimate classes
+    '''
+    config = context['config']
+    domain = context['domain']
+    masknan_vals = context['masknan_vals']
+
+    hydro_classes = select_band(context, context['inputs']['hydro_classes'])
+    hydro_class_index = hydroclimate_class_index(hydro_classes)
+
+    parameters = collections.OrderedDict()
+    baseflow = calculate_baseflow_parameters(domain, config['Soil Data']['ascii_dir'],
+                                             config['Soil Data']['ascii_filename'], hydro_classes,
+                                             cache_dir=context['output_dir'])
+    for name in baseflow.data_vars:
+        parameters[name] = gather_land(context, baseflow[name].values)
+    parameters['infilt'] = gather_land(context, scatter_hydroclimate_values(domain, hydro_class_index,
+                                                                           INFILT))
+    layer2_depth = scatter_hydroclimate_values(domain, hydro_class_index, LAYER2_DEPTHS)
+    parameters['depth'] = np.stack([masknan_vals * LAYER1_DEPTH,
+                                    gather_land(context, layer2_depth),
+                                    masknan_vals * LAYER3_DEPTH])
+    # the soil layer depths are needed to aggregate the soil layers
+    return({'parameters': stream_parameters(context, parameters, keep=['depth'], stage='baseflow')})
+
+def assemble_stage(context, results):
+    '''
+    aggregates the soil properties to the VIC layers, derives the remaining soil and grid cell
+    parameters and fills the parameter DataSet
+    '''
+    domain = context['domain']
+    old_params = context['old_params']
+    masknan_vals = context['masknan_vals']
+    nj, ni = context['nj'], context['ni']
+    soil_data = results['soil']['soil_data']
+    soil_properties = results['soil']['soil_properties']
+
+    parameters = collections.OrderedDict()
+    for stage in ('veg', 'climate', 'baseflow'):
+        parameters.update(results[stage]['parameters'])
+
+    # aggregate soil properties to the VIC layers
+    soil_depths = xr.DataArray(parameters['depth'], dims=('nlayer',) + context['grid_dims']).sum(axis=0)
+    # bands don't cache the index, its cache files would be keyed on the depths of every band
+    soil_layer_idx = soil_layer_index(soil_depths,
+                                      cache_dir=context['output_dir'] if context['band'] is None else None)
+    ksat = aggregate_soil_layers(soil_properties['ksat'], soil_depths, mean='harmonic',
+                                 layer_index=soil_layer_idx)
+
+    soil_layer_vars = collections.OrderedDict()
+    for soil_property in ('bulk_density', 'b', 'resid_moist', 'Wcr_FRACT', 'Wpwp_FRACT', 'quartz'):
+        soil_layer_vars[soil_property] = soil_properties[soil_property]
+    if context['bulk_density_comb']:
+        soil_layer_vars['bulk_density_comb'] = soil_data['bulk_density']
+    if context['organic_fract']:
+        soil_layer_vars['organic_fract'] = soil_data['organic_fract']
+    soil_layer_cube = xr.concat(list(soil_layer_vars.values()), dim='soil_property')
+    soil_layer_cube.coords['soil_property'] = list(soil_layer_vars.keys())
+    layer_means = aggregate_soil_layers(soil_layer_cube, soil_depths, mean='arithmetic',
+                                        layer_index=soil_layer_idx)
+    # classify, look up and aggregate the soil layers in one pass over the soil data
+    ksat, layer_means = dask.compute(ksat, layer_means)
+    parameters['Ksat'] = ksat.values
+
+    parameters['bulk_density'] = layer_means.sel(soil_property='bulk_density').values
+    parameters['expt'] = (layer_means.sel(soil_property='b').values * 2) + 3
+    parameters['bubble'] = (parameters['expt'] * 0.32) + 4.3
+    parameters['resid_moist'] = layer_means.sel(soil_property='resid_moist').values
+    parameters['quartz'] = layer_means.sel(soil_property='quartz').values
+    if context['bulk_density_comb']:
+        parameters['bulk_density_comb'] = layer_means.sel(soil_property='bulk_density_comb').values
+    if context['organic_fract']:
+        parameters['organic'] = layer_means.sel(soil_property='organic_fract').values / 1000
+        parameters['soil_density_org'] = np.broadcast_to(masknan_vals * 1300.0, (3,) + masknan_vals.shape)
+    parameters['soil_density'] = np.broadcast_to(masknan_vals * 2685.0, (3,) + masknan_vals.shape)
+
+    # porosity, with the soil density as it is stored (float32)
+    soil_density = parameters['soil_density'].astype(np.float32)
+    if context['bulk_density_comb']:
+        porosity = 1 - (parameters['bulk_density_comb'] / soil_density)
+    else:
+        porosity = 1 - (parameters['bulk_density'] / soil_density)
+    parameters['Wpwp_FRACT'] = layer_means.sel(soil_property='Wpwp_FRACT').values / porosity
+    parameters['Wcr_FRACT'] = layer_means.sel(soil_property='Wcr_FRACT').values / porosity
+    # fully saturated initial moisture, the third layer uses the porosity of the second layer
+    parameters['init_moist'] = calculate_init_moist(porosity[[0, 1, 1]], parameters['depth'])
+
+    parameters['rough'] = masknan_vals * 0.001
+    parameters['phi_s'] = np.broadcast_to(masknan_vals * float(old_params['phi_s'].mean()),
+                                          (3,) + masknan_vals.shape)
+    # frozen soils are active for all gridcells
+    parameters['fs_active'] = domain['mask'].values
+    parameters['dp'] = masknan_vals * float(old_params['dp'].mean())
+    parameters['snow_rough'] = masknan_vals * 0.0024
+
+    parameters['run_cell'] = masknan_vals
+    parameters['mask'] = domain['mask'].values
+    if context['res'] == "50km":
+        parameters['gridcell'] = gather_land(context, select_band(context, old_params['gridcell'].values))
+        parameters['lons'] = mask_land(context, select_band(context, old_params['lons'])).values
+    else:
+        # gridcells are numbered on the whole domain
+        first_row = context['band'].start if context['band'] is not None else 0
+        gridcell = np.arange(first_row * ni + 1, (first_row + nj) * ni + 1, dtype='int32').reshape(nj, ni)
+        parameters['gridcell'] = gather_land(context, gridcell)
+        parameters['lons'] = mask_land(context, domain['xc']).values
+    parameters['lats'] = mask_land(context, domain['yc']).values
+    if context['stream'] is not None:
+        # the parameter file is only moved to its name once every parameter was written, so
+        # checking before the last group is written keeps invalid parameters out of it
+        validate_soil_moisture(parameters['depth'], porosity, parameters['Wcr_FRACT'],
+                               parameters['Wpwp_FRACT'], parameters['resid_moist'])
+        # the baseflow stage wrote the depths already, they were only kept to aggregate the soil layers
+        del parameters['depth']
+        stream_parameters(context, parameters, stage='assemble')
+        return({})
+
+    params = create_parameter_dataset(domain, old_params, nj, ni, NUM_VEG, context['organic_fract'],
+                                      context['max_snow_albedo'], context['bulk_density_comb'],
+                                      lazy=True)
+    for name, values in parameters.items():
+        fill_parameter(params, name, grid_values(context, name, values))
+        fill_parameter(params, name, finalize_parameter_values(name, params[name].values,
+                                                               domain['mask'].values))
+    fill_parameter(params, 'xc', domain['xc'].values)
+    fill_parameter(params, 'yc', domain['yc'].values)
+
+    validate_parameters(params, context['organic_fract'], context['max_snow_albedo'],
+                        context['bulk_density_comb'])
+    return({'params': params})
+
+def write_stage(context, results):
+    '''
+    writes the parameter DataSet to `output_dir`, compressed and chunked with float32 where the
+    precision allows if context['compact'] is set. if context['zarr'] is set the parameters are
+    first written to a Zarr store next to it in parallel chunks, and the NetCDF file is exported
+    from the store
+    '''
+    new_params_file = parameter_filename(context)
+    if context['stream'] is not None:
+        return(close_stream(context))
+    params = results['assemble']['params']
+    if context['zarr']:
+        store = os.path.splitext(new_params_file)[0] + '.zarr'
+        size, elapsed = write_parameters_zarr(params, store, compact=context['compact'],
+                                              chunk_size=context['chunks']['nj'] if context['chunks'] else None,
+                                              workers=context['workers'])
+        print("saved new parameters to %s (%.1f MB in %.1f s)" % (store, size / 1e6, elapsed))
+        size, elapsed = export_parameters_netcdf(store, new_params_file, compact=context['compact'])
+    else:
+        size, elapsed = write_parameters(params, new_params_file, compact=context['compact'])
+    print("saved new parameters to %s (%.1f MB in %.1f s)" % (new_params_file, size / 1e6, elapsed))
+    return({'filename': new_params_file})
+
+def close_stream(context):
+    '''
+    streaming mode: checks that every parameter was written, closes the parameter file and moves it
+    to its name. raises ValueError listing the parameters that were not written
+    '''
+    stream = context['stream']
+    stream['file'].close()
+    missing = [name for name in selected_parameters(context['organic_fract'], context['max_snow_albedo'],
+                                                    context['bulk_density_comb'])
+               if name not in stream['written']]
+    if missing:
+        raise ValueError("invalid parameters: %s not written" % ", ".join(missing))
+    os.replace(stream['tmp_file'], stream['filename'])
+    print("saved new parameters to %s (%.1f MB, streamed)" % (stream['filename'],
+                                                            os.path.getsize(stream['filename']) / 1e6))
+    return({'filename': stream['filename']})
+
+STAGES = collections.OrderedDict((stage.name, stage) for stage in [
+    Stage('convert', convert_stage, [], True),
+    Stage('regrid', regrid_stage, ['convert'], True),
+    Stage('hydroclimate', hydroclimate_stage, ['regrid'], True),
+    Stage('soil', soil_stage, ['regrid'], False),
+    Stage('veg', veg_stage, ['regrid'], False),
+    Stage('climate', climate_stage, ['regrid'], False),
+    Stage('baseflow', baseflow_stage, ['hydroclimate'], False),
+    Stage('assemble', assemble_stage, ['soil', 'veg', 'climate', 'baseflow'], False),
+    Stage('write', write_stage, ['assemble'], False)])
+# tiled mode: the stages that run on the whole domain, and the ones that run band by band
+GRID_STAGES = collections.OrderedDict((name, stage) for name, stage in STAGES.items() if stage.writes_files)
+BAND_STAGES = collections.OrderedDict((name, stage) for name, stage in STAGES.items() if name != 'write')
+
+def run_stages(context, stages, skip=()):
+    '''
+    runs the stages as soon as their requirements are done, up to context['workers'] at a time.
+    skipped stages count as done. the stages that don't write files read the inputs opened by
+    `open_inputs`. returns dict of stage results and dict of stage wall times (s)
+    '''
+    for name in skip:
+        if not stages[name].writes_files:
+            raise ValueError("stage %s keeps its results in memory and can't be skipped" % name)
+
+    done = set(skip)
+    results = {}
+    timings = collections.OrderedDict()
+    running = {}
+    with ThreadPoolExecutor(max_workers=context['workers']) as executor:
+        while len(done) < len(stages):
+            for stage in stages.values():
+                if (stage.name not in done and stage.name not in running.values()
+                        and all(required in done for required in stage.requires)):
+                    print("starting stage %s" % stage.name)
+                    future = executor.submit(timed, stage.func, context, results)
+                    running[future] = stage.name
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                name = running.pop(future)
+                # re-raises the exception of a failed stage
+                results[name], timings[name] = future.result()
+                done.add(name)
+                print("finished stage %s in %.1f s" % (name, timings[name]))
+    return(results, timings)
+
+def run_grid_stages(context, skip=()):
+    '''
+    runs the stages that write files (GRID_STAGES) and opens their outputs for the other stages
+    (`open_inputs`). returns dict of stage results and dict of stage wall times (s) as `run_stages`
+    '''
+    results, timings = run_stages(context, GRID_STAGES, skip=skip)
+    _, timings['inputs'] = timed(open_inputs, context)
+    return(results, timings)
+
+def run_build(context, skip=()):
+    '''
+    runs all stages, the stages that write files first (`run_grid_stages`). returns dict of stage
+    results and dict of stage wall times (s) as `run_stages`
+    '''
+    results, timings = run_grid_stages(context, skip=skip)
+    build_results, build_timings = run_stages(context, STAGES, skip=GRID_STAGES.keys())
+    results.update(build_results)
+    timings.update(build_timings)
+    return(results, timings)
+
+def timed(func, *args):
+    '''
+    calls func with args and returns its result and wall time (s)
+    '''
+    start = time.time()
+    result = func(*args)
+    return(result, time.time() - start)
+
+# incremental rebuilds: the parameter stages whose results the parameters of a stage depend on
+# besides its own inputs (the assemble stage only passes the veg and climate parameters through),
+# and the lookup tables of parameter_functions every stage derives its parameters with
+PARAMETER_DEPENDENCIES = collections.OrderedDict([('soil', []), ('veg', []), ('climate', []), ('baseflow', []),
+                                                  ('assemble', ['soil', 'baseflow'])])
+STAGE_TABLES = {'soil': ['KSAT_UNITS_FACTOR'],
+                'veg': ['PFT_TO_NLDAS', 'NLDAS_ROOT_FRACT', 'ROOT_ZONE_DEPTHS', 'NLDAS_OVERSTORY',
+                        'NLDAS_ALBEDO', 'NLDAS_MAX_SNOW_ALBEDO', 'NLDAS_OLD_PARAMS', 'BARE_SOIL_SWAP_VARS',
+                        'BARE_SOIL_ZERO_VARS'],
+                'climate': [],
+                'baseflow': ['HYDROCLIMATE_DONOR_BOXES', 'BASEFLOW_PARAMETERS', 'VIC4_SOIL_COLUMNS'],
+                'assemble': ['SOIL_LAYER_D1', 'SOIL_LAYER_D3', 'SOIL_LAYER_BRANCHES']}
+# global attributes of the parameter file holding the input hash of each stage
+INPUT_HASH_PREFIX = 'input_hash_'
+
+def update_input_hash(key, value):
+    '''
+    updates the hashlib object `key` with a value: numpy arrays by their dtype, shape and bytes,
+    DataFrames by their values, containers item by item and anything else by its repr
+    '''
+    if isinstance(value, np.ndarray):
+        key.update(repr((value.dtype.str, value.shape)).encode())
+        key.update(np.ascontiguousarray(value).tobytes())
+    elif isinstance(value, pd.DataFrame):
+        key.update(value.to_csv().encode())
+    elif isinstance(value, dict):
+        for item in value.items():
+            update_input_hash(key, item)
+    elif isinstance(value, (list, tuple)):
+        key.update(b'(')
+        for item in value:
+            update_input_hash(key, item)
+        key.update(b')')
+    else:
+        key.update(repr(value).encode())
+
+def file_input_hash(filename):
+    '''
+    takes in path of an input file and returns sha1 hex digest of its contents. NetCDF files are hashed
+    by the names, dims, dtypes, attributes and raw values of their variables, without the global
+    attributes (CDO stamps its history with the time of the run), other files by their bytes
+    '''
+    key = hashlib.sha1()
+    if os.path.splitext(filename)[1] == '.nc':
+        with HDF5_LOCK, netCDF4.Dataset(filename) as fh:
+            fh.set_auto_maskandscale(False)
+            for name in sorted(fh.variables):
+                var = fh.variables[name]
+                update_input_hash(key, (name, var.dimensions, var.dtype.str,
+                                        sorted((attr, str(var.getncattr(attr))) for attr in var.ncattrs())))
+                update_input_hash(key, np.asarray(var[...]))
+    else:
+        with open(filename, 'rb') as f:
+            for block in iter(lambda: f.read(1 << 20), b''):
+                key.update(block)
+    return(key.hexdigest())
+
+def stage_inputs(context):
+    '''
+    takes in context and returns OrderedDict of the inputs of every parameter stage (in the order of
+    PARAMETER_DEPENDENCIES): dict of the list of its input files and the list of (name, value) of
+    the options, constants and lookup tables it uses
+    '''
+    config = context['config']
+    old_param_file = os.path.join(config['Other']['dir'], config['Other']['old_param_filename'])
+    if context['res'] == "50km":
+        off_gmt_file = old_param_file
+    else:
+        off_gmt_file = regridded_file(context, 'Other', 'gmt_regrid_filename')
+
+    inputs = collections.OrderedDict()
+    inputs['soil'] = {'files': [filename for wildcard in SOIL_DATA_VARS.values()
+                                for filename in sorted(glob.glob(os.path.join(context['output_dir'], wildcard)))],
+                      'values': [('property_table', soil_property_table(config))]}
+    inputs['veg'] = {'files': [regridded_file(context, 'PFTs', 'filename'),
+                               regridded_file(context, 'Vegetation', 'lai_filename', 'lai'),
+                               regridded_file(context, 'Vegetation', 'veg_height_filename', 'veg_height'),
+                               old_param_file],
+                     'values': [('max_snow_albedo', context['max_snow_albedo'])]}
+    inputs['climate'] = {'files': ([regridded_file(context, 'GTOPO', 'filename')] +
+                                   sorted(glob.glob(os.path.join(context['output_dir'], 'prec*'))) +
+                                   sorted(glob.glob(os.path.join(context['output_dir'], 'tavg*'))) +
+                                   [off_gmt_file]),
+                         'values': [('res', context['res'])]}
+    inputs['baseflow'] = {'files': [os.path.join(context['output_dir'], 'hydroclimate_masks_%s.nc' % context['grid']),
+                                    os.path.join(config['Soil Data']['ascii_dir'],
+                                                 config['Soil Data']['ascii_filename'])],
+                          'values': [('LAYER1_DEPTH', LAYER1_DEPTH), ('LAYER2_DEPTHS', LAYER2_DEPTHS),
+                                     ('LAYER3_DEPTH', LAYER3_DEPTH), ('INFILT', INFILT)]}
+    inputs['assemble'] = {'files': [old_param_file],
+                          'values': [('organic_fract', context['organic_fract']),
+                                     ('bulk_density_comb', context['bulk_density_comb']), ('res', context['res'])]}
+    for stage, stage_input in inputs.items():
+        stage_input['values'] += [(name, getattr(parameter_functions, name)) for name in STAGE_TABLES[stage]]
+    return(inputs)
+
+def stage_keys(context):
+    '''
+    takes in context and returns OrderedDict of the input hash of every parameter stage, over the
+    domain, its inputs (`stage_inputs`) and the hashes of the stages it depends on
+    (PARAMETER_DEPENDENCIES), and the hash of the layout of the parameter file ('layout')
+    '''
+    specs = context['config']['Parameter Specs']
+    file_hashes = {}
+    def file_key(filename):
+        if filename not in file_hashes:
+            file_hashes[filename] = file_input_hash(filename)
+        return(file_hashes[filename])
+
+    domain_key = file_key(os.path.join(specs['domain_file_dir'], specs['domain_file']))
+    keys = collections.OrderedDict()
+    for stage, stage_input in stage_inputs(context).items():
+        key = hashlib.sha1(stage.encode())
+        key.update(domain_key.encode())
+        for filename in stage_input['files']:
+            update_input_hash(key, (os.path.basename(filename), file_key(filename)))
+        update_input_hash(key, stage_input['values'])
+        for required in PARAMETER_DEPENDENCIES[stage]:
+            key.update(keys[required].encode())
+        keys[stage] = key.hexdigest()
+
+    key = hashlib.sha1(domain_key.encode())
+    update_input_hash(key, [(name, spec) for name, spec in selected_parameters(
+        context['organic_fract'], context['max_snow_albedo'], context['bulk_density_comb']).items()])
+    update_input_hash(key, (NUM_VEG, context['compact']))
+    keys['layout'] = key.hexdigest()
+    return(keys)
+
+def read_stage_keys(filename):
+    '''
+    takes in path of a parameter file and returns dict of the input hashes an incremental build
+    stored in it, empty if there is no such file or it has none
+    '''
+    if not os.path.exists(filename):
+        return({})
+    with HDF5_LOCK, netCDF4.Dataset(filename) as fh:
+        return({name[len(INPUT_HASH_PREFIX):]: fh.getncattr(name) for name in fh.ncattrs()
+                if name.startswith(INPUT_HASH_PREFIX)})
+
+def write_stage_keys(fh, keys):
+    '''
+    takes in parameter file open for writing and dict of input hashes and stores them in its
+    global attributes
+    '''
+    for stage, key in keys.items():
+        fh.setncattr(INPUT_HASH_PREFIX + stage, key)
+
+def unchanged_stage(context, results):
+    '''
+    incremental rebuilds: stands in for a stage whose inputs did not change, its parameters are
+    kept as they are in the parameter file
+    '''
+    return({'parameters': collections.OrderedDict()})
+
+def run_incremental(context, skip=()):
+    '''
+    incremental rebuild: runs the stages that write files (GRID_STAGES), hashes the inputs of every
+    parameter stage (`stage_keys`) and compares the hashes with the ones stored in the parameter file.
+    builds and writes all parameters if there is no parameter file with the same layout, otherwise
+    runs only the stages whose inputs changed (and the stages they depend on) and patches their
+    parameters into the parameter file in place. changes to the code of the stages are not tracked,
+    they need a full build. returns dict of stage results and dict of stage wall times (s) as `run_stages`
+    '''
+    results, timings = run_grid_stages(context, skip=skip)
+    filename = parameter_filename(context)
+    keys, timings['hash'] = timed(stage_keys, context)
+    stored = read_stage_keys(filename)
+
+    if stored.get('layout') != keys['layout']:
+        print("no parameters with the same layout in %s, building all parameters" % filename)
+        build_results, build_timings = run_stages(context, STAGES, skip=GRID_STAGES.keys())
+        results.update(build_results)
+        timings.update(build_timings)
+        with HDF5_LOCK, netCDF4.Dataset(filename, 'r+') as fh:
+            write_stage_keys(fh, keys)
+        return(results, timings)
+
+    changed = [stage for stage in PARAMETER_DEPENDENCIES if stored.get(stage) != keys[stage]]
+    if not changed:
+        print("parameters in %s are up to date" % filename)
+        return(results, timings)
+    needed = set(changed)
+    for stage in changed:
+        needed.update(PARAMETER_DEPENDENCIES[stage])
+    print("inputs of %s changed, patching their parameters in %s" % (", ".join(changed), filename))
+
+    fh = netCDF4.Dataset(filename, 'r+')
+    # an interrupted patch leaves the changed stages without hashes, so they are rebuilt next time
+    write_stage_keys(fh, {stage: '' for stage in changed})
+    fh.sync()
+    context['stream'] = {'filename': filename, 'tmp_file': None, 'lock': HDF5_LOCK, 'written': set(),
+                         'file': fh, 'stages': set(changed)}
+    stages = collections.OrderedDict((name, stage if name in needed or stage.writes_files
+                                      else stage._replace(func=unchanged_stage))
+                                     for name, stage in BAND_STAGES.items())
+    try:
+        patch_results, patch_timings = run_stages(context, stages, skip=GRID_STAGES.keys())
+        write_stage_keys(fh, keys)
+    finally:
+        fh.close()
+    results.update(patch_results)
+    timings.update(patch_timings)
+    results['write'] = {'filename': filename}
+    print("patched %s in %s" % (", ".join(sorted(context['stream']['written'])), filename))
+    return(results, timings)
+
+def band_rows(context, memory_budget, band_workers=1):
+    '''
+    takes in context, memory budget (bytes) and number of bands processed at the same time and
+    returns the largest number of rows (nj) per band so that the bands being processed fit in the
+    budget, see BAND_MEMORY_FACTOR. raises ValueError if not even bands of one row fit
+    '''
+    row_bytes = BAND_MEMORY_FACTOR * parameter_bytes(1, context['ni'], NUM_VEG, context['organic_fract'],
+                                                     context['max_snow_albedo'], context['bulk_density_comb'])
+    rows = int(memory_budget // (band_workers * row_bytes))
+    if rows < 1:
+        raise ValueError("memory budget of %.1f MB is too small for %d bands of one row (%.1f MB each)"
+                         % (memory_budget / 1e6, band_workers, row_bytes / 1e6))
+    return(min(rows, context['nj']))
+
+def run_bands(context, memory_budget, band_workers=1, skip=()):
+    '''
+    tiled mode: runs the stages that write files (GRID_STAGES) on the whole domain, then the soil,
+    veg, climate, baseflow and assemble stages (BAND_STAGES) on bands of rows of the domain,
+    `band_workers` bands at a time, with the band size from `band_rows`. every band writes its
+    rows of the parameter file, which is streamed (see `open_stream`). the derivations are per
+    gridcell (missing values are filled by the regridding, on the whole domain), so the bands
+    need no halo. returns dict of stage results and dict of stage wall times (s) as `run_stages`
+    '''
+    results, timings = run_grid_stages(context, skip=skip)
+    if context['stream'] is None:
+        open_stream(context)
+
+    rows = band_rows(context, memory_budget, band_workers)
+    bands = [slice(start, min(start + rows, context['nj'])) for start in range(0, context['nj'], rows)]
+    print("processing %d x %d grid in %d bands of up to %d rows, %d at a time"
+          % (context['nj'], context['ni'], len(bands), rows, band_workers))
+
+    # parse the VIC 4 soil file into its cache once, instead of in every band at the same time
+    config = context['config']
+    read_vic4_soil_file(os.path.join(config['Soil Data']['ascii_dir'], config['Soil Data']['ascii_filename']),
+                        cache_dir=context['output_dir'])
+
+    land_only = context['landcells'] is not None
+    def run_band(band):
+        band_context = dict(context)
+        band_context.update(domain_context(context['domain'], land_only, band))
+        (_, band_timings), elapsed = timed(run_stages, band_context, BAND_STAGES, GRID_STAGES.keys())
+        print("   rows %d to %d finished in %.1f s" % (band.start, band.stop - 1, elapsed))
+        return(band_timings)
+
+    start = time.time()
+    with ThreadPoolExecutor(max_workers=band_workers) as executor:
+        band_timings = list(executor.map(run_band, bands))
+    for band in band_timings:
+        for name, timing in band.items():
+            timings[name] = timings.get(name, 0.0) + timing
+    timings['bands'] = time.time() - start
+
+    results['write'], timings['write'] = timed(close_stream, context)
+    return(results, timings)
+
+def main():
+    parser = argparse.ArgumentParser(description="build VIC 5 parameters")
+    parser.add_argument('--config', default=os.path.join(REGRID_DIR, 'regridding.cfg'),
+                        help="config file (default: regridding/regridding.cfg)")
+    parser.add_argument('--skip', nargs='*', default=[], choices=[name for name, stage in STAGES.items()
+                                                                  if stage.writes_files],
+                        help="stages whose outputs already exist in output_dir")
+    parser.add_argument('--workers', type=int, default=4,
+                        help="number of stages or scripts that run at the same time")
+    parser.add_argument('--dask-workers', type=int, default=None,
+                        help="compute the derivations chunk by chunk on this many processes "
+                             "(default: in memory, without chunking)")
+    parser.add_argument('--chunk-size', type=int, default=128,
+                        help="gridcells along nj and ni per chunk with --dask-workers (default: 128)")
+    parser.add_argument('--compact', action='store_true',
+                        help="write the parameter file compressed, chunked per (nj, ni) field and with "
+                             "float32 where the precision allows")
+    parser.add_argument('--zarr', action='store_true',
+                        help="write the parameters to a Zarr store in parallel chunks first and export "
+                             "the NetCDF file from it")
+    parser.add_argument('--stream', action='store_true',
+                        help="create the parameter file up front and write every parameter group as soon "
+                             "as it is computed, instead of holding all of them until the end")
+    parser.add_argument('--land-only', action='store_true',
+                        help="compute the soil, veg and climate parameters on the land gridcells of the "
+                             "domain mask only, and scatter them back to the grid when they are written")
+    parser.add_argument('--memory-budget', type=float, default=None,
+                        help="process the domain in bands of rows that fit in this many MB, and write "
+                             "every band into its rows of the parameter file (default: whole domain)")
+    parser.add_argument('--band-workers', type=int, default=1,
+                        help="number of bands processed at the same time with --memory-budget (default: 1)")
+    parser.add_argument('--incremental', action='store_true',
+                        help="only rerun the stages whose inputs changed since the last --incremental "
+                             "build and patch their parameters into the existing parameter file")
+    args = parser.parse_args()
+    if args.stream and args.zarr:
+        parser.error("--stream writes the NetCDF file directly and can't be combined with --zarr")
+    if args.memory_budget and args.zarr:
+        parser.error("--memory-budget streams the bands to the NetCDF file and can't be combined with --zarr")
+    if args.incremental and (args.zarr or args.stream or args.memory_budget):
+        parser.error("--incremental patches the parameter file and can't be combined with --zarr, --stream "
+                     "or --memory-budget")
+
+    context = load_context(args.config, workers=args.workers,
+                           chunk_size=args.chunk_size if args.dask_workers else None,
+                           compact=args.compact, zarr=args.zarr, stream=args.stream,
+                           land_only=args.land_only)
+    print("calculating parameters at %s" % context['res'])
+
+    def run():
+        if args.incremental:
+            return(run_incremental(context, skip=args.skip))
+        if args.memory_budget:
+            return(run_bands(context, args.memory_budget * 1e6, band_workers=args.band_workers,
+                             skip=args.skip))
+        return(run_build(context, skip=args.skip))
+
+    start = time.time()
+    if args.dask_workers:
+        print("computing in %d x %d chunks on %d processes" % (args.chunk_size, args.chunk_size,
+                                                             args.dask_workers))
+        with dask.config.set(scheduler='processes', num_workers=args.dask_workers):
+            _, timings = run()
+    else:
+        _, timings = run()
+    for name, timing in timings.items():
+        print("%-12s %8.1f s" % (name, timing))
+    print("%-12s %8.1f s" % ("total", time.time() - start))
+
+if __name__ == "__main__":
+    main()
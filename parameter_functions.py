@@ -5,9 +5,15 @@ import os
 import numpy as np
 import matplotlib.pyplot as plt
 import collections
+import hashlib
+import threading
+import time
+import pandas as pd
 import warnings 
+import netCDF4
 from netCDF4 import default_fillvals
 from scipy.stats import hmean
+from scipy.spatial import cKDTree
 
 def is_soil_class(soil_class):
     '''
@@ -70,9 +76,61 @@ def classify_soil_texture(sand, clay, silt):
         soil_class = 12
     elif np.isnan(clay):
         soil_class = 12
-    
+
     return(soil_class)
 
+def classify_soil_texture_array(sand, clay, silt):
+    '''
+    array version of `classify_soil_texture`. takes in percent sand, percent clay and percent silt
+    as arrays of any shape (e.g. the full nlayer x nj x ni soil cubes) and classifies every element
+    in one vectorized pass. conditions are evaluated in the same order as `classify_soil_texture`,
+    so the first matching ARS class wins and cells with missing clay are assigned class 12.
+
+    if the inputs are DataArrays they are passed through xr.apply_ufunc with dask='parallelized',
+    so dask-backed arrays are classified chunk by chunk.
+    Returns: int8 array (or DataArray) of ARS soil texture classes
+    '''
+    if isinstance(sand, xr.DataArray):
+        return(xr.apply_ufunc(_classify_soil_texture_block, sand, clay, silt,
+                              dask='parallelized',
+                              output_dtypes=[np.int8]))
+    return(_classify_soil_texture_block(np.asarray(sand), np.asarray(clay), np.asarray(silt)))
+
+def _classify_soil_texture_block(sand, clay, silt):
+    '''
+    classifies numpy arrays of percent sand, clay and silt, see `classify_soil_texture_array`
+    '''
+    conditions = [
+        # sand
+        silt + (1.5 * clay) < 15,
+        # loamy sand
+        (silt + (1.5 * clay) >= 15) & (silt + (2 * clay) < 30),
+        # sandy loam
+        (((clay >= 7) & (clay < 20) & (sand > 52) & (silt + (2 * clay) >= 30)) |
+         ((clay < 7) & (silt < 50) & (silt + (2 * clay) >= 30))),
+        # loam
+        (clay >= 7) & (clay < 27) & (silt >= 28) & (silt < 50) & (sand <= 52),
+        # silt loam
+        ((silt >= 50) & (clay >= 12) & (clay < 27)) | ((silt >= 50) & (silt < 80) & (clay < 12)),
+        # silt
+        (silt >= 80) & (clay < 12),
+        # sandy clay loam
+        (clay >= 20) & (clay < 35) & (silt < 28) & (sand > 45),
+        # clay loam
+        (clay >= 27) & (clay < 40) & (sand > 20) & (sand <= 45),
+        # silty clay loam
+        (clay >= 27) & (clay < 40) & (sand <= 20),
+        # sandy clay
+        (clay >= 35) & (sand > 45),
+        # silty clay
+        (clay >= 40) & (silt >= 40),
+        # clay
+        (clay >= 40) & (sand <= 45) & (silt < 40),
+        np.isnan(clay)]
+    soil_classes = [1, 2, 3, 6, 4, 5, 7, 9, 8, 10, 11, 12, 12]
+
+    return(np.select(conditions, soil_classes, default=0).astype(np.int8))
+
 def calculate_cv_pft(gridcell_pft):
     '''
     takes a percent PFT for a gridcell and returns the fraction of gridcell coverage for that PFT
@@ -144,7 +202,7 @@ def is_overstory(nldas_class):
     function takes in an NLDAS class, if NLDAS class is 1-6 returns 1 (class has an overstory)
     if NLDAS class 7-12, return 0 (class does not have an overstory)
     '''
-    if nldas <= 5:
+    if nldas_class <= 5:
         return(1)
     else:
         return(0)
@@ -204,6 +262,66 @@ def calc_root_depth_rz2(cv):
         root_depth = 0.0
     return(root_depth)
 
+# look-up tables for `calculate_veg_parameters`. PFT_TO_NLDAS is `map_pft_to_nldas_class` for
+# PFTs 0-16, the NLDAS_* tables are indexed by NLDAS class (0-11)
+PFT_TO_NLDAS = np.array([11, 0, 0, 1, 2, 2, 3, 3, 3, 8, 8, 8, 9, 9, 9, 10, 2])
+# fraction of roots in root zones 1 and 2, see `calc_root_fract`
+NLDAS_ROOT_FRACT = np.array([[0.3, 0.7]] * 6 + [[0.6, 0.4]] * 2 + [[0.7, 0.3]] * 3 + [[0.0, 0.0]])
+# thickness of root zones 1 and 2 (m), see `calc_root_depth_rz1` and `calc_root_depth_rz2`
+ROOT_ZONE_DEPTHS = np.array([0.3, 0.7])
+NLDAS_OVERSTORY = np.array([is_overstory(nldas) for nldas in range(12)])
+NLDAS_ALBEDO = np.array([0.12, 0.12, 0.18, 0.18, 0.18, 0.18, 0.19, 0.19, 0.19, 0.2, 0.12, 0.2])
+# maximum snow albedo from Barlage et al 2005
+NLDAS_MAX_SNOW_ALBEDO = np.array([0.34, 0.37, 0.35, 0.35, 0.44, 0.69, 0.43, 0.56, 0.70, 0.65,
+                                  0.46, 0.84])
+# parameters taken from the mean of the old parameters, as (old parameter, veg_class of the
+# old parameters to use for each NLDAS class)
+NLDAS_OLD_PARAMS = collections.OrderedDict()
+NLDAS_OLD_PARAMS['rmin'] = ('rmin', [0, 0, 0, 0, 4, 5, 5, 7, 7, 9, 10, 11])
+NLDAS_OLD_PARAMS['wind_h'] = ('wind_h', [0, 0, 0, 0, 4, 5, 5, 7, 7, 9, 10, 11])
+NLDAS_OLD_PARAMS['RGL'] = ('wind_h', [0, 0, 0, 0, 4, 4, 6, 6, 6, 9, 9, 11])
+
+def calculate_veg_parameters(cv, old_params=None, veg_dim='veg_class'):
+    '''
+    vectorized version of the per-PFT veg parameter derivations. takes in a DataArray of Cv with
+    the 17 PFTs along `veg_dim` (in PFT order), maps the PFTs to NLDAS classes with PFT_TO_NLDAS
+    and broadcasts the NLDAS look-up tables against Cv in one pass:
+    root_fract and root_depth (veg_class, root_zone, nj, ni) follow `calc_root_fract` and
+    `calc_root_depth_rz1`/`calc_root_depth_rz2`, overstory, max_snow_albedo (veg_class, nj, ni) and
+    albedo (veg_class, month, nj, ni) are uniform per veg class.
+
+    if the old parameters Dataset is given, rmin, wind_h and RGL are also derived from it
+    (see NLDAS_OLD_PARAMS).
+    Returns: Dataset of veg parameters
+    '''
+    cv = cv.rename({veg_dim: 'veg_class'})
+    nldas = PFT_TO_NLDAS[np.arange(cv.sizes['veg_class'])]
+
+    def veg_table(values, *dims):
+        return(xr.DataArray(values, dims=('veg_class',) + dims))
+
+    veg_params = xr.Dataset()
+    veg_params['root_fract'] = xr.where(cv > 0, veg_table(NLDAS_ROOT_FRACT[nldas], 'root_zone'),
+                                        xr.where(cv == 0, 0.0, cv))
+    veg_params['root_depth'] = xr.where(cv > 0, xr.DataArray(ROOT_ZONE_DEPTHS, dims='root_zone'),
+                                        0.0)
+
+    ones = xr.ones_like(cv, dtype=np.float64)
+    veg_params['overstory'] = ones * veg_table(NLDAS_OVERSTORY[nldas])
+    veg_params['max_snow_albedo'] = ones * veg_table(NLDAS_MAX_SNOW_ALBEDO[nldas])
+    veg_params['albedo'] = ones * veg_table(NLDAS_ALBEDO[nldas]) * xr.DataArray(np.ones(12),
+                                                                                dims='month')
+    if old_params is not None:
+        for var, (old_var, old_veg_classes) in NLDAS_OLD_PARAMS.items():
+            old_means = old_params[old_var].mean(dim=[d for d in old_params[old_var].dims
+                                                      if d != 'veg_class']).values
+            veg_params[var] = ones * veg_table(old_means[old_veg_classes][nldas])
+
+    for var in ('root_fract', 'root_depth'):
+        veg_params[var] = veg_params[var].transpose('veg_class', 'root_zone', ...)
+    veg_params['albedo'] = veg_params['albedo'].transpose('veg_class', 'month', ...)
+    return(veg_params)
+
 def calculate_first_layer_harmonic_mean(sl1, sl2):
     '''
     takes in two values over which to calculate the harmonic mean, uses hmean from scipy.stats package
@@ -312,7 +430,145 @@ def calculate_third_layer_arithmetic_mean(sl3, sl4, sl5, sl6, sl7, total_depth):
     # else: 
         # return(0)
 
+# spatially homogenous first and third layer soil depths (m) assumed by the layer mean functions
+SOIL_LAYER_D1 = 0.1
+SOIL_LAYER_D3 = 0.5
+
+# SoilGrids layers (0-based, sl1-sl7) averaged into a VIC layer, indexed by the branch codes of
+# `soil_layer_index`. branch 0 is a cell that did not get assigned a layer
+SOIL_LAYER_BRANCHES = [(), (0, 1), (2,), (2, 3), (4, 5), (5,), (3,), (3, 4, 5), (6,)]
+
+def soil_layer_index(total_depth, cache_dir=None):
+    '''
+    takes in a DataArray of total soil depth (m) and maps every gridcell to the SoilGrids layers that
+    fall into each VIC layer, using the branches of the calculate_*_layer_*_mean functions.
+    the mapping only depends on the soil depth field and the layer scheme, so it can be computed
+    once and reused for every soil property.
+
+    if `cache_dir` is given the index is stored there as a NetCDF file keyed on a hash of the soil
+    depth field and the layer constants, and read back on later calls (e.g. calibration reruns).
+    indexes of earlier soil depth fields are removed when a new one is stored.
+    Returns: Dataset with int8 `harmonic` and `arithmetic` branch codes (nlayer=3) into
+    SOIL_LAYER_BRANCHES (the two only differ in how the deepest branch treats its bound)
+    '''
+    total_depth = total_depth.compute()
+
+    if cache_dir is not None:
+        key = hashlib.sha1()
+        key.update(np.ascontiguousarray(total_depth.values, dtype=np.float64).tobytes())
+        key.update(repr((total_depth.dims, total_depth.shape, SOIL_LAYER_D1, SOIL_LAYER_D3,
+                         SOIL_LAYER_BRANCHES)).encode())
+        cache_file = os.path.join(cache_dir, 'soil_layer_index_%s.nc' % key.hexdigest()[:16])
+        if os.path.exists(cache_file):
+            with xr.open_dataset(cache_file) as cached:
+                return(cached.load())
+
+    index = xr.Dataset()
+    for mean in ('harmonic', 'arithmetic'):
+        index[mean] = xr.apply_ufunc(_soil_layer_index_block, total_depth,
+                                     kwargs={'mean': mean},
+                                     output_core_dims=[['nlayer']])
+        index[mean] = index[mean].transpose('nlayer', ...)
+
+    if cache_dir is not None and not os.path.exists(cache_file):
+        # drop indexes of earlier soil depth fields, only the current one is read back
+        for old_file in os.listdir(cache_dir):
+            if (old_file.startswith('soil_layer_index_') and old_file.endswith('.nc')
+                    and old_file != os.path.basename(cache_file)):
+                try:
+                    os.remove(os.path.join(cache_dir, old_file))
+                except OSError:
+                    # dropped by a concurrent call
+                    pass
+        # write to a temporary name first so an interrupted run doesn't leave a partial cache,
+        # unique to the process and thread as concurrent calls may compute the same index
+        tmp_file = '%s.%d.%d.tmp' % (cache_file, os.getpid(), threading.get_ident())
+        index.to_netcdf(tmp_file)
+        os.replace(tmp_file, cache_file)
+    return(index)
+
+def _soil_layer_index_block(total_depth, mean):
+    '''
+    branch codes for the three VIC layers (last axis) of a numpy array of total soil depth,
+    see `soil_layer_index`
+    '''
+    second_layer = total_depth - (SOIL_LAYER_D1 + SOIL_LAYER_D3)
+    second_layer_depth = SOIL_LAYER_D1 + second_layer
+
+    first = np.ones(total_depth.shape)
+    second = np.select([second_layer < 0.3,
+                        (second_layer >= 0.3) & (second_layer < 0.6),
+                        (second_layer >= 0.6) & (second_layer <= 2),
+                        second_layer > 2],
+                       [2, 3, 4, 5], default=0)
+    if mean == 'harmonic':
+        deepest = second_layer_depth > 1.5
+    else:
+        deepest = second_layer_depth >= 1.5
+    third = np.select([(second_layer_depth >= 0.1) & (total_depth <= 1.0),
+                       (second_layer_depth >= 0.3) & (total_depth <= 1.5),
+                       (second_layer_depth >= 0.6) & (total_depth <= 1.5),
+                       (second_layer_depth >= 1.0) & (second_layer_depth < 1.5),
+                       deepest],
+                      [6, 7, 4, 5, 8], default=0)
+    return(np.stack((first, second, third), axis=-1).astype(np.int8))
+
+def aggregate_soil_layers(soil_layers, total_depth, mean='harmonic', layer_index=None):
+    '''
+    vectorized version of the calculate_{first,second,third}_layer_{harmonic,arithmetic}_mean
+    functions. takes in a DataArray (or Dataset) of SoilGrids values with an `nlayer` dimension of
+    length 7 (sl1-sl7), e.g. a (soil_property, nlayer, nj, ni) cube of several properties, and a
+    DataArray of total soil depth (m). returns all three VIC layers for every property in one pass,
+    with `nlayer` of length 3.
+
+    `mean` is either 'harmonic' or 'arithmetic'. layers are assigned with the same branches as the
+    scalar functions, cells where those would raise "layer did not get assigned" are set to NaN.
+    `layer_index` is the output of `soil_layer_index`, and is computed from `total_depth` if not
+    given. dask-backed inputs are aggregated chunk by chunk.
+    '''
+    if mean not in ('harmonic', 'arithmetic'):
+        raise ValueError("mean must be 'harmonic' or 'arithmetic', not %s" % mean)
+    if layer_index is None:
+        layer_index = soil_layer_index(total_depth)
+    if soil_layers.chunks:
+        # the layer dimension has to be in a single chunk
+        soil_layers = soil_layers.chunk({'nlayer': -1})
 
+    vic_layers = xr.apply_ufunc(_aggregate_soil_layers_block, soil_layers, layer_index[mean],
+                                kwargs={'mean': mean},
+                                input_core_dims=[['nlayer'], ['nlayer']],
+                                output_core_dims=[['nlayer']],
+                                exclude_dims={'nlayer'},
+                                dask='parallelized',
+                                output_dtypes=[np.float64],
+                                dask_gufunc_kwargs={'output_sizes': {'nlayer': 3}})
+    return(vic_layers.transpose(*soil_layers.dims, ...))
+
+def _aggregate_soil_layers_block(sl, branches, mean):
+    '''
+    aggregates a numpy array with sl1-sl7 along the last axis to the three VIC layers (last axis)
+    given their branch codes, see `aggregate_soil_layers`
+    '''
+    shape = np.broadcast_shapes(sl.shape[:-1], branches.shape[:-1])
+    sl = np.broadcast_to(sl, shape + sl.shape[-1:])
+    branches = np.broadcast_to(branches, shape + branches.shape[-1:])
+
+    vic_layers = np.full(shape + (3,), np.nan)
+    for branch in np.unique(branches):
+        layers = list(SOIL_LAYER_BRANCHES[branch])
+        if not layers:
+            continue
+        if len(layers) == 1:
+            values = sl[..., layers[0]]
+        elif mean == 'harmonic':
+            with np.errstate(divide='ignore'):
+                values = len(layers) / np.sum(1.0 / sl[..., layers], axis=-1)
+        else:
+            values = np.mean(sl[..., layers], axis=-1)
+        for vic_layer in range(3):
+            in_branch = branches[..., vic_layer] == branch
+            vic_layers[..., vic_layer][in_branch] = values[in_branch]
+    return(vic_layers)
 
 def soil_class_values(soil_class, return_var):
     '''
@@ -487,6 +743,77 @@ def soil_class_values(soil_class, return_var):
     elif return_var == "bulk_density":
         return(bulk_density)
 
+# soil property look-up table used by `soil_class_lookup`, one row per ARS soil texture class,
+# same values as `soil_class_values`. row 0 is used for cells that are not in classes 1-12 (loam).
+# ksat is in cm/hr as in Carsel and Parrish 1988, bulk density in kg/m3
+SOIL_PROPERTIES = ['ksat', 'b', 'Wpwp_FRACT', 'Wcr_FRACT', 'resid_moist', 'quartz', 'bulk_density']
+SOIL_PROPERTY_TABLE = pd.DataFrame([[1.97, 5.25, 0.117, 0.27, 0.027, 0.40, 1490],    # unclassified
+                                    [38.41, 2.79, 0.033, 0.091, 0.02, 0.92, 1490],   # sand
+                                    [10.87, 4.26, 0.055, 0.125, 0.035, 0.82, 1520],  # loamy sand
+                                    [5.24, 4.74, 0.095, 0.207, 0.041, 0.60, 1570],   # sandy loam
+                                    [3.96, 5.33, 0.133, 0.33, 0.015, 0.25, 1420],    # silty loam
+                                    [8.59, 8.72, 0.208, 0.366, 0.04, 0.10, 1280],    # silty
+                                    [1.97, 5.25, 0.117, 0.27, 0.027, 0.40, 1490],    # loam
+                                    [2.4, 6.77, 0.148, 0.255, 0.068, 0.60, 1600],    # sandy clay loam
+                                    [4.57, 8.72, 0.208, 0.366, 0.04, 0.10, 1380],    # silty clay loam
+                                    [1.77, 8.17, 0.197, 0.318, 0.075, 0.35, 1430],   # clay loam
+                                    [1.19, 10.73, 0.239, 0.339, 0.109, 0.52, 1570],  # sandy clay
+                                    [2.95, 10.39, 0.250, 0.387, 0.056, 0.10, 1350],  # silty clay
+                                    [3.18, 11.55, 0.272, 0.396, 0.09, 0.25, 1390]],  # clay
+                                   index=pd.Index(np.arange(13), name='soil_class'),
+                                   columns=SOIL_PROPERTIES)
+
+# converts ksat from cm/hr to mm/day for VIC 5
+KSAT_UNITS_FACTOR = 240
+
+def read_soil_property_table(table_file):
+    '''
+    takes in path to a csv file with a `soil_class` column and one column per soil property
+    (same layout as SOIL_PROPERTY_TABLE) and returns it as a DataFrame for `soil_class_lookup`
+    '''
+    return(pd.read_csv(table_file, index_col='soil_class'))
+
+def soil_class_lookup(soil_class, table=SOIL_PROPERTY_TABLE):
+    '''
+    table-driven version of `soil_class_values`. takes in a DataArray of soil classes and gathers
+    every property in `table` for every cell in one pass, instead of one if/elif walk per property.
+    classes missing from the table use row 0, missing soil classes (NaN) return NaN for all
+    properties and ksat is converted to mm/day.
+
+    dask-backed soil classes are looked up chunk by chunk.
+    Returns: Dataset with one data_var per column of `table`
+    '''
+    if not isinstance(soil_class, xr.DataArray):
+        soil_class = xr.DataArray(soil_class)
+
+    # dense class x property array, rows absent from the table fall back to row 0
+    nclasses = int(table.index.max()) + 1
+    lookup = table.reindex(np.arange(nclasses))
+    lookup = lookup.fillna(lookup.loc[0]).values.astype(np.float64)
+    if 'ksat' in table.columns:
+        lookup[:, table.columns.get_loc('ksat')] *= KSAT_UNITS_FACTOR
+
+    properties = xr.apply_ufunc(_soil_class_lookup_block, soil_class,
+                                kwargs={'lookup': lookup},
+                                output_core_dims=[['soil_property']],
+                                dask='parallelized',
+                                output_dtypes=[np.float64],
+                                dask_gufunc_kwargs={'output_sizes':
+                                                    {'soil_property': len(table.columns)}})
+    properties.coords['soil_property'] = list(table.columns)
+    return(properties.to_dataset(dim='soil_property'))
+
+def _soil_class_lookup_block(soil_class, lookup):
+    '''
+    gathers rows of `lookup` for a numpy array of soil classes, see `soil_class_lookup`
+    '''
+    missing = np.isnan(soil_class)
+    rows = np.where(missing, 0, soil_class).astype(np.int64)
+    rows[(rows < 1) | (rows >= len(lookup))] = 0
+    values = lookup[rows]
+    values[missing] = np.nan
+    return(values)
+
 def calculate_init_moist(porosity, soil_layer_depth):
     '''
     takes in soil layer depth and porosity and calculates initial moisture, 
@@ -497,135 +824,195 @@ def calculate_init_moist(porosity, soil_layer_depth):
 
     return(init_moist)
 
-def calculate_baseflow_parameters(domain, soil_direc, soil_filename, hydro_classes, var):
+# columns of the VIC 4 ASCII soil parameter file
+VIC4_SOIL_COLUMNS = ['runflag', 'gridcell', 'lat', 'lon', 'bi', 'd1', 'd2', 'd3', 'd4', 'N1', 'N2', 'N3',
+                     'ksat1', 'ksat2', 'ksat3', 'phi_s1', 'phi_s2', 'phi_s3', 'init_moist1', 'init_moist2',
+                     'init_moist3', 'elevation', 'depth1', 'depth2', 'depth3', 'avg_T', 'dp', 'bubble', 'quartz',
+                     'bulk_density1', 'bulk_density2', 'bulk_density3', 'soil_density1', 'soil_density2',
+                     'soil_density3', 'off_gmt', 'Wcr1', 'Wcr2', 'Wcr3', 'Wp1', 'Wp2', 'Wp3',
+                     'surface_roughness', 'snow_roughness', 'annual_prec', 'residual1', 'residual2', 'residual3']
+
+def read_vic4_soil_file(soil_file, cache_dir=None, hash_contents=False):
     '''
-    takes in DataArrays: domain file and hydro_classes
-    str: var name to return
-    Returns: numpy array of var name
+    takes in path to a VIC 4 ASCII soil parameter file and returns DataFrame with VIC4_SOIL_COLUMNS.
+    if `cache_dir` is given the parsed columns are stored there as a column-major .npy file and
+    memory-mapped on later calls instead of parsing the text again. the cache is keyed on the
+    path, size and modification time of the soil file, or on a sha1 of its contents if
+    `hash_contents` is True, so it is rebuilt whenever the soil file changes
+    '''
+    if cache_dir is None:
+        return(pd.read_table(soil_file, sep=r'\s+', names=VIC4_SOIL_COLUMNS))
+
+    key = hashlib.sha1()
+    if hash_contents:
+        with open(soil_file, 'rb') as f:
+            for block in iter(lambda: f.read(1 << 20), b''):
+                key.update(block)
+    else:
+        stat = os.stat(soil_file)
+        key.update(repr((os.path.abspath(soil_file), stat.st_size, stat.st_mtime_ns)).encode())
+    key.update(repr(VIC4_SOIL_COLUMNS).encode())
+    prefix = 'vic4_soil_%s_' % os.path.basename(soil_file)
+    cache_file = os.path.join(cache_dir, prefix + '%s.npy' % key.hexdigest()[:16])
+
+    if not os.path.exists(cache_file):
+        soil = pd.read_table(soil_file, sep=r'\s+', names=VIC4_SOIL_COLUMNS)
+        # drop caches of earlier versions of the soil file
+        for old_file in os.listdir(cache_dir):
+            if (old_file.startswith(prefix) and old_file.endswith('.npy')
+                    and old_file != os.path.basename(cache_file)):
+                try:
+                    os.remove(os.path.join(cache_dir, old_file))
+                except OSError:
+                    # dropped by a concurrent call
+                    pass
+        # write to a temporary name first so an interrupted run doesn't leave a partial cache,
+        # unique to the process and thread as concurrent calls may parse the same soil file.
+        # a cache file written by one of them in the meantime has the same contents
+        tmp_file = '%s.%d.%d.tmp' % (cache_file, os.getpid(), threading.get_ident())
+        with open(tmp_file, 'wb') as f:
+            np.save(f, np.asfortranarray(soil.values, dtype=np.float64))
+        os.replace(tmp_file, cache_file)
+
+    columns = np.load(cache_file, mmap_mode='r')
+    return(pd.DataFrame(columns, columns=VIC4_SOIL_COLUMNS, copy=False))
+
+# spatial index of the gridcells of a VIC 4 soil file, see `build_soil_index`
+SoilIndex = collections.namedtuple('SoilIndex', ['lat_order', 'sorted_lat', 'lon', 'tree'])
+
+def build_soil_index(soil):
+    '''
+    takes in DataFrame of a VIC 4 soil parameter file and returns SoilIndex of its gridcells:
+    rows sorted by latitude for bounding box queries and a KD-tree on (lat, lon) in degrees
+    for nearest gridcell queries
+    '''
+    lat = np.asarray(soil['lat'].values, dtype=np.float64)
+    lon = np.asarray(soil['lon'].values, dtype=np.float64)
+    lat_order = np.argsort(lat, kind='stable')
+    return(SoilIndex(lat_order, lat[lat_order], lon, cKDTree(np.column_stack((lat, lon)))))
+
+def soil_cells_in_box(index, lat_min, lat_max, lon_min, lon_max):
     '''
-    import pandas as pd
-    soil_file = os.path.join(soil_direc, soil_filename)
+    takes in SoilIndex and box bounds and returns row numbers (in file order) of the gridcells
+    inside the box, bounds excluded
+    '''
+    start = np.searchsorted(index.sorted_lat, lat_min, side='right')
+    stop = np.searchsorted(index.sorted_lat, lat_max, side='left')
+    rows = np.sort(index.lat_order[start:stop])
+    return(rows[(index.lon[rows] > lon_min) & (index.lon[rows] < lon_max)])
+
+def nearest_soil_cells(index, lats, lons):
+    '''
+    takes in SoilIndex and arrays of latitudes and longitudes and returns row numbers of the
+    nearest gridcell (in lat/lon degrees) of each point
+    '''
+    lats = np.asarray(lats, dtype=np.float64)
+    _, rows = index.tree.query(np.column_stack((lats.ravel(), np.asarray(lons, dtype=np.float64).ravel())))
+    return(rows.reshape(lats.shape))
+
+# hydroclimate classes in the order they are applied (later classes win where masks overlap),
+# with the (lat_min, lat_max, lon_min, lon_max) box of the VIC 4 gridcell whose baseflow parameters
+# they take
+HYDROCLIMATE_DONOR_BOXES = collections.OrderedDict([
+    ('arid', (38, 40, 104, 107)),
+    ('temperate_dry', (30, 32, 114, 116)),
+    ('cold_dry_perma', (55, 59, 115, 118)),
+    ('cold_dry_noperma', (59, 62, 141, 144)),
+    ('cold_wds_ws_perma', (46, 49, -120, -117)),
+    ('cold_wds_ws_noperma', (52, 54, 34, 36)),
+    ('cold_wds_cs_perma', (63, 66, 159, 162)),
+    ('cold_wds_cs_noperma', (60, 63, 22, 24)),
+    ('polar', (68, 71, -73, -69))])
+HYDROCLIMATE_CLASSES = list(HYDROCLIMATE_DONOR_BOXES)
+
+BASEFLOW_PARAMETERS = collections.OrderedDict([('Ds', 'd1'), ('Dsmax', 'd2'), ('Ws', 'd3'), ('c', 'd4')])
 
+def hydroclimate_class_index(hydro_classes):
+    '''
+    takes in DataSet of hydroclimate masks and returns int8 numpy array of the hydroclimate class
+    of each gridcell, 1 + position in HYDROCLIMATE_CLASSES, 0 where no mask is set
+    '''
+    class_index = np.zeros(hydro_classes[HYDROCLIMATE_CLASSES[0]].shape, dtype=np.int8)
+    for i, hydro_class in enumerate(HYDROCLIMATE_CLASSES):
+        class_index[np.nonzero(hydro_classes[hydro_class].values)] = i + 1
+    return(class_index)
+
+def scatter_hydroclimate_values(domain, class_index, class_values):
+    '''
+    takes in domain DataSet, hydroclimate class index from `hydroclimate_class_index` and
+    array of values per class (in the order of HYDROCLIMATE_CLASSES, with any trailing dims)
+    returns numpy array (nj, ni, ...) of the class values, domain mask (1, NaN) where no class is set
+    '''
     masknan_vals = domain['mask'].where(domain['mask'] == 1).values
-    names = ['runflag', 'gridcell', 'lat', 'lon', 'bi', 'd1', 'd2', 'd3', 'd4', 'N1', 'N2', 'N3', 'ksat1',
-             'ksat2', 'ksat3', 'phi_s1', 'phi_s2', 'phi_s3', 'init_moist1', 'init_moist2', 'init_moist3',
-             'elevation', 'depth1', 'depth2', 'depth3', 'avg_T', 'dp', 'bubble', 'quartz', 'bulk_density1',
-             'bulk_density2', 'bulk_density3', 'soil_density1', 'soil_density2', 'soil_density3', 'off_gmt',
-             'Wcr1', 'Wcr2', 'Wcr3', 'Wp1', 'Wp2', 'Wp3', 'surface_roughness', 'snow_roughness', 'annual_prec',
-             'residual1', 'residual2', 'residual3']
-    soil = pd.read_table(soil_file, delim_whitespace=True, names=names)
-
-    d1 = np.copy(masknan_vals)
-    d2 = np.copy(masknan_vals)
-    d3 = np.copy(masknan_vals)
-    d4 = np.copy(masknan_vals)
-
-    # arid
-    gc = soil.loc[(soil['lat'] > 38) & (soil['lat'] < 40) & (soil['lon'] < 107) & (soil['lon'] > 104)]
-    d1[np.nonzero(hydro_classes['arid'].values)] = gc['d1'].values[0]
-    d2[np.nonzero(hydro_classes['arid'].values)] = gc['d2'].values[0]
-    d3[np.nonzero(hydro_classes['arid'].values)] = gc['d3'].values[0]
-    d4[np.nonzero(hydro_classes['arid'].values)] = gc['d4'].values[0]
-
-    # temperate dry 
-    gc = soil.loc[(soil['lat'] > 30) & (soil['lat'] < 32) & (soil['lon'] < 116) & (soil['lon'] > 114)]
-    d1[np.nonzero(hydro_classes['temperate_dry'].values)] = gc['d1'].values[0]
-    d2[np.nonzero(hydro_classes['temperate_dry'].values)] = gc['d2'].values[0]
-    d3[np.nonzero(hydro_classes['temperate_dry'].values)] = gc['d3'].values[0]
-    d4[np.nonzero(hydro_classes['temperate_dry'].values)] = gc['d4'].values[0]
-
-    # cold_dry_perma
-    gc = soil.loc[(soil['lat'] > 55) & (soil['lat'] < 59) & (soil['lon'] < 118) & (soil['lon'] > 115)]
-    d1[np.nonzero(hydro_classes['cold_dry_perma'].values)] = gc['d1'].values[0]
-    d2[np.nonzero(hydro_classes['cold_dry_perma'].values)] = gc['d2'].values[0]
-    d3[np.nonzero(hydro_classes['cold_dry_perma'].values)] = gc['d3'].values[0]
-    d4[np.nonzero(hydro_classes['cold_dry_perma'].values)] = gc['d4'].values[0]
-
-    # cold_dry_noperma
-    gc = soil.loc[(soil['lat'] > 59) & (soil['lat'] < 62) & (soil['lon'] < 144) & (soil['lon'] > 141)]
-    d1[np.nonzero(hydro_classes['cold_dry_noperma'].values)] = gc['d1'].values[0]
-    d2[np.nonzero(hydro_classes['cold_dry_noperma'].values)] = gc['d2'].values[0]
-    d3[np.nonzero(hydro_classes['cold_dry_noperma'].values)] = gc['d3'].values[0]
-    d4[np.nonzero(hydro_classes['cold_dry_noperma'].values)] = gc['d4'].values[0]
-
-    # cold_wds_ws_perma
-    gc = soil.loc[(soil['lat'] > 46) & (soil['lat'] < 49) & (soil['lon'] < -117) & (soil['lon'] > -120)]
-    d1[np.nonzero(hydro_classes['cold_wds_ws_perma'].values)] = gc['d1'].values[0]
-    d2[np.nonzero(hydro_classes['cold_wds_ws_perma'].values)] = gc['d2'].values[0]
-    d3[np.nonzero(hydro_classes['cold_wds_ws_perma'].values)] = gc['d3'].values[0]
-    d4[np.nonzero(hydro_classes['cold_wds_ws_perma'].values)] = gc['d4'].values[0]
-
-    # cold_wds_ws_noperma
-    gc = soil.loc[(soil['lat'] > 52) & (soil['lat'] < 54) & (soil['lon'] < 36) & (soil['lon'] > 34)]
-    d1[np.nonzero(hydro_classes['cold_wds_ws_noperma'].values)] = gc['d1'].values[0]
-    d2[np.nonzero(hydro_classes['cold_wds_ws_noperma'].values)] = gc['d2'].values[0]
-    d3[np.nonzero(hydro_classes['cold_wds_ws_noperma'].values)] = gc['d3'].values[0]
-    d4[np.nonzero(hydro_classes['cold_wds_ws_noperma'].values)] = gc['d4'].values[0]
-
-    # cold_wds_cs_perma
-    gc = soil.loc[(soil['lat'] > 63) & (soil['lat'] < 66) & (soil['lon'] < 162) & (soil['lon'] > 159)]
-    d1[np.nonzero(hydro_classes['cold_wds_cs_perma'].values)] = gc['d1'].values[0]
-    d2[np.nonzero(hydro_classes['cold_wds_cs_perma'].values)] = gc['d2'].values[0]
-    d3[np.nonzero(hydro_classes['cold_wds_cs_perma'].values)] = gc['d3'].values[0]
-    d4[np.nonzero(hydro_classes['cold_wds_cs_perma'].values)] = gc['d4'].values[0]
-
-    # cold_wds_cs_noperma
-    gc = soil.loc[(soil['lat'] > 60) & (soil['lat'] < 63) & (soil['lon'] < 24) & (soil['lon'] > 22)]
-    d1[np.nonzero(hydro_classes['cold_wds_cs_noperma'].values)] = gc['d1'].values[0]
-    d2[np.nonzero(hydro_classes['cold_wds_cs_noperma'].values)] = gc['d2'].values[0]
-    d3[np.nonzero(hydro_classes['cold_wds_cs_noperma'].values)] = gc['d3'].values[0]
-    d4[np.nonzero(hydro_classes['cold_wds_cs_noperma'].values)] = gc['d4'].values[0]
-
-    # polar
-    gc = soil.loc[(soil['lat'] > 68) & (soil['lat'] < 71) & (soil['lon'] < -69) & (soil['lon'] > -73)]
-    d1[np.nonzero(hydro_classes['polar'].values)] = gc['d1'].values[0]
-    d2[np.nonzero(hydro_classes['polar'].values)] = gc['d2'].values[0]
-    d3[np.nonzero(hydro_classes['polar'].values)] = gc['d3'].values[0]
-    d4[np.nonzero(hydro_classes['polar'].values)] = gc['d4'].values[0]
-
-    if var == "d1":
-        return(d1)
-    elif var == "d2":
-        return(d2)
-    elif var == "d3":
-        return(d3)
-    elif var == "d4":
-        return(d4)
-
-def create_empty_arrays(domain, nj, ni, num_veg):
+    class_values = np.asarray(class_values, dtype=np.float64)
+    values = np.empty(masknan_vals.shape + class_values.shape[1:])
+    values[...] = masknan_vals.reshape(masknan_vals.shape + (1,) * (class_values.ndim - 1))
+    classified = class_index > 0
+    values[classified] = class_values[class_index[classified] - 1]
+    return(values)
+
+def find_donor_cells(soil, boxes=HYDROCLIMATE_DONOR_BOXES, index=None):
+    '''
+    takes in DataFrame of a VIC 4 soil parameter file and OrderedDict of
+    (lat_min, lat_max, lon_min, lon_max) boxes, returns row number of the first
+    gridcell inside each box (bounds excluded).
+    `index` is the SoilIndex of the soil file, built if not given
+    '''
+    if index is None:
+        index = build_soil_index(soil)
+    rows = []
+    for name, (lat_min, lat_max, lon_min, lon_max) in boxes.items():
+        in_box = soil_cells_in_box(index, lat_min, lat_max, lon_min, lon_max)
+        if in_box.size == 0:
+            raise ValueError("no gridcell for %s in soil file within lat %s to %s, lon %s to %s"
+                             % (name, lat_min, lat_max, lon_min, lon_max))
+        rows.append(in_box[0])
+    return(np.array(rows))
+
+def calculate_baseflow_parameters(domain, soil_direc, soil_filename, hydro_classes, var=None,
+                                  cache_dir=None):
+    '''
+    takes in DataArrays: domain file and hydro_classes
+    the VIC 4 soil file is read once and each hydroclimate class takes d1-d4 of its donor gridcell
+    Returns: DataSet of Ds (d1), Dsmax (d2), Ws (d3) and c (d4), or numpy array of var name
+    if var ("d1", "d2", "d3" or "d4") is given
+    if `cache_dir` is given the parsed soil file is cached there, see `read_vic4_soil_file`
+    '''
+    soil = read_vic4_soil_file(os.path.join(soil_direc, soil_filename), cache_dir=cache_dir)
+
+    donors = soil[list(BASEFLOW_PARAMETERS.values())].values[find_donor_cells(soil)]
+    class_index = hydroclimate_class_index(hydro_classes)
+    baseflow = scatter_hydroclimate_values(domain, class_index, donors)
+
+    if var is not None:
+        return(baseflow[..., list(BASEFLOW_PARAMETERS.values()).index(var)])
+
+    baseflow_params = xr.Dataset()
+    for i, name in enumerate(BASEFLOW_PARAMETERS):
+        baseflow_params[name] = xr.DataArray(baseflow[..., i], dims=domain['mask'].dims)
+    return(baseflow_params)
+
+def create_empty_arrays(domain, nj, ni, num_veg, lazy=False):
    '''
    takes in DataSet of domain file, scalars for nj and ni 
    (size of array)
+   if `lazy` is True the arrays are read-only broadcast views of the domain mask, so no memory is
+   allocated until a copy is made or values are assigned
    '''
    masknan_vals = domain['mask'].where(domain['mask'] == 1).values
 
-   arr_months = np.rollaxis(np.dstack((masknan_vals, masknan_vals, masknan_vals, masknan_vals,
-                                    masknan_vals, masknan_vals, masknan_vals, masknan_vals,
-                                    masknan_vals, masknan_vals, masknan_vals, masknan_vals)),
-                        axis=2)
-   arr_nlayer = np.rollaxis(np.dstack((masknan_vals, masknan_vals, masknan_vals)),
-                        axis=2)
-
-   arr_rootzone = np.rollaxis(np.dstack((masknan_vals, masknan_vals)),
-                        axis=2)
-
-   arr_veg_classes = np.rollaxis(np.dstack((masknan_vals, masknan_vals, masknan_vals, masknan_vals,
-                                         masknan_vals, masknan_vals, masknan_vals, masknan_vals,
-                                         masknan_vals, masknan_vals, masknan_vals, masknan_vals,
-                                         masknan_vals, masknan_vals, masknan_vals, masknan_vals,
-                                         masknan_vals)),
-                              axis=2)
-   arr_veg_classes_rootzone = np.vstack((arr_rootzone, arr_rootzone, arr_rootzone, arr_rootzone,
-                                      arr_rootzone, arr_rootzone, arr_rootzone, arr_rootzone,
-                                      arr_rootzone, arr_rootzone, arr_rootzone, arr_rootzone,
-                                      arr_rootzone, arr_rootzone, arr_rootzone,
-                                      arr_rootzone, arr_rootzone)).reshape(num_veg, 2, nj, ni)
-   arr_veg_classes_month = np.vstack((arr_months, arr_months, arr_months, arr_months, arr_months,
-                                   arr_months, arr_months, arr_months, arr_months, arr_months,
-                                   arr_months, arr_months, arr_months, arr_months, arr_months,
-                                   arr_months, arr_months,)).reshape(num_veg, 12, nj, ni)
-   return(arr_months, arr_nlayer, arr_rootzone, arr_veg_classes, arr_veg_classes_rootzone,
-          arr_veg_classes_month)
+   arr_months = np.broadcast_to(masknan_vals, (12, nj, ni))
+   arr_nlayer = np.broadcast_to(masknan_vals, (3, nj, ni))
+   arr_rootzone = np.broadcast_to(masknan_vals, (2, nj, ni))
+   arr_veg_classes = np.broadcast_to(masknan_vals, (num_veg, nj, ni))
+   arr_veg_classes_rootzone = np.broadcast_to(masknan_vals, (num_veg, 2, nj, ni))
+   arr_veg_classes_month = np.broadcast_to(masknan_vals, (num_veg, 12, nj, ni))
+
+   empty_arrays = (arr_months, arr_nlayer, arr_rootzone, arr_veg_classes, arr_veg_classes_rootzone,
+                   arr_veg_classes_month)
+   if not lazy:
+      empty_arrays = tuple(np.copy(arr) for arr in empty_arrays)
+   return(empty_arrays)
 
 def calculate_nveg_pfts(gridcell_pfts):
     '''
@@ -646,400 +1033,249 @@ def calculate_nveg_pfts(gridcell_pfts):
         active_pfts = np.count_nonzero(gridcell_pfts[1:])
         return(active_pfts)
 
+def calculate_nveg(pct_pft, pft_dim='pft'):
+    '''
+    array version of `calculate_nveg_pfts`. takes in a DataArray of PCT_PFT and counts the active
+    (nonzero) PFTs after bare soil for every gridcell in one reduction over `pft_dim`. a pure bare
+    soil gridcell has no active PFTs and the rounding error case counts its active PFTs, so as in
+    `calculate_nveg_pfts` both reduce to the count. missing PFTs count as active, like
+    np.count_nonzero. dask-backed arrays are reduced chunk by chunk.
+    Returns: DataArray of Nveg
+    '''
+    return((pct_pft.isel({pft_dim: slice(1, None)}) != 0).sum(dim=pft_dim))
+
+# VIC 5 parameter catalog. create_parameter_dataset allocates, validate_parameters checks and
+# parameter_encoding encodes the parameters from this table.
+#   dims: dimensions of the variable
+#   dtype: dtype in the parameter file. in memory, integer flags are held as float32 and int32
+#          variables as float64 so masked gridcells can be NaN
+#   fill_value: _FillValue in the parameter file, defaults to the netCDF4 default for dtype
+#   zlib, chunksizes: compression and chunking in the parameter file
+#   option: the [Options] entry that has to be set for the variable to be included
+ParameterSpec = collections.namedtuple('ParameterSpec', ['dims', 'dtype', 'units', 'long_name',
+                                                         'description', 'fill_value', 'zlib',
+                                                         'chunksizes', 'option'])
+ParameterSpec.__new__.__defaults__ = (None, None, False, None, None)
+
+GRID_DIMS = ('nj', 'ni')
+LAYER_DIMS = ('nlayer', 'nj', 'ni')
+VEG_DIMS = ('veg_class', 'nj', 'ni')
+VEG_MONTH_DIMS = ('veg_class', 'month', 'nj', 'ni')
+VEG_ROOTZONE_DIMS = ('veg_class', 'root_zone', 'nj', 'ni')
+
+PARAMETER_SCHEMA = collections.OrderedDict()
+# vegetation
+PARAMETER_SCHEMA['Cv'] = ParameterSpec(
+    VEG_DIMS, 'f8', "fraction", "Cv", "Fraction of grid cell covered by vegetation tile")
+PARAMETER_SCHEMA['Nveg'] = ParameterSpec(
+    GRID_DIMS, 'i4', "N/A", "Nveg", "Number of vegetation tiles in the grid cell")
+PARAMETER_SCHEMA['trunk_ratio'] = ParameterSpec(
+    VEG_DIMS, 'f4', "fraction", "trunk_ratio",
+    "Ratio of total tree height that is trunk (no branches). The default value has been 0.2")
+PARAMETER_SCHEMA['rarc'] = ParameterSpec(
+    VEG_DIMS, 'f4', "s/m", "rarc", "Architectural resistance of vegetation type (~2 s/m)")
+PARAMETER_SCHEMA['rmin'] = ParameterSpec(
+    VEG_DIMS, 'f4', "s/m", "rmin", "Minimum stomatal resistance of vegetation type (~100 s/m)")
+PARAMETER_SCHEMA['wind_h'] = ParameterSpec(
+    VEG_DIMS, 'f4', "m", "wind_h", "Height at which wind speed is measured")
+PARAMETER_SCHEMA['RGL'] = ParameterSpec(
+    VEG_DIMS, 'f4', "W/m^2", "RGL",
+    "Minimum incoming shortwave radiation at which there will be transpiration. For trees this "
+    "is about 30 W/m^2, for crops about 100 W/m^2")
+PARAMETER_SCHEMA['rad_atten'] = ParameterSpec(
+    VEG_DIMS, 'f4', "fraction", "rad_atten",
+    "Radiation attenuation factor. Normally set to 0.5, though may need to be adjusted for high "
+    "latitudes")
+PARAMETER_SCHEMA['wind_atten'] = ParameterSpec(
+    VEG_DIMS, 'f4', "fraction", "wind_atten",
+    "Wind speed attenuation through the overstory. The default value has been 0.5")
+PARAMETER_SCHEMA['max_snow_albedo'] = ParameterSpec(
+    VEG_DIMS, 'f4', "fraction", "max_snow_albedo", "maximum snow albedo from Barlage et al 2005",
+    option='max_snow_albedo')
+PARAMETER_SCHEMA['albedo'] = ParameterSpec(
+    VEG_MONTH_DIMS, 'f4', "fraction", "albedo", "Shortwave albedo for vegetation type")
+PARAMETER_SCHEMA['LAI'] = ParameterSpec(
+    VEG_MONTH_DIMS, 'f8', "N/A", "LAI", "Leaf Area Index, one per month")
+PARAMETER_SCHEMA['overstory'] = ParameterSpec(
+    VEG_DIMS, 'i1', "N/A", "overstory",
+    "Flag to indicate whether or not the current vegetation type has an overstory (TRUE for "
+    "overstory present (e.g. trees), FALSE for overstory not present (e.g. grass))")
+PARAMETER_SCHEMA['displacement'] = ParameterSpec(
+    VEG_MONTH_DIMS, 'f8', "m", "displacement",
+    "Vegetation displacement height (typically 0.67 * vegetation height)")
+PARAMETER_SCHEMA['veg_rough'] = ParameterSpec(
+    VEG_MONTH_DIMS, 'f8', "m", "veg_rough",
+    "Vegetation roughness length (typically 0.123 * vegetation height)")
+PARAMETER_SCHEMA['root_depth'] = ParameterSpec(
+    VEG_ROOTZONE_DIMS, 'f4', "m", "root_depth",
+    "Root zone thickness (sum of depths is total depth of root penetration)")
+PARAMETER_SCHEMA['root_fract'] = ParameterSpec(
+    VEG_ROOTZONE_DIMS, 'f4', "fraction", "root_fract", "Fraction of root in the current root zone")
+# climate and elevation
+PARAMETER_SCHEMA['elev'] = ParameterSpec(
+    GRID_DIMS, 'f8', "m", "elev", "Average elevation of grid cell")
+PARAMETER_SCHEMA['avg_T'] = ParameterSpec(
+    GRID_DIMS, 'f8', "C", "avg_T",
+    "Average soil temperature, used as the bottom boundary for soil heat flux solutions")
+PARAMETER_SCHEMA['annual_prec'] = ParameterSpec(
+    GRID_DIMS, 'f8', "mm", "annual_prec", "Average annual precipitation")
+PARAMETER_SCHEMA['rough'] = ParameterSpec(
+    GRID_DIMS, 'f4', "m", "rough", "Surface roughness of bare soil")
+# baseflow and infiltration
+PARAMETER_SCHEMA['Ds'] = ParameterSpec(
+    GRID_DIMS, 'f4', "fraction", "Ds", "Fraction of Dsmax where non-linear baseflow begins")
+PARAMETER_SCHEMA['Dsmax'] = ParameterSpec(
+    GRID_DIMS, 'f4', "fraction", "Dsmax",
+    "Fraction of maximum soil moisture where non-linear baseflow occurs")
+PARAMETER_SCHEMA['Ws'] = ParameterSpec(
+    GRID_DIMS, 'f4', "fraction", "Ws",
+    "Fraction of maximum soil moisture where non-linear baseflow occurs")
+PARAMETER_SCHEMA['c'] = ParameterSpec(
+    GRID_DIMS, 'f4', "N/A", "c", "Exponent used in baseflow curve, normally set to 2")
+PARAMETER_SCHEMA['infilt'] = ParameterSpec(
+    GRID_DIMS, 'f4', "fraction", "infilt",
+    "Fraction of maximum soil moisture where non-linear baseflow occurs")
+# soil
+PARAMETER_SCHEMA['depth'] = ParameterSpec(
+    LAYER_DIMS, 'f8', "m", "depth", "Thickness of each soil moisture layer")
+PARAMETER_SCHEMA['Ksat'] = ParameterSpec(
+    LAYER_DIMS, 'f8', "mm/day", "Ksat", "Saturated hydraulic conductivity")
+PARAMETER_SCHEMA['bulk_density'] = ParameterSpec(
+    LAYER_DIMS, 'f8', "kg/m3", "bulk_density", "Mineral bulk density of soil layer")
+PARAMETER_SCHEMA['expt'] = ParameterSpec(
+    LAYER_DIMS, 'f8', "N/A", "expt",
+    "Exponent n (=3+2/lambda) in Campbell's eqt for Ksat, HBH 5.6 where lambda = soil pore size "
+    "distribution parameter")
+PARAMETER_SCHEMA['bubble'] = ParameterSpec(
+    LAYER_DIMS, 'f8', "cm", "bubble", "Bubbling pressure of soil. Values should be > 0")
+PARAMETER_SCHEMA['resid_moist'] = ParameterSpec(
+    LAYER_DIMS, 'f8', "fraction", "resid_moist", "Soil moisture layer residual moisture")
+PARAMETER_SCHEMA['quartz'] = ParameterSpec(
+    LAYER_DIMS, 'f4', "fraction", "quartz", "Quartz content of soil")
+PARAMETER_SCHEMA['bulk_density_comb'] = ParameterSpec(
+    LAYER_DIMS, 'f8', "kg/m3", "bulk_density", "Soil bulk density of soil layer",
+    option='bulk_density_comb')
+PARAMETER_SCHEMA['organic'] = ParameterSpec(
+    LAYER_DIMS, 'f8', "fraction", "organic_fract", "soil organic carbon fraction",
+    option='organic_fract')
+PARAMETER_SCHEMA['soil_density'] = ParameterSpec(
+    LAYER_DIMS, 'f4', "kg/m3", "soil_density", "Soil particle density, normally 2685 kg/m3")
+PARAMETER_SCHEMA['soil_density_org'] = ParameterSpec(
+    LAYER_DIMS, 'f4', "kg/m3", "soil_dens_org", "Organic matter particle density, normally 1300 kg/m3",
+    option='organic_fract')
+PARAMETER_SCHEMA['Wpwp_FRACT'] = ParameterSpec(
+    LAYER_DIMS, 'f8', "fraction", "Wpwp_FRACT",
+    "Fractional soil moisture content at the wilting point (fraction of maximum moisture)")
+PARAMETER_SCHEMA['Wcr_FRACT'] = ParameterSpec(
+    LAYER_DIMS, 'f8', "fraction", "Wcr_FRACT",
+    "Fractional soil moisture content at the critical point (~70% of field capacity) (fraction "
+    "of maximum moisture)")
+PARAMETER_SCHEMA['init_moist'] = ParameterSpec(
+    LAYER_DIMS, 'f8', "mm", "init_moist", "Initial layer moisture content")
+PARAMETER_SCHEMA['off_gmt'] = ParameterSpec(
+    GRID_DIMS, 'f8', "s", "off_gmt", "Time zone offset from GMT")
+PARAMETER_SCHEMA['phi_s'] = ParameterSpec(
+    LAYER_DIMS, 'f4', "mm/mm", "phi_s", "Soil moisture diffusion parameter")
+PARAMETER_SCHEMA['fs_active'] = ParameterSpec(
+    GRID_DIMS, 'i1', "binary", "fs_active",
+    "If set to 1, then frozen soil algorithm is activated for the grid cell. A 0 indicates that "
+    "frozen soils are not computed if soil temperatures fall below 0C.")
+PARAMETER_SCHEMA['dp'] = ParameterSpec(
+    GRID_DIMS, 'f4', "m", "dp",
+    "Soil thermal damping depth (depth at which soil temperature remains constant through the "
+    "year, ~4 m)")
+PARAMETER_SCHEMA['snow_rough'] = ParameterSpec(
+    GRID_DIMS, 'f4', "m", "snow_rough", "Surface roughness of snowpack")
+# grid cells
+PARAMETER_SCHEMA['run_cell'] = ParameterSpec(
+    GRID_DIMS, 'i1', "N/A", "run_cell", "1 value indicates cell is run")
+PARAMETER_SCHEMA['mask'] = ParameterSpec(
+    GRID_DIMS, 'i4', "N/A", "mask", "0 value indicates cell is not active")
+PARAMETER_SCHEMA['gridcell'] = ParameterSpec(
+    GRID_DIMS, 'i4', "N/A", "gridcell", "Grid cell number")
+PARAMETER_SCHEMA['lats'] = ParameterSpec(
+    GRID_DIMS, 'f8', "degrees", "lats", "Latitude of grid cell")
+PARAMETER_SCHEMA['lons'] = ParameterSpec(
+    GRID_DIMS, 'f8', "degrees", "lons", "Longitude of grid cell")
+
+def parameter_memory_dtype(spec):
+    '''
+    takes in a ParameterSpec and returns the numpy dtype its values are held in before writing,
+    floats that can represent NaN for masked gridcells
+    '''
+    if spec.dtype in ('f4', 'i1'):
+        return(np.dtype(np.float32))
+    return(np.dtype(np.float64))
+
+def parameter_fill_value(spec):
+    '''
+    takes in a ParameterSpec and returns its _FillValue in the parameter file
+    '''
+    if spec.fill_value is not None:
+        return(spec.fill_value)
+    return(default_fillvals[spec.dtype])
+
+def selected_parameters(organic_fract, max_snow_albedo, bulk_density_comb):
+    '''
+    takes in the booleans from [Options] and returns the PARAMETER_SCHEMA entries they include
+    '''
+    options = {'organic_fract': organic_fract, 'max_snow_albedo': max_snow_albedo,
+               'bulk_density_comb': bulk_density_comb}
+    return(collections.OrderedDict((name, spec) for name, spec in PARAMETER_SCHEMA.items()
+                                   if spec.option is None or options[spec.option]))
+
+def parameter_shape(spec, nj, ni, num_veg):
+    '''
+    takes in a ParameterSpec and grid size and returns the shape of the variable
+    '''
+    sizes = {'veg_class': num_veg, 'month': 12, 'nlayer': 3, 'root_zone': 2, 'nj': nj, 'ni': ni}
+    return(tuple(sizes[dim] for dim in spec.dims))
+
+def parameter_bytes(nj, ni, num_veg, organic_fract, max_snow_albedo, bulk_density_comb):
+    '''
+    takes in grid size and the booleans from [Options] and returns the bytes the parameters
+    included by the options take in memory (in their in-memory dtype)
+    '''
+    return(sum(int(np.prod(parameter_shape(spec, nj, ni, num_veg))) * parameter_memory_dtype(spec).itemsize
+               for spec in selected_parameters(organic_fract, max_snow_albedo, bulk_density_comb).values()))
+
 def create_parameter_dataset(domain, old_params, nj, ni, num_veg,
                              organic_fract, max_snow_albedo,
-                             bulk_density_comb):
+                             bulk_density_comb, lazy=False):
    '''
-   takes in: 
-   returns parameter DataSet
+   takes in DataSet of domain file, DataSet of old parameters (for the month coordinate),
+   scalars for nj, ni and num_veg and the options organic_fract, max_snow_albedo and
+   bulk_density_comb (booleans).
+   returns parameter DataSet with one data_var per entry of PARAMETER_SCHEMA included by the options,
+   filled with the domain mask (NaN where mask is not 1) in the in-memory dtype of the entry.
+   if `lazy` is True the data_vars are read-only broadcast views of the domain mask and memory is
+   only allocated when a variable is filled (with `fill_parameter`), otherwise every
+   data_var gets its own copy of the empty template.
    '''
-   from netCDF4 import default_fillvals
-   # define fillvals
-   fillval_f = default_fillvals['f8']
-   fillval_i = default_fillvals['i4']
-
    masknan_vals = domain['mask'].where(domain['mask'] == 1).values
 
-   arr_months, arr_nlayer, \
-   arr_rootzone, arr_veg_classes, \
-   arr_veg_classes_rootzone, \
-   arr_veg_classes_month = create_empty_arrays(domain, nj, ni, num_veg)
-
    params = xr.Dataset()
 
    # assign veg class indexing
-   params['veg_class'] = xr.DataArray(np.arange(1, 18), dims='veg_class',
+   params['veg_class'] = xr.DataArray(np.arange(1, num_veg + 1), dims='veg_class',
                                    attrs={'long_name': "vegetation class"})
    params['nlayer'] = xr.DataArray(np.arange(0, 3), dims='nlayer')
+   params.coords['month'] = old_params['month']
+
+   filled_bytes = 0
+   for name, spec in selected_parameters(organic_fract, max_snow_albedo, bulk_density_comb).items():
+      dtype = parameter_memory_dtype(spec)
+      shape = parameter_shape(spec, nj, ni, num_veg)
+      template = np.broadcast_to(masknan_vals.astype(dtype), shape)
+      if not lazy:
+         template = np.copy(template)
+      params[name] = xr.DataArray(template,
+                                  dims=spec.dims,
+                                  coords={'xc': domain.xc, 'yc': domain.yc},
+                                  attrs={'description': spec.description,
+                                         'units': spec.units, 'long_name': spec.long_name})
+      filled_bytes += template.size * dtype.itemsize
 
-   params['Cv'] = xr.DataArray(np.copy(arr_veg_classes),
-                                 dims=('veg_class','nj', 'ni'),
-                                 coords={'xc': domain.xc, 'yc': domain.yc},
-                                 attrs={'description': "Fraction of grid cell covered by vegetation tile",
-                                        'units': "fraction", 'long_name': "Cv"},
-                                 encoding={"_FillValue": fillval_f,
-                                               "Coordinates": "xc yc"})
-   params['Nveg'] = xr.DataArray(np.copy(masknan_vals),
-                                   dims=('nj', 'ni'),
-                                   coords={'xc': domain.xc, 'yc': domain.yc},
-                                   attrs={'description': "Number of vegetation tiles in the grid cell",
-                                          'units': "N/A", 'long_name': "Nveg"},
-                                   encoding={"_FillValue": fillval_i,
-                                               "Coordinates": "xc yc", 'dtype': 'int32'})
-   params['trunk_ratio'] = xr.DataArray(arr_veg_classes,
-                                 dims=('veg_class','nj', 'ni'),
-                                 coords={'xc': domain.xc, 'yc': domain.yc},
-                                 attrs={'description': "Ratio of total tree height that is trunk \
-                                 (no branches) \
-                                        The default value has been 0.2",
-                                 'units': "fraction", 'long_name': "Cv"},
-                                 encoding={"_FillValue": fillval_f,
-                                               "Coordinates": "xc yc"})
-   params['rarc'] = xr.DataArray(arr_veg_classes,
-                                 dims=('veg_class','nj', 'ni'),
-                                 coords={'xc': domain.xc, 'yc': domain.yc},
-                                 attrs={'description': "Architectural resistance of vegetation type \(~2 s/m)",
-                                        'units': "s/m", 'long_name': "rarc"},
-                                 encoding={"_FillValue": fillval_f,
-                                               "Coordinates": "xc yc"})
-   params['rmin'] = xr.DataArray(np.copy(arr_veg_classes),
-                                 dims=('veg_class','nj', 'ni'),
-                                 coords={'xc': domain.xc, 'yc': domain.yc},
-                                 attrs={'description': "Minimum stomatal resistance of vegetation type (~100 s/m)"},
-                                 encoding={"_FillValue": fillval_f,
-                                               "Coordinates": "xc yc"})
-   params['wind_h'] = xr.DataArray(np.copy(arr_veg_classes),
-                                 dims=('veg_class','nj', 'ni'),
-                                 coords={'xc': domain.xc, 'yc': domain.yc},
-                                 attrs={'description': "Height at which wind speed is measured",
-                                        'units': "m", 'long_name': "wind_h"},
-                                 encoding={"_FillValue": fillval_f,
-                                               "Coordinates": "xc yc"})
-   params['RGL'] = xr.DataArray(np.copy(arr_veg_classes),
-                                 dims=('veg_class','nj', 'ni'),
-                                 coords={'xc': domain.xc, 'yc': domain.yc},
-                                 attrs={'description': "Minimum incoming shortwave radiation at which there will be \
-                                        transpiration. For trees this is about 30 W/m^2, for crops about 100 W/m^2",
-                                        'units': "W/m^2", 'long_name': "RGL"},
-                                 encoding={"_FillValue": fillval_f,
-                                               "Coordinates": "xc yc"})
-
-   params['rad_atten'] = xr.DataArray(arr_veg_classes,
-                                 dims=('veg_class','nj', 'ni'),
-                                 coords={'xc': domain.xc, 'yc': domain.yc},
-                                 attrs={'description': "Radiation attenuation factor. Normally set to 0.5, though may \
-                                        need to be adjusted for high latitudes",
-                                        'units': "fraction", 'long_name': "rad_atten"},
-                                 encoding={"_FillValue": fillval_f,
-                                               "Coordinates": "xc yc"})
-
-   params['wind_atten'] = xr.DataArray(arr_veg_classes,
-                                 dims=('veg_class','nj', 'ni'),
-                                 coords={'xc': domain.xc, 'yc': domain.yc},
-                                 attrs={'description': "Wind speed attenuation through the overstory. The default value \
-                                        has been 0.5",
-                                        'units': "fraction", 'long_name': "wind_atten"},
-                                 encoding={"_FillValue": fillval_f,
-                                               "Coordinates": "xc yc"})
-   if max_snow_albedo == True:
-       params['max_snow_albedo'] = xr.DataArray(np.copy(arr_veg_classes),
-                                 dims=('veg_class','nj', 'ni'),
-                                 coords={'xc': domain.xc, 'yc': domain.yc},
-                                 attrs={'description': "maximum snow albedo from Barlage et al 2005",
-                                        'units': "fraction", 'long_name': "max_snow_albedo"},
-                                 encoding={"_FillValue": fillval_f,
-                                               "Coordinates": "xc yc"})
-   params['albedo'] = xr.DataArray(arr_veg_classes_month,
-                                         dims=('veg_class','month','nj', 'ni'),
-                                         coords={'xc': domain.xc, 'yc': domain.yc},
-                                         attrs={'description': "Shortwave albedo for vegetation type",
-                                                'units': "fraction", 'long_name': "albedo"},
-                                         encoding={"_FillValue": fillval_f,
-                                               "Coordinates": "xc yc"})
-   params['LAI'] = xr.DataArray(np.copy(arr_veg_classes_month),
-                                 dims=('veg_class','month','nj', 'ni'),
-                                 coords={'xc': domain.xc, 'yc': domain.yc, 'month': old_params.month},
-                                 attrs={'description': "Leaf Area Index, one per month",
-                                        'units': "N/A", 'long_name': "LAI"},
-                                 encoding={"_FillValue": fillval_f,
-                                               "Coordinates": "xc yc"})
-   params['overstory'] = xr.DataArray(arr_veg_classes,
-                                 dims=('veg_class','nj', 'ni'),
-                                 coords={'xc': domain.xc, 'yc': domain.yc},
-                                 attrs={'description': "Flag to indicate whether or not the current vegetation type \
-                                        has an overstory (TRUE for overstory present (e.g. trees), FALSE for \
-                                        overstory not present (e.g. grass))",
-                                        'units': "N/A", 'long_name': "overstory"},
-                                 encoding={"_FillValue": fillval_i,
-                                               "Coordinates": "xc yc", 'dtype': 'int32'})
-   params['displacement'] = xr.DataArray(np.copy(arr_veg_classes_month),
-                                         dims=('veg_class','month','nj', 'ni'),
-                                         coords={'month': old_params['month'], 'xc': domain.xc,
-                                                 'yc': domain.yc},
-                                         attrs={'description': "Vegetation displacement height (typically 0.67 \
-                                                * vegetation height)",
-                                                'units': "m", 'long_name': "displacement"},
-                                         encoding={"_FillValue": fillval_f,
-                                               "Coordinates": "xc yc"})
-   params['veg_rough'] = xr.DataArray(np.copy(arr_veg_classes_month),
-                                         dims=('veg_class','month','nj', 'ni'),
-                                         coords={'xc': domain.xc, 'yc': domain.yc},
-                                         attrs={'description': "Vegetation roughness length (typically 0.123 \
-                                                * vegetation height)",
-                                                'units': "m", 'long_name': "veg_rough"},
-                                         encoding={"_FillValue": fillval_f,
-                                               "Coordinates": "xc yc"})
-   params['elev'] = xr.DataArray(np.copy(masknan_vals),
-                                dims=('nj', 'ni'),
-                                coords={'xc': domain.xc, 'yc': domain.yc},
-                                attrs={'description': "Average elevation of grid cell",
-                                              'units': "m", 'long_name': "elev"},
-                                encoding={"_FillValue": fillval_f,
-                                               "Coordinates": "xc yc"})
-   params['avg_T'] = xr.DataArray(np.copy(masknan_vals),
-                                dims=('nj', 'ni'),
-                                coords={'xc': domain.xc, 'yc': domain.yc},
-                                attrs={'description': "Average soil temperature, used as the bottom boundary \
-                                        for soil heat flux solutions",
-                                        'units': "C", 'long_name': "avg_T"},
-                                encoding={"_FillValue": fillval_f,
-                                               "Coordinates": "xc yc"})
-   params['annual_prec'] = xr.DataArray(np.copy(masknan_vals),
-                                dims=('nj', 'ni'),
-                                coords={'xc': domain.xc, 'yc': domain.yc},
-                                attrs={'description': "Average annual precipitation",
-                                              'units': "mm", 'long_name': "annual_prec"},
-                                encoding={"_FillValue": fillval_f,
-                                               "Coordinates": "xc yc"})
-   params['rough'] = xr.DataArray(np.copy(masknan_vals),
-                                dims=('nj', 'ni'),
-                                coords={'xc': domain.xc, 'yc': domain.yc},
-                                attrs={'description': "Surface roughness of bare soil",
-                                              'units': "m", 'long_name': "rough"},
-                                encoding={"_FillValue": fillval_f,
-                                               "Coordinates": "xc yc"})
-   params['root_depth'] = xr.DataArray(np.copy(arr_veg_classes_rootzone),
-                                         dims=('veg_class','root_zone','nj', 'ni'),
-                                         coords={'xc': domain.xc, 'yc': domain.yc},
-                                         attrs={'description': "Root zone thickness (sum of depths is total depth of \
-                                                 root penetration)",
-                                                'units': "m", 'long_name': "root_depth"},
-                                         encoding={"_FillValue": fillval_f,
-                                               "Coordinates": "xc yc"})
-   params['root_fract'] = xr.DataArray(np.copy(arr_veg_classes_rootzone),
-                                         dims=('veg_class','root_zone','nj', 'ni'),
-                                         coords={'xc': domain.xc, 'yc': domain.yc},
-                                         attrs={'description': "Fraction of root in the current root zone",
-                                                'units': "fraction", 'long_name': "root_fract"},
-                                         encoding={"_FillValue": fillval_f,
-                                               "Coordinates": "xc yc"})
-   params['Ds'] = xr.DataArray(np.copy(masknan_vals),
-                              dims=('nj', 'ni'),
-                              coords={'xc': domain.xc, 'yc': domain.yc},
-                              attrs={'description': "Fraction of Dsmax where non-linear baseflow begins",
-                                         'units': "fraction", 'long_name': "Ds"},
-                                 encoding={"_FillValue": fillval_f,
-                                           "Coordinates": "xc yc"})
-   params['Dsmax'] = xr.DataArray(np.copy(masknan_vals),
-                              dims=('nj', 'ni'),
-                              coords={'xc': domain.xc, 'yc': domain.yc},
-                              attrs={'description': "Fraction of maximum soil moisture where non-linear baseflow occurs",
-                                              'units': "fraction", 'long_name': "Dsmax"},
-                                 encoding={"_FillValue": fillval_f,
-                                           "Coordinates": "xc yc"})
-   params['Ws'] = xr.DataArray(np.copy(masknan_vals),
-                              dims=('nj', 'ni'),
-                              coords={'xc': domain.xc, 'yc': domain.yc},
-                              attrs={'description': "Fraction of maximum soil moisture where non-linear baseflow occurs",
-                                              'units': "fraction", 'long_name': "Ws"},
-                                 encoding={"_FillValue": fillval_f,
-                                           "Coordinates": "xc yc"})
-   params['c'] = xr.DataArray(np.copy(masknan_vals),
-                           dims=('nj', 'ni'),
-                           coords={'xc': domain.xc, 'yc': domain.yc},
-                           attrs={'description': "Exponent used in baseflow curve, normally set to 2",
-                                      'units': "N/A", 'long_name': "c"},
-                           encoding={"_FillValue": fillval_f,
-                                  "Coordinates": "xc yc"})
-   params['infilt'] = xr.DataArray(np.copy(masknan_vals),
-                              dims=('nj', 'ni'),
-                              coords={'xc': domain.xc, 'yc': domain.yc},
-                              attrs={'description': "Fraction of maximum soil moisture where non-linear baseflow occurs",
-                                              'units': "fraction", 'long_name': "infilt"},
-                                 encoding={"_FillValue": fillval_f,
-                                           "Coordinates": "xc yc"})
-   params['depth'] = xr.DataArray(np.copy(arr_nlayer),
-                                dims=('nlayer','nj', 'ni'),
-                                coords={'xc': domain.xc, 'yc': domain.yc},
-                                attrs={'description': "Thickness of each soil moisture layer",
-                                   'units': "m", 'long_name': "depth"},
-                                encoding={"_FillValue": fillval_f,
-                                       "Coordinates": "xc yc"})
-   params['Ksat'] = xr.DataArray(np.copy(arr_nlayer),
-                              dims=('nlayer','nj', 'ni'),
-                              coords={'xc': domain.xc, 'yc': domain.yc},
-                              attrs={'description': "Saturated hydraulic conductivity",
-                                       'units': "mm/day", 'long_name': "Ksat"},
-                              encoding={"_FillValue": fillval_f,
-                                         "Coordinates": "xc yc"})
-   params['bulk_density'] = xr.DataArray(np.copy(arr_nlayer),
-                                      dims=('nlayer','nj', 'ni'),
-                                      coords={'xc': domain.xc, 'yc': domain.yc},
-                                      attrs={'description': "Mineral bulk density of soil layer",
-                                             'units': "kg/m3", 'long_name': "bulk_density"},
-                                      encoding={"_FillValue": fillval_f,
-                                             "Coordinates": "xc yc"})
-   params['expt'] = xr.DataArray(np.copy(arr_nlayer),
-                                   dims=('nlayer','nj', 'ni'),
-                                   coords={'xc': domain.xc, 'yc': domain.yc},
-                                   attrs={'description': "Exponent n (=3+2/lambda) in Campbell's eqt for Ksat, HBH 5.6 \
-                                           where lambda = soil pore size distribution parameter",
-                                           'units': "N/A", 'long_name': "expt"},
-                                   encoding={"_FillValue": fillval_f,
-                                             "Coordinates": "xc yc"})
-   params['bubble'] = xr.DataArray(np.copy(arr_nlayer),
-                                         dims=('nlayer','nj', 'ni'),
-                                         coords={'xc': domain.xc, 'yc': domain.yc},
-                                         attrs={'description': "Bubbling pressure of soil. Values should be > 0",
-                                           'units': "cm", 'long_name': "bubble"},
-                                     encoding={"_FillValue": fillval_f,
-                                               "Coordinates": "xc yc"})
-   params['resid_moist'] = xr.DataArray(np.copy(arr_nlayer),
-                                         dims=('nlayer','nj', 'ni'),
-                                         coords={'xc': domain.xc, 'yc': domain.yc},
-                                         attrs={'description': "Soil moisture layer residual moisture",
-                                           'units': "fraction", 'long_name': "resid_moist"},
-                                         encoding={"_FillValue": fillval_f,
-                                               "Coordinates": "xc yc"})
-   params['quartz'] = xr.DataArray(np.copy(arr_nlayer),
-                                dims=('nlayer','nj', 'ni'),
-                                coords={'xc': domain.xc, 'yc': domain.yc},
-                                attrs={'description': "Quartz content of soil",
-                                       'units': "cm", 'long_name': "quartz"},
-                                encoding={"_FillValue": fillval_f,
-                                       "Coordinates": "xc yc"})
-   if bulk_density_comb == True:
-      params['bulk_density_comb'] = xr.DataArray(np.copy(arr_nlayer),
-                                      dims=('nlayer','nj', 'ni'),
-                                      coords={'xc': domain.xc, 'yc': domain.yc},
-                                      attrs={'description': "Soil bulk density of soil layer",
-                                             'units': "kg/m3", 'long_name': "bulk_density"},
-                                      encoding={"_FillValue": fillval_f,
-                                             "Coordinates": "xc yc"})
-   if organic_fract == True:
-      params['organic'] = xr.DataArray(np.copy(arr_nlayer),
-                                      dims=('nlayer','nj', 'ni'),
-                                      coords={'xc': domain.xc, 'yc': domain.yc},
-                                      attrs={'description': "soil organic carbon fraction",
-                                             'units': "fraction", 'long_name': "organic_fract"},
-                                      encoding={"_FillValue": fillval_f,
-                                             "Coordinates": "xc yc"})
-   params['soil_density'] = xr.DataArray(np.copy(arr_nlayer),
-                                      dims=('nlayer','nj', 'ni'),
-                                      coords={'xc': domain.xc, 'yc': domain.yc},
-                                      attrs={'description': "Soil particle density, normally 2685 kg/m3",
-                                       'units': "kg/m3", 'long_name': "soil_density"},
-                                      encoding={"_FillValue": fillval_f,
-                                           "Coordinates": "xc yc"})
-   if organic_fract == True:
-      params['soil_density_org'] = xr.DataArray(np.copy(arr_nlayer),
-                                      dims=('nlayer','nj', 'ni'),
-                                      coords={'xc': domain.xc, 'yc': domain.yc},
-                                      attrs={'description': "Organic matter particle density, normally 1300 kg/m3",
-                                       'units': "kg/m3", 'long_name': "soil_dens_org"},
-                                      encoding={"_FillValue": fillval_f,
-                                           "Coordinates": "xc yc"})
-   params['Wpwp_FRACT'] = xr.DataArray(np.copy(arr_nlayer),
-                                         dims=('nlayer','nj', 'ni'),
-                                         coords={'xc': domain.xc, 'yc': domain.yc},
-                                         attrs={'description': "Fractional soil moisture content at the \
-                                                wilting point (fraction of maximum moisture)",
-                                           'units': "fraction", 'long_name': "Wpwp_FRACT"},
-                                         encoding={"_FillValue": fillval_f,
-                                               "Coordinates": "xc yc"})
-   params['Wcr_FRACT'] = xr.DataArray(np.copy(arr_nlayer),
-                                         dims=('nlayer','nj', 'ni'),
-                                         coords={'xc': domain.xc, 'yc': domain.yc},
-                                         attrs={'description': "Fractional soil moisture content at the critical point \
-                                                (~70%% of field capacity) (fraction of maximum moisture)",
-                                           'units': "fraction", 'long_name': "Wcr_FRACT"},
-                                         encoding={"_FillValue": fillval_f,
-                                               "Coordinates": "xc yc"})
-   params['init_moist'] = xr.DataArray(np.copy(arr_nlayer),
-                                     dims=('nlayer','nj', 'ni'),
-                                     coords={'xc': domain.xc, 'yc': domain.yc},
-                                     attrs={'description': "Initial layer moisture content",
-                                           'units': "mm", 'long_name': "init_moist"},
-                                     encoding={"_FillValue": fillval_f,
-                                             "Coordinates": "xc yc"})
-   params['off_gmt'] = xr.DataArray(np.copy(masknan_vals),
-                                 dims=('nj', 'ni'),
-                                 coords={'xc': domain.xc, 'yc': domain.yc},
-                                 encoding={"_FillValue": fillval_f,
-                                               "Coordinates": "xc yc"})
-   params['phi_s'] = xr.DataArray(np.copy(arr_nlayer),
-                                    dims=('nlayer','nj', 'ni'),
-                                    coords={'xc': domain.xc, 'yc': domain.yc},
-                                    attrs={'description': "Soil moisture diffusion parameter",
-                                           'units': "mm/mm", 'long_name': "phi_s"},
-                                    encoding={"_FillValue": fillval_f,
-                                              "Coordinates": "xc yc"})
-   params['fs_active'] = xr.DataArray(np.copy(masknan_vals),
-                                dims=('nj', 'ni'),
-                                coords={'xc': domain.xc, 'yc': domain.yc},
-                                attrs={'description': "If set to 1, then frozen soil algorithm is activated for the \
-                                        grid cell. A 0 indicates that frozen soils are not computed if soil \
-                                        temperatures fall below 0C.",
-                                        'units': "binary", 'long_name': "fs_active"},
-                                encoding={"_FillValue": fillval_i,
-                                               "Coordinates": "xc yc", 'dtype': 'int32'})
-   params['dp'] = xr.DataArray(np.copy(masknan_vals),
-                                dims=('nj', 'ni'),
-                                coords={'xc': domain.xc, 'yc': domain.yc},
-                                attrs={'description': "Soil thermal damping depth (depth at which soil temperature) \
-                                        remains constant through the year, ~4 m",
-                                              'units': "m", 'long_name': "dp"},
-                                encoding={"_FillValue": fillval_f,
-                                               "Coordinates": "xc yc"})
-   params['snow_rough'] = xr.DataArray(np.copy(masknan_vals),
-                                    dims=('nj', 'ni'),
-                                    coords={'xc': domain.xc, 'yc': domain.yc},
-                                    attrs={'description': "Surface roughness of snowpack",
-                                              'units': "m", 'long_name': "snow_rough"},
-                                    encoding={"_FillValue": fillval_f,
-                                               "Coordinates": "xc yc"})
-   params['run_cell'] = xr.DataArray(np.copy(masknan_vals),
-                                       dims=('nj', 'ni'),
-                                       coords={'xc': domain.xc, 'yc': domain.yc},
-                                       attrs={'units': "N/A", 'long_name': "run_cell"},
-                                       encoding={"_FillValue": fillval_i,
-                                                 "Coordinates": "xc yc",
-                                                 "dtype": "int32"})
-   params['mask'] = xr.DataArray(np.copy(masknan_vals),
-                                   dims=('nj', 'ni'),
-                                   coords={'xc': domain.xc, 'yc': domain.yc},
-                                   attrs={'description': "0 value indicates cell is not active",
-                                          'units': "N/A", 'long_name': "mask", 'bounds': 'yv'},
-                                   encoding={"_FillValue": fillval_i,
-                                                 "Coordinates": "xc yc",
-                                                 "dtype": "int32"})
-   params['gridcell'] = xr.DataArray(np.copy(masknan_vals),
-                                       dims=('nj', 'ni'),
-                                       coords={'xc': domain.xc, 'yc': domain.yc},
-                                       attrs={'description': "Grid cell number",
-                                              'units': "N/A", 'long_name': "gridcell"},
-                                       encoding={"_FillValue": fillval_i,
-                                                 "Coordinates": "xc yc", "dtype": "int32"})
-   params['lats'] = xr.DataArray(np.copy(masknan_vals),
-                                   dims=('nj', 'ni'),
-                                   coords={'xc': domain.xc, 'yc': domain.yc},
-                                   attrs={'description': "Latitude of grid cell",
-                                              'units': "degrees", 'long_name': "lats"})
-   params['lons'] = xr.DataArray(np.copy(masknan_vals),
-                                   dims=('nj', 'ni'),
-                                   coords={'xc': domain.xc, 'yc': domain.yc},
-                                   attrs={'description': "Longitude of grid cell",
-                                          'units': "degrees", 'long_name': "lons"})
    params['xc'] = xr.DataArray(np.copy(masknan_vals),
                                  dims=('nj', 'ni'),
                                  attrs={'units': "degrees_east", 'long_name': "longitude of gridcell center",
@@ -1057,5 +1293,293 @@ def create_parameter_dataset(domain, old_params, nj, ni, num_veg,
                                  dims=('nv4', 'nj', 'ni'),
                                  attrs={'units': "degrees_north",
                                         'long_name': "latitude of grid cell vertices"})
+
+   print("expected memory of filled parameters on %d x %d grid: %.1f MB" % (nj, ni, filled_bytes / 1e6))
    return(params)
 
+def fill_parameter(params, name, values):
+    '''
+    takes in parameter DataSet, name of a data_var and its values (array or DataArray), and fills
+    the data_var with the values cast to its in-memory dtype, so only the compact array is kept
+    '''
+    params[name].values = np.asarray(values).astype(params[name].dtype, copy=False)
+
+# veg class data_vars where the bare soil PFT (0) is moved to the last veg class,
+# and the data_vars that are zero for the bare soil veg class
+BARE_SOIL_SWAP_VARS = ['Cv', 'trunk_ratio', 'rarc', 'rmin', 'wind_h', 'RGL', 'rad_atten', 'wind_atten',
+                       'albedo', 'LAI', 'overstory', 'root_depth', 'root_fract', 'displacement',
+                       'veg_rough', 'max_snow_albedo']
+BARE_SOIL_ZERO_VARS = ['root_fract', 'root_depth', 'displacement', 'veg_rough', 'overstory']
+# data_vars that keep their values outside of the domain mask
+UNMASKED_PARAMETERS = ['mask', 'fs_active', 'off_gmt']
+
+def finalize_parameter_values(name, values, mask):
+    '''
+    takes in name of a data_var, numpy array of its values and the domain mask (nj, ni) and
+    returns the values as they are written: bare soil swapped into the last veg class
+    (BARE_SOIL_SWAP_VARS, BARE_SOIL_ZERO_VARS) and NaN outside of the mask
+    '''
+    values = np.array(values)
+    if name in BARE_SOIL_SWAP_VARS:
+        values[[0, -1]] = values[[-1, 0]]
+    if name in BARE_SOIL_ZERO_VARS:
+        values[-1] = 0
+    if name not in UNMASKED_PARAMETERS:
+        values = np.where(mask == 1, values, np.nan).astype(values.dtype, copy=False)
+    return(values)
+
+def landcell_index(mask):
+    '''
+    takes in the domain mask (nj, ni) and returns (rows, cols) of its land gridcells (mask == 1),
+    in C order. their position is the `landcell` dimension of the land-only computation
+    '''
+    return(np.nonzero(np.asarray(mask) == 1))
+
+def gather_landcells(values, landcells):
+    '''
+    takes in DataArray or numpy array with (nj, ni) as its last two dims and the index from
+    `landcell_index`, and returns the land gridcells only, with (nj, ni) replaced by `landcell`.
+    dask-backed DataArrays are gathered lazily
+    '''
+    rows, cols = landcells
+    if isinstance(values, xr.DataArray):
+        return(values.isel(nj=xr.DataArray(rows, dims='landcell'), ni=xr.DataArray(cols, dims='landcell')))
+    return(np.asarray(values)[..., rows, cols])
+
+def scatter_landcells(values, landcells, nj, ni):
+    '''
+    takes in numpy array (..., landcell) from `gather_landcells`, its index and the grid size and
+    returns float numpy array (..., nj, ni) of the values, NaN outside of the land gridcells
+    '''
+    values = np.asarray(values)
+    dtype = values.dtype if values.dtype.kind == 'f' else np.float64
+    gridded = np.full(values.shape[:-1] + (nj, ni), np.nan, dtype=dtype)
+    gridded[..., landcells[0], landcells[1]] = values
+    return(gridded)
+
+def validate_parameters(params, organic_fract, max_snow_albedo, bulk_density_comb):
+    '''
+    takes in parameter DataSet and the booleans from [Options] and checks it against
+    PARAMETER_SCHEMA: every included variable has to be present with the dims from the schema.
+    then checks the soil moisture parameters with `validate_soil_moisture`, with the porosity
+    from the combined bulk density if `bulk_density_comb` is set. raises ValueError listing all
+    problems
+    '''
+    problems = []
+    for name, spec in selected_parameters(organic_fract, max_snow_albedo, bulk_density_comb).items():
+        if name not in params:
+            problems.append("%s is missing" % name)
+        elif params[name].dims != spec.dims:
+            problems.append("%s has dims %s, expected %s" % (name, params[name].dims, spec.dims))
+    if problems:
+        raise ValueError("invalid parameters: %s" % "; ".join(problems))
+
+    bulk_density = params['bulk_density_comb'] if bulk_density_comb else params['bulk_density']
+    porosity = 1 - (bulk_density.values / params['soil_density'].values)
+    validate_soil_moisture(params['depth'].values, porosity, params['Wcr_FRACT'].values,
+                           params['Wpwp_FRACT'].values, params['resid_moist'].values)
+
+def validate_soil_moisture(depth, porosity, wcr_fract, wpwp_fract, resid_moist):
+    '''
+    takes in arrays (nlayer, ...) of the soil layer depths (m), porosity, Wcr_FRACT, Wpwp_FRACT and
+    resid_moist and checks that the parameters don't make VIC crash: the wilting point moisture
+    can't be greater than the critical point moisture or less than the residual moisture.
+    gridcells outside of the mask (NaN) are not checked. raises ValueError listing all problems
+    '''
+    max_moist = depth * porosity * 1000
+    wcr = wcr_fract * max_moist
+    wpwp = wpwp_fract * max_moist
+    resid_moist_mm = resid_moist * depth * 1000
+
+    problems = []
+    with np.errstate(invalid='ignore'):
+        if np.any(wpwp > wcr):
+            problems.append("wilting point moisture is greater than critical point moisture")
+        if np.any(wpwp < resid_moist_mm):
+            problems.append("wilting point moisture is less than residual moisture")
+        # Wpwp_FRACT MUST be >= resid_moist / (1.0 - bulk_density/soil_density)
+        if np.any(wpwp_fract < resid_moist / porosity):
+            problems.append("Wpwp_FRACT is less than resid_moist / porosity")
+    if problems:
+        raise ValueError("invalid parameters: %s" % "; ".join(problems))
+
+def parameter_encoding(params):
+    '''
+    takes in parameter DataSet and returns the encoding for to_netcdf from PARAMETER_SCHEMA
+    (dtype, _FillValue, compression and chunking of each data_var in the schema)
+    '''
+    encoding = {'veg_class': {'dtype': 'int32'}}
+    for name in params.data_vars:
+        if name not in PARAMETER_SCHEMA:
+            continue
+        spec = PARAMETER_SCHEMA[name]
+        encoding[name] = {'dtype': np.dtype(spec.dtype).name,
+                          '_FillValue': parameter_fill_value(spec),
+                          'zlib': spec.zlib}
+        if spec.chunksizes is not None:
+            encoding[name]['chunksizes'] = spec.chunksizes
+    return(encoding)
+
+# f8 variables stored as f4 in compact parameter files: smooth fields whose float32 rounding
+# (~6e-8 relative) is far below the precision of their inputs. the other f8 variables keep their
+# dtype: lats/lons, Cv (VIC checks that it sums to 1), the depths, bulk densities and moisture
+# fractions VIC and `validate_soil_moisture` compare against each other, and init_moist, which
+# is at saturation and must not exceed the maximum moisture
+COMPACT_FLOAT32 = ['LAI', 'displacement', 'veg_rough', 'elev', 'avg_T', 'annual_prec', 'off_gmt',
+                   'Ksat', 'expt', 'bubble', 'organic']
+
+def parameter_chunksizes(dims, shape):
+    '''
+    takes in dims and shape of a variable and returns its chunk shape in compact parameter files:
+    one chunk per (nj, ni) field, as the VIC 5 image driver reads a parameter one field (veg class,
+    month, layer) at a time and scatters it to the gridcells. None for variables without nj/ni
+    '''
+    if not set(GRID_DIMS).issubset(dims):
+        return(None)
+    return(tuple(size if dim in GRID_DIMS else 1 for dim, size in zip(dims, shape)))
+
+def compact_parameter_spec(name):
+    '''
+    takes in name of a PARAMETER_SCHEMA variable and returns its ParameterSpec in compact parameter
+    files: f4 for the variables in COMPACT_FLOAT32, as in the schema otherwise
+    '''
+    spec = PARAMETER_SCHEMA[name]
+    if name in COMPACT_FLOAT32:
+        return(spec._replace(dtype='f4'))
+    return(spec)
+
+def compact_parameter_encoding(params, complevel=4):
+    '''
+    takes in parameter DataSet and zlib compression level and returns the encoding for to_netcdf
+    of `parameter_encoding` with every data_var in the schema compressed (zlib with shuffle),
+    chunked per (nj, ni) field and with the dtypes of `compact_parameter_spec`
+    '''
+    encoding = parameter_encoding(params)
+    for name in params.data_vars:
+        if name not in PARAMETER_SCHEMA:
+            continue
+        spec = compact_parameter_spec(name)
+        encoding[name].update({'dtype': np.dtype(spec.dtype).name, '_FillValue': parameter_fill_value(spec),
+                               'zlib': True, 'shuffle': True, 'complevel': complevel})
+        chunksizes = parameter_chunksizes(params[name].dims, params[name].shape)
+        if chunksizes is not None:
+            encoding[name]['chunksizes'] = chunksizes
+    return(encoding)
+
+def write_parameters(params, filename, compact=False, complevel=4):
+    '''
+    takes in parameter DataSet and the path of the parameter file and writes it with
+    `parameter_encoding`, or `compact_parameter_encoding` if `compact` is True.
+    returns the size of the file (bytes) and the wall time of the write (s)
+    '''
+    start = time.time()
+    if compact:
+        encoding = compact_parameter_encoding(params, complevel=complevel)
+    else:
+        encoding = parameter_encoding(params)
+    params.to_netcdf(filename, format='NETCDF4_CLASSIC', encoding=encoding)
+    return(os.path.getsize(filename), time.time() - start)
+
+def create_parameter_file(filename, domain, old_params, nj, ni, num_veg,
+                          organic_fract, max_snow_albedo, bulk_density_comb, compact=False):
+    '''
+    takes in path of the parameter file, the domain, old parameters (for the months), grid size and
+    the booleans from [Options], and creates the parameter file with every PARAMETER_SCHEMA
+    variable included by the options defined but not yet written (all _FillValue), laid out as
+    `create_parameter_dataset` + `write_parameters` would write it. the coordinates and grid cell
+    bounds are written from the domain. with `compact` the variables are compressed, chunked and
+    stored with the dtypes of `compact_parameter_spec`, as in `compact_parameter_encoding`.
+    returns the open netCDF4.Dataset, to fill with `write_parameter` and close
+    '''
+    fh = netCDF4.Dataset(filename, 'w', format='NETCDF4_CLASSIC')
+    for dim, size in (('veg_class', num_veg), ('nlayer', 3), ('month', len(old_params['month'])),
+                      ('nj', nj), ('ni', ni), ('root_zone', 2), ('nv4', 4)):
+        fh.createDimension(dim, size)
+
+    veg_class = fh.createVariable('veg_class', 'i4', ('veg_class',))
+    veg_class.long_name = "vegetation class"
+    veg_class[:] = np.arange(1, num_veg + 1)
+    fh.createVariable('nlayer', 'i4', ('nlayer',))[:] = np.arange(0, 3)
+    month = fh.createVariable('month', 'i4', ('month',))
+    month.setncatts(old_params['month'].attrs)
+    month[:] = old_params['month'].values
+    for name, units, long_name, bounds in (('xc', "degrees_east", "longitude of gridcell center", 'xv'),
+                                           ('yc', "degrees_north", "latitude of gridcell center", 'yv')):
+        var = fh.createVariable(name, 'f8', GRID_DIMS, fill_value=np.nan)
+        var.setncatts({'units': units, 'long_name': long_name, 'bounds': bounds})
+        var[:] = domain[name].values
+
+    for name, spec in selected_parameters(organic_fract, max_snow_albedo, bulk_density_comb).items():
+        options = {}
+        if compact:
+            spec = compact_parameter_spec(name)
+            options = {'zlib': True, 'shuffle': True, 'complevel': 4,
+                       'chunksizes': parameter_chunksizes(spec.dims, parameter_shape(spec, nj, ni, num_veg))}
+        elif spec.zlib or spec.chunksizes is not None:
+            options = {'zlib': spec.zlib, 'chunksizes': spec.chunksizes}
+        var = fh.createVariable(name, spec.dtype, spec.dims, fill_value=parameter_fill_value(spec), **options)
+        var.setncatts({'description': spec.description, 'units': spec.units, 'long_name': spec.long_name,
+                       'coordinates': "xc yc"})
+
+    for name, long_name in (('xv', "longitude of grid cell vertices"), ('yv', "latitude of grid cell vertices")):
+        var = fh.createVariable(name, 'f8', ('nv4',) + GRID_DIMS, fill_value=np.nan)
+        var.setncatts({'long_name': long_name, 'coordinates': "xc yc"})
+        var[:] = np.rollaxis(domain[name].values, axis=2)
+    return(fh)
+
+def write_parameter(fh, name, values, mask, rows=None):
+    '''
+    takes in parameter file from `create_parameter_file`, name of a data_var, its values and the
+    domain mask (nj, ni), and writes the values as `fill_parameter` + `finalize_parameter_values`
+    + `write_parameters` would: cast to the in-memory dtype, bare soil swapped, masked and NaN
+    written as _FillValue.
+    if `rows` (slice along nj) is given the values and the mask are those rows only, and are
+    written into their slice of the variable
+    '''
+    spec = PARAMETER_SCHEMA[name]
+    values = np.asarray(values).astype(parameter_memory_dtype(spec), copy=False)
+    values = np.ma.masked_invalid(finalize_parameter_values(name, values, mask))
+    if np.dtype(spec.dtype).kind == 'i':
+        values = np.ma.masked_array(np.around(values.filled(0)).astype(spec.dtype), mask=values.mask)
+    fh.variables[name][..., rows if rows is not None else slice(None), :] = values
+
+def parameter_chunks(params, chunk_size=None):
+    '''
+    takes in parameter DataSet and chunk size along nj and ni (the whole grid if None) and returns
+    the chunks of its Zarr store: one (nj, ni) field per veg class, month and layer, in tiles of
+    chunk_size x chunk_size gridcells if given
+    '''
+    return({dim: (chunk_size or -1) if dim in GRID_DIMS else 1 for dim in params.dims})
+
+def write_parameters_zarr(params, store, compact=False, chunk_size=None, workers=None):
+    '''
+    takes in parameter DataSet, path of the Zarr store, whether to store the compact dtypes of
+    `compact_parameter_encoding`, chunk size along nj and ni (see `parameter_chunks`) and number of
+    dask workers, and writes the parameters to the Zarr store with consolidated metadata.
+    every chunk is written by its own dask task on a thread pool (compression releases the GIL),
+    so there is no single writer. returns the size of the store (bytes) and the wall time (s)
+    '''
+    start = time.time()
+    if compact:
+        encoding = compact_parameter_encoding(params)
+    else:
+        encoding = parameter_encoding(params)
+    # the Zarr store is chunked by `parameter_chunks` and compressed by zarr, only keep the dtypes
+    encoding = {name: {key: value for key, value in var_encoding.items() if key in ('dtype', '_FillValue')}
+                for name, var_encoding in encoding.items()}
+    writes = params.chunk(parameter_chunks(params, chunk_size)).to_zarr(store, mode='w', encoding=encoding,
+                                                                        consolidated=True, compute=False)
+    writes.compute(scheduler='threads', num_workers=workers)
+
+    size = sum(os.path.getsize(os.path.join(direc, filename))
+               for direc, _, filenames in os.walk(store) for filename in filenames)
+    return(size, time.time() - start)
+
+def export_parameters_netcdf(store, filename, compact=False):
+    '''
+    takes in path of a Zarr store written by `write_parameters_zarr` and path of the parameter file,
+    and writes the parameters to NetCDF with `write_parameters` for VIC.
+    returns the size of the file (bytes) and the wall time (s)
+    '''
+    with xr.open_zarr(store, consolidated=True) as params:
+        return(write_parameters(params, filename, compact=compact))
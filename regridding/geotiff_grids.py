@@ -0,0 +1,160 @@
+#!/bin/env python
+'''
+lon/lat grids of GeoTIFFs for the GeoTIFF -> NetCDF converters and for reading GeoTIFFs directly
+in the regridding (windowed reads of the domain only).
+
+rasters in a geographic CRS (SoilGrids, WorldClim) are regular lon/lat grids, so their 1-D
+coordinates are the pixel centers of the affine transform and no coordinate transform is needed.
+other CRSs fall back to transforming every pixel center to EPSG:4326 (2-D lon/lat).
+grids are computed once per (crs, transform, shape) and shared by all files on that grid.
+'''
+
+import numpy as np
+import xarray as xr
+import netCDF4
+
+# lon, lat of every grid seen, by (crs, transform, shape)
+_grid_cache = {}
+
+def grid_key(crs, transform, shape):
+    return((crs.to_string(), tuple(transform), tuple(shape)))
+
+def affine_coords(transform, shape):
+    '''
+    takes in affine transform without rotation and (height, width) of a raster and returns 1-D arrays
+    of the x and y of the pixel centers
+    '''
+    height, width = shape
+    x = transform.c + (np.arange(width) + 0.5) * transform.a
+    y = transform.f + (np.arange(height) + 0.5) * transform.e
+    return(x, y)
+
+def grid_coords(crs, transform, shape):
+    '''
+    takes in crs, affine transform and (height, width) of a raster and returns lon, lat of the
+    pixel centers: 1-D arrays for geographic CRSs without rotation, 2-D arrays (height, width) otherwise
+    '''
+    key = grid_key(crs, transform, shape)
+    if key not in _grid_cache:
+        if crs.is_geographic and transform.b == 0 and transform.d == 0:
+            lon, lat = affine_coords(transform, shape)
+        else:
+            from rasterio.warp import transform as warp_transform
+            cols, rows = np.meshgrid(np.arange(shape[1]) + 0.5, np.arange(shape[0]) + 0.5)
+            x, y = transform * (cols, rows)
+            lon, lat = warp_transform(crs, {'init': 'EPSG:4326'}, x.flatten(), y.flatten())
+            lon = np.asarray(lon).reshape(shape)
+            lat = np.asarray(lat).reshape(shape)
+        _grid_cache[key] = (lon, lat)
+    return(_grid_cache[key])
+
+def geotiff_dataset(file, varname):
+    '''
+    takes in path to a single band GeoTIFF and the name of its variable and returns Dataset of the
+    band with lon/lat coordinates, (lat, lon) for geographic grids and (nj, ni) with xc/yc otherwise
+    '''
+    import rasterio
+    with rasterio.open(file) as dataset:
+        band = dataset.read(1)
+        lon, lat = grid_coords(dataset.crs, dataset.transform, band.shape)
+
+    ds = xr.Dataset()
+    if lon.ndim == 1:
+        ds.coords['lon'] = xr.DataArray(lon, dims=('lon',),
+                                        attrs={'long_name': "longitude", 'units': "degrees_east"})
+        ds.coords['lat'] = xr.DataArray(lat, dims=('lat',),
+                                        attrs={'long_name': "latitude", 'units': "degrees_north"})
+        ds[varname] = xr.DataArray(band, dims=('lat', 'lon'))
+    else:
+        ds['xc'] = xr.DataArray(lon, dims=('nj', 'ni'))
+        ds['yc'] = xr.DataArray(lat, dims=('nj', 'ni'))
+        ds[varname] = xr.DataArray(band, dims=('nj', 'ni'))
+    return(ds)
+
+def convert_geotiff(file, varname, savepath):
+    '''
+    takes in path to a single band GeoTIFF, the name of its variable and the path of the NetCDF
+    to write, and converts the GeoTIFF to a NetCDF file that CDO can read
+    '''
+    ds = geotiff_dataset(file, varname)
+    ds.to_netcdf(savepath, encoding={varname: {'dtype': 'float'}}, format='NETCDF4')
+
+    if 'xc' in ds:
+        # adjust file for using CDO
+        fh = netCDF4.Dataset(savepath, 'r+')
+
+        # fix xc attributes
+        fh.variables['xc'].long_name = "longitude of grid cell center"
+        fh.variables['xc'].units = "degrees_east"
+
+        # fix yc attributes
+        fh.variables['yc'].long_name = "latitude of grid cell center"
+        fh.variables['yc'].units = "degrees_north"
+
+        fh.variables[varname].coordinates = "xc yc"
+
+        fh.close()
+
+def domain_bounds(domain, halo=0.0):
+    '''
+    takes in domain Dataset and a halo (degrees) and returns (west, south, east, north) of the
+    domain gridcells (corners xv/yv if present, centers otherwise) widened by the halo.
+    longitudes are in [-180, 180], domains that cross the dateline span all longitudes
+    '''
+    lon = domain['xv'].values if 'xv' in domain else domain['xc'].values
+    lat = domain['yv'].values if 'yv' in domain else domain['yc'].values
+    lon = ((np.asarray(lon, dtype=np.float64) + 180) % 360) - 180
+    west, east = np.nanmin(lon) - halo, np.nanmax(lon) + halo
+    south, north = np.nanmin(lat) - halo, np.nanmax(lat) + halo
+    if west < -180 or east > 180:
+        west, east = -180.0, 180.0
+    return((west, max(south, -90.0), east, min(north, 90.0)))
+
+def crop_bounds(bounds, crop_box):
+    '''
+    takes in (west, south, east, north) and CDO style crop box (lon1, lon2, lat1, lat2) and returns
+    their intersection as (west, south, east, north)
+    '''
+    if crop_box is None:
+        return(bounds)
+    west, south, east, north = bounds
+    lon1, lon2, lat1, lat2 = crop_box
+    return((max(west, lon1), max(south, min(lat1, lat2)), min(east, lon2), min(north, max(lat1, lat2))))
+
+def window_slices(transform, shape, bounds):
+    '''
+    takes in affine transform without rotation, (height, width) of a raster and (west, south, east, north)
+    and returns the row and column slices of the pixels with their centers within the bounds
+    '''
+    height, width = shape
+    west, south, east, north = bounds
+    cols = sorted([(west - transform.c) / transform.a - 0.5, (east - transform.c) / transform.a - 0.5])
+    rows = sorted([(north - transform.f) / transform.e - 0.5, (south - transform.f) / transform.e - 0.5])
+    col_slice = slice(min(max(int(np.ceil(cols[0])), 0), width), min(max(int(np.floor(cols[1])) + 1, 0), width))
+    row_slice = slice(min(max(int(np.ceil(rows[0])), 0), height), min(max(int(np.floor(rows[1])) + 1, 0), height))
+    return(row_slice, col_slice)
+
+def read_geotiff_window(file, varname, bounds):
+    '''
+    takes in path to a single band GeoTIFF in a geographic CRS, the name of its variable and
+    (west, south, east, north), reads only the pixels within the bounds (windowed read) and returns
+    Dataset (lat, lon) of them, as `geotiff_dataset` but cropped
+    '''
+    import rasterio
+    from rasterio.windows import Window
+    with rasterio.open(file) as dataset:
+        if not dataset.crs.is_geographic:
+            raise ValueError("windowed reads need a geographic GeoTIFF, %s is in %s"
+                             % (file, dataset.crs.to_string()))
+        rows, cols = window_slices(dataset.transform, dataset.shape, bounds)
+        window = Window.from_slices(rows, cols)
+        band = dataset.read(1, window=window)
+        lon, lat = grid_coords(dataset.crs, dataset.window_transform(window), band.shape)
+
+    ds = xr.Dataset()
+    ds.coords['lon'] = xr.DataArray(lon, dims=('lon',),
+                                    attrs={'long_name': "longitude", 'units': "degrees_east"})
+    ds.coords['lat'] = xr.DataArray(lat, dims=('lat',),
+                                    attrs={'long_name': "latitude", 'units': "degrees_north"})
+    ds[varname] = xr.DataArray(band, dims=('lat', 'lon'))
+    return(ds)
@@ -0,0 +1,130 @@
+#!/bin/env python
+'''
+in-process nearest neighbour regridding with a KD-tree, an alternative to CDO that reproduces
+the regridding recipe of regrid_datasets.py on xarray objects:
+
+    sellonlatbox -> setvrange -> setmisstonn -> remapnn
+
+distances are taken between points on the unit sphere, as CDO does.
+'''
+
+import hashlib
+
+import numpy as np
+import xarray as xr
+from scipy.spatial import cKDTree
+
+LON_NAMES = ['xc', 'lon', 'longitude', 'LONGXY', 'x']
+LAT_NAMES = ['yc', 'lat', 'latitude', 'LATIXY', 'y']
+
+# nearest source point of every domain gridcell, by source grid and domain
+_remap_index_cache = {}
+
+def lonlat_to_xyz(lon, lat):
+    '''
+    takes in arrays of longitude and latitude (degrees) and returns (n, 3) array of
+    points on the unit sphere
+    '''
+    lon = np.deg2rad(np.ravel(lon))
+    lat = np.deg2rad(np.ravel(lat))
+    return(np.column_stack((np.cos(lat) * np.cos(lon), np.cos(lat) * np.sin(lon), np.sin(lat))))
+
+def find_coord(obj, names):
+    for name in names:
+        if name in obj.coords or name in getattr(obj, 'data_vars', {}):
+            return(obj[name])
+    raise ValueError("no coordinate out of %s found" % ", ".join(names))
+
+def source_lonlat(da, lon=None, lat=None):
+    '''
+    takes in DataArray with the horizontal grid in its last two dims and optionally its lon/lat
+    DataArrays (found by name if not given) and returns 2-D numpy arrays of lon and lat
+    '''
+    if lon is None:
+        lon = find_coord(da, LON_NAMES)
+    if lat is None:
+        lat = find_coord(da, LAT_NAMES)
+    lon = np.asarray(lon, dtype=np.float64)
+    lat = np.asarray(lat, dtype=np.float64)
+    if lon.ndim == 1 and lat.ndim == 1:
+        lon, lat = np.meshgrid(lon, lat)
+    return(lon, lat)
+
+def fill_missing_nearest(values, xyz):
+    '''
+    takes in (fields, points) array and the points as (points, 3) array on the unit sphere and fills
+    every missing value (NaN) from the nearest valid point of its field (CDO setmisstonn)
+    '''
+    values = np.array(values, dtype=np.float64)
+    trees = {}
+    for field in values:
+        missing = np.isnan(field)
+        if not missing.any() or missing.all():
+            continue
+        # fields with the same missing values (e.g. months of one dataset) share one tree
+        mask_key = hashlib.sha1(np.packbits(missing).tobytes()).hexdigest()
+        if mask_key not in trees:
+            valid_points = np.flatnonzero(~missing)
+            _, nearest = cKDTree(xyz[valid_points]).query(xyz[missing])
+            trees[mask_key] = valid_points[nearest]
+        field[missing] = field[trees[mask_key]]
+    return(values)
+
+def remap_index(src_xyz, domain):
+    '''
+    takes in source points (points, 3) on the unit sphere and the domain DataSet and returns
+    the index of the nearest source point of every domain gridcell, (nj, ni)
+    '''
+    key = (hashlib.sha1(src_xyz.tobytes()).hexdigest(),
+           hashlib.sha1(np.ascontiguousarray(domain['xc'].values, dtype=np.float64).tobytes() +
+                        np.ascontiguousarray(domain['yc'].values, dtype=np.float64).tobytes()).hexdigest())
+    if key not in _remap_index_cache:
+        _, nearest = cKDTree(src_xyz).query(lonlat_to_xyz(domain['xc'].values, domain['yc'].values))
+        _remap_index_cache[key] = nearest.reshape(domain['xc'].shape)
+    return(_remap_index_cache[key])
+
+def regrid_nearest(da, domain, valid_range=None, crop_box=None, lon=None, lat=None):
+    '''
+    takes in DataArray with the horizontal grid in its last two dims, domain DataSet, optional
+    valid range (vmin, vmax) and crop box (lon1, lon2, lat1, lat2), and returns the DataArray
+    remapped to the domain (..., nj, ni):
+    points outside of the crop box are dropped, values outside of the valid range are set to missing,
+    missing values are filled from the nearest valid point and every domain gridcell takes the value
+    of its nearest source point
+    '''
+    src_lon, src_lat = source_lonlat(da, lon, lat)
+    src_lon = ((src_lon.ravel() + 180) % 360) - 180
+    src_lat = src_lat.ravel()
+
+    lead_dims = da.dims[:-2]
+    values = np.asarray(da.values, dtype=np.float64).reshape((-1, src_lon.size))
+
+    if crop_box is not None:
+        lon1, lon2, lat1, lat2 = crop_box
+        in_box = ((src_lon >= lon1) & (src_lon <= lon2) & (src_lat >= min(lat1, lat2)) &
+                  (src_lat <= max(lat1, lat2)))
+        src_lon, src_lat, values = src_lon[in_box], src_lat[in_box], values[:, in_box]
+
+    src_xyz = lonlat_to_xyz(src_lon, src_lat)
+    if valid_range is not None:
+        vmin, vmax = valid_range
+        values = np.where((values >= vmin) & (values <= vmax), values, np.nan)
+        values = fill_missing_nearest(values, src_xyz)
+
+    nearest = remap_index(src_xyz, domain)
+    remapped = values[:, nearest].reshape(da.shape[:-2] + nearest.shape)
+
+    regridded = xr.DataArray(remapped, dims=lead_dims + ('nj', 'ni'),
+                             coords={dim: da[dim] for dim in lead_dims if dim in da.coords},
+                             attrs=da.attrs, name=da.name)
+    regridded.coords['xc'] = (('nj', 'ni'), domain['xc'].values)
+    regridded.coords['yc'] = (('nj', 'ni'), domain['yc'].values)
+    return(regridded)
+
+def parse_range(text):
+    '''
+    takes in CDO style 'a,b' string and returns tuple of floats, None for None
+    '''
+    if text is None:
+        return(None)
+    return(tuple(float(value) for value in text.split(',')))
@@ -1,23 +1,11 @@
 #!/bin/env python 
 
 import configparser
-import os
-from cdo import *
-cdo = Cdo()
+from regrid_datasets import regrid_datasets
 
 config = configparser.ConfigParser()
 config.read('regridding.cfg')
-domain_dir = config['Parameter Specs']['domain_file_dir']
-domain_file = config['Parameter Specs']['domain_file']
-domain = os.path.join(domain_dir, domain_file)
-grid = config['Parameter Specs']['grid']
 
-outdir = config['Parameter Specs']['output_dir']
-
-filename = os.path.join(config['Hydroclimate']['dir'],
-                        config['Hydroclimate']['brown_filename'])
-		
-# regrid file
-regrid_file = os.path.join(outdir, 'NCSCDv2_Circumpolar_WGS84_pfregion_extent_005deg_%s.nc' %grid)
-
-cdo.remapnn(domain, input=filename, output=regrid_file)
+# see REGRID_SPECS in regrid_datasets.py for the recipe
+if __name__ == "__main__":
+    regrid_datasets(config, ['brown_permafrost'])
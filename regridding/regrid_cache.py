@@ -0,0 +1,177 @@
+#!/bin/env python
+'''
+content-addressed cache of regridded files, shared by all runs (and users) of regrid_datasets.py
+(and of the hydroclimate stage of build_parameters.py) that point to the same cache directory.
+
+every regridded file is stored once, under the hash of the contents of its source file, its regrid
+recipe (RegridJob without the paths, engine, GeoTIFF halo) and the contents of the domain file.
+later runs with the same key copy the cached file to the output directory instead of regridding.
+the cache is capped in size, the least recently used files are evicted first: the modification
+time of a cached file is the time it was last stored or used.
+'''
+
+import collections
+import hashlib
+import json
+import os
+import shutil
+
+# bump when the regridding changes in a way the recipe doesn't capture, to invalidate the cache
+CACHE_VERSION = 1
+DEFAULT_CACHE_SIZE_GB = 100.0
+# hashes of the source files, by path, size and modification time, so unchanged sources
+# aren't hashed again on every run
+SOURCE_HASHES = 'source_hashes.json'
+
+def cache_stats():
+    '''
+    returns OrderedDict of the cache counters of a run, see `report_cache`
+    '''
+    return(collections.OrderedDict([('hits', 0), ('misses', 0), ('stored', 0), ('stored_bytes', 0),
+                                    ('evicted', 0), ('evicted_bytes', 0), ('files', 0), ('size', 0)]))
+
+def file_hash(filename):
+    '''
+    sha1 hex digest of the contents of a file
+    '''
+    key = hashlib.sha1()
+    with open(filename, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            key.update(block)
+    return(key.hexdigest())
+
+def source_hashes(cache_dir, filenames):
+    '''
+    takes in the cache directory and list of source files and returns dict of the content hash of
+    every file. hashes are stored in SOURCE_HASHES in the cache directory and only recomputed when
+    the path, size or modification time of a file changed
+    '''
+    index_file = os.path.join(cache_dir, SOURCE_HASHES)
+    try:
+        with open(index_file) as f:
+            index = json.load(f)
+    except (IOError, ValueError):
+        index = {}
+
+    hashes = {}
+    for filename in set(filenames):
+        stat = os.stat(filename)
+        path = os.path.abspath(filename)
+        signature = [stat.st_size, stat.st_mtime_ns]
+        if path not in index or index[path][:2] != signature:
+            index[path] = signature + [file_hash(filename)]
+        hashes[filename] = index[path][2]
+
+    # write to a temporary name first so concurrent runs never read a partial index
+    tmp_file = '%s.%d.tmp' % (index_file, os.getpid())
+    with open(tmp_file, 'w') as f:
+        json.dump(index, f)
+    os.replace(tmp_file, index_file)
+    return(hashes)
+
+def cache_key(job, source_hash, domain_hash, engine, halo=None):
+    '''
+    takes in RegridJob, content hashes of its source and of the domain file, the regrid engine and
+    the halo of GeoTIFF sources (None otherwise), and returns the key of its regridded file
+    '''
+    key = hashlib.sha1()
+    key.update(repr((CACHE_VERSION, engine, job.variable, job.valid_range, job.crop_box, halo)).encode())
+    key.update(source_hash.encode())
+    key.update(domain_hash.encode())
+    return(key.hexdigest())
+
+def script_key(script, source_hashes, domain_hash):
+    '''
+    takes in path of a script that derives a file from regridded files (e.g. the hydroclimate
+    masks), the content hashes of the files it reads and of the domain file, and returns the key
+    of its output. the key includes the contents of the script, so changes to it invalidate the cache
+    '''
+    key = hashlib.sha1()
+    key.update(repr((CACHE_VERSION, os.path.basename(script))).encode())
+    key.update(file_hash(script).encode())
+    for source_hash in source_hashes:
+        key.update(source_hash.encode())
+    key.update(domain_hash.encode())
+    return(key.hexdigest())
+
+def cached_file(cache_dir, key):
+    return(os.path.join(cache_dir, 'regridded_%s.nc' % key))
+
+def copy_file(source, destination):
+    '''
+    copies a file to a temporary name next to the destination and renames it, so the destination
+    is either complete or not there
+    '''
+    tmp_file = '%s.%d.tmp' % (destination, os.getpid())
+    try:
+        shutil.copyfile(source, tmp_file)
+        os.replace(tmp_file, destination)
+    finally:
+        if os.path.exists(tmp_file):
+            os.remove(tmp_file)
+
+def restore_cached(cache_dir, key, output, stats):
+    '''
+    takes in the cache directory, key of a regridded file, its output path and the cache counters,
+    copies the cached file to the output and marks it as used. returns False if it is not cached
+    '''
+    cached = cached_file(cache_dir, key)
+    try:
+        copy_file(cached, output)
+        os.utime(cached)
+    except (IOError, OSError):
+        # not cached, or evicted by another run in the meantime
+        stats['misses'] += 1
+        return(False)
+    stats['hits'] += 1
+    return(True)
+
+def store_cached(cache_dir, key, output, stats):
+    '''
+    takes in the cache directory, key of a regridded file, its output path and the cache counters,
+    and stores a copy of the output in the cache
+    '''
+    cached = cached_file(cache_dir, key)
+    copy_file(output, cached)
+    stats['stored'] += 1
+    stats['stored_bytes'] += os.path.getsize(cached)
+
+def evict_cached(cache_dir, max_bytes, stats):
+    '''
+    takes in the cache directory, its size cap (bytes) and the cache counters, and removes the least
+    recently used regridded files until the cache fits in the cap
+    '''
+    entries = []
+    for name in os.listdir(cache_dir):
+        if name.startswith('regridded_') and name.endswith('.nc'):
+            try:
+                stat = os.stat(os.path.join(cache_dir, name))
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, name))
+    entries.sort()
+
+    size = sum(entry[1] for entry in entries)
+    while entries and size > max_bytes:
+        _, file_size, name = entries.pop(0)
+        try:
+            os.remove(os.path.join(cache_dir, name))
+        except OSError:
+            # removed by another run in the meantime
+            pass
+        size -= file_size
+        stats['evicted'] += 1
+        stats['evicted_bytes'] += file_size
+    stats['files'] = len(entries)
+    stats['size'] = size
+
+def report_cache(cache_dir, stats):
+    '''
+    prints the cache counters of a run
+    '''
+    lookups = stats['hits'] + stats['misses']
+    print("regrid cache %s: %d hits, %d misses (%.0f%% hit rate), %d files stored (%.1f MB), "
+          "%d evicted (%.1f MB), %d files cached (%.1f MB)"
+          % (cache_dir, stats['hits'], stats['misses'], 100.0 * stats['hits'] / lookups if lookups else 0,
+             stats['stored'], stats['stored_bytes'] / 1e6, stats['evicted'], stats['evicted_bytes'] / 1e6,
+             stats['files'], stats['size'] / 1e6))
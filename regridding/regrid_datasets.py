@@ -0,0 +1,516 @@
+#!/bin/env python
+'''
+regrids the input datasets to the domain with CDO. every dataset is described by a RegridSpec
+and expanded into one job per file, and all jobs run on a pool of worker processes.
+
+recipe for each file: select variable -> crop to box -> set values outside of the valid range
+to missing -> fill missing values from the nearest valid neighbour -> nearest neighbour remap,
+run as one chained CDO call without intermediate files. the nearest neighbour weights are
+generated once per source grid (CDO gennn) and reused for every file on that grid (CDO remap).
+filling missing values before remapping keeps fill values from being remapped to coastal
+gridcells, solution adapted from https://code.mpimet.mpg.de/boards/2/topics/6172?r=6199
+
+with a cache directory (--cache-dir or `regrid_cache_dir`) regridded files are looked up in a
+content-addressed cache first and only the files that are not cached are regridded, see
+regrid_cache.py.
+
+usage: python regrid_datasets.py [dataset ...] [--workers N] [--cache-dir DIR] [--cache-size GB]
+'''
+
+import argparse
+import collections
+import configparser
+import hashlib
+import itertools
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+# source and output are patterns, filled in with config values, the grid name and every
+# combination of the values in `expand`.
+# variable: variable to select, None for all variables
+# valid_range: 'min,max' of valid values, None to skip the valid range and missing value fill
+# crop_box: 'lon1,lon2,lat1,lat2' box to crop to, None for no cropping
+# geotiff: patterns of the GeoTIFF the source is converted from and of its variable name, the GeoTIFF
+# is read directly (windowed to the domain) instead of the source with `read_geotiffs`
+RegridSpec = collections.namedtuple('RegridSpec', ['source', 'variable', 'valid_range', 'crop_box',
+                                                   'output', 'expand', 'geotiff'])
+RegridSpec.__new__.__defaults__ = ({}, None)
+
+RegridJob = collections.namedtuple('RegridJob', ['name', 'source', 'variable', 'valid_range',
+                                                 'crop_box', 'output'])
+
+SOIL_LAYERS = [1, 2, 3, 4, 5, 6, 7]
+MONTHS = ["01", "02", "03", "04", "05", "06", "07", "08", "09", "10", "11", "12"]
+NORTH_CROP_BOX = "-180,180,15,90"
+# halo (degrees) around the domain that is read from GeoTIFFs, so that missing values near the
+# edges of the domain are filled from the same neighbours as from the full files
+GEOTIFF_HALO = 2.0
+# SoilGrids file name of every soil variable, see batch_convert_soilgrid_geotiff_to_netcdf.py
+SOILGRIDS_CODES = {'bulk_density': 'BLDFIE', 'clay': 'CLYPPT', 'sand': 'SNDPPT', 'silt': 'SLTPPT',
+                   'coarse': 'CRFVOL', 'organic_fract': 'OCDENS'}
+SOILGRIDS_GEOTIFF = ('{soil_geotiff_dir}/{soilgrids_code}_M_sl{layer}_5km_ll.tif', '{soil_var}')
+
+REGRID_SPECS = collections.OrderedDict()
+# sand, silt, coarse, clay content, volumetric (%)
+REGRID_SPECS['soil_texture'] = RegridSpec(
+    '{soil_netcdf_dir}/{soil_var}_sl{layer}.nc', None, '0,100', NORTH_CROP_BOX,
+    '{soil_var}_sl{layer}_{grid}.nc', {'soil_var': ['clay', 'sand', 'silt', 'coarse'], 'layer': SOIL_LAYERS},
+    SOILGRIDS_GEOTIFF)
+# bulk density (kg/m3)
+REGRID_SPECS['bulk_density'] = RegridSpec(
+    '{soil_netcdf_dir}/{soil_var}_sl{layer}.nc', None, '50,3000', NORTH_CROP_BOX,
+    '{soil_var}_sl{layer}_{grid}.nc', {'soil_var': ['bulk_density'], 'layer': SOIL_LAYERS}, SOILGRIDS_GEOTIFF)
+# soil organic carbon content (g/kg)
+REGRID_SPECS['organic_fract'] = RegridSpec(
+    '{soil_netcdf_dir}/{soil_var}_sl{layer}.nc', None, '0,500', NORTH_CROP_BOX,
+    '{soil_var}_sl{layer}_{grid}.nc', {'soil_var': ['organic_fract'], 'layer': SOIL_LAYERS}, SOILGRIDS_GEOTIFF)
+REGRID_SPECS['pfts'] = RegridSpec(
+    '{pfts_dir}/{pfts_filename}', 'PCT_PFT', '0,100', NORTH_CROP_BOX, '{pfts_name}_{grid}.nc')
+REGRID_SPECS['veg_height'] = RegridSpec(
+    '{veg_dir}/{veg_filename}', 'MONTHLY_HEIGHT_TOP', '0.0,52.5', NORTH_CROP_BOX,
+    '{veg_height_name}_{grid}_veg_height.nc')
+REGRID_SPECS['lai'] = RegridSpec(
+    '{veg_dir}/{veg_filename}', 'MONTHLY_LAI', '0.0,7', NORTH_CROP_BOX, '{lai_name}_{grid}_lai.nc')
+REGRID_SPECS['worldclim'] = RegridSpec(
+    '{worldclim_netcdf_dir}/{clim_var}_{month}.nc', None, '-1000,1000', NORTH_CROP_BOX,
+    '{clim_var}_{month}_{grid}.nc', {'clim_var': ['tavg', 'prec'], 'month': MONTHS},
+    ('{worldclim_geotiff_dir}/wc2.0_10m_{clim_var}/wc2.0_10m_{clim_var}_{month}.tif', '{clim_var}'))
+# remap both land and ocean gridcells so that coastal gridcells are assigned valid values
+REGRID_SPECS['gtopo'] = RegridSpec(
+    '{gtopo_dir}/{gtopo_filename}', 'Band1', None, "-180,180,16.5,90", '{gtopo_name}_{grid}.nc')
+REGRID_SPECS['koppengeiger'] = RegridSpec(
+    '{hydroclimate_dir}/{koppen_filename}', 'Band1', '1,32', NORTH_CROP_BOX, '{koppen_name}_{grid}.nc')
+REGRID_SPECS['brown_permafrost'] = RegridSpec(
+    '{hydroclimate_dir}/{brown_filename}', None, None, None, '{brown_name}_{grid}.nc')
+REGRID_SPECS['off_gmt'] = RegridSpec(
+    '{other_dir}/{off_gmt_filename}', 'off_gmt', '-43198560000000,43199280000000', None,
+    '{gmt_regrid_name}_{grid}.nc')
+
+def config_fields(config):
+    '''
+    takes in ConfigParser of regridding.cfg and returns dict of the fields used in the
+    RegridSpec patterns
+    '''
+    def name(filename):
+        return(os.path.splitext(filename)[0])
+
+    fields = {'grid': config['Parameter Specs']['grid']}
+    for field, section, option in [('soil_netcdf_dir', 'Soil Data', 'netcdf_dir'),
+                                   ('soil_geotiff_dir', 'Soil Data', 'geotiff_dir'),
+                                   ('pfts_dir', 'PFTs', 'dir'), ('pfts_filename', 'PFTs', 'filename'),
+                                   ('veg_dir', 'Vegetation', 'dir'), ('veg_filename', 'Vegetation', 'filename'),
+                                   ('worldclim_netcdf_dir', 'WorldClim', 'netcdf_dir'),
+                                   ('worldclim_geotiff_dir', 'WorldClim', 'geotiff_dir'),
+                                   ('gtopo_dir', 'GTOPO', 'dir'), ('gtopo_filename', 'GTOPO', 'filename'),
+                                   ('hydroclimate_dir', 'Hydroclimate', 'dir'),
+                                   ('koppen_filename', 'Hydroclimate', 'koppen_filename'),
+                                   ('brown_filename', 'Hydroclimate', 'brown_filename'),
+                                   ('other_dir', 'Other', 'dir'),
+                                   ('off_gmt_filename', 'Other', 'off_gmt_filename')]:
+        if config.has_option(section, option):
+            fields[field] = config[section][option].strip()
+    for field, section, option in [('pfts_name', 'PFTs', 'filename'),
+                                   ('lai_name', 'Vegetation', 'lai_filename'),
+                                   ('veg_height_name', 'Vegetation', 'veg_height_filename'),
+                                   ('gtopo_name', 'GTOPO', 'filename'),
+                                   ('koppen_name', 'Hydroclimate', 'koppen_filename'),
+                                   ('brown_name', 'Hydroclimate', 'brown_filename'),
+                                   ('gmt_regrid_name', 'Other', 'gmt_regrid_filename')]:
+        if config.has_option(section, option):
+            fields[field] = name(config[section][option].strip())
+    return(fields)
+
+def regrid_jobs(config, datasets=None, read_geotiffs=False):
+    '''
+    takes in ConfigParser of regridding.cfg and names of REGRID_SPECS (all if None)
+    and returns list of RegridJob, one per file. with `read_geotiffs` the sources of the
+    datasets that are converted from GeoTIFFs are the GeoTIFFs
+    '''
+    fields = config_fields(config)
+    outdir = config['Parameter Specs']['output_dir']
+    jobs = []
+    for name in (datasets or REGRID_SPECS):
+        spec = REGRID_SPECS[name]
+        keys = list(spec.expand)
+        for values in itertools.product(*[spec.expand[key] for key in keys]):
+            job_fields = dict(fields, **dict(zip(keys, values)))
+            source, variable = spec.source, spec.variable
+            if read_geotiffs and spec.geotiff is not None:
+                source, variable = spec.geotiff
+                job_fields['soilgrids_code'] = SOILGRIDS_CODES.get(job_fields.get('soil_var'))
+                variable = variable.format(**job_fields)
+            jobs.append(RegridJob(name, source.format(**job_fields), variable,
+                                  spec.valid_range, spec.crop_box,
+                                  os.path.join(outdir, spec.output.format(**job_fields))))
+    return(jobs)
+
+def is_geotiff(job):
+    return(job.source.lower().endswith(('.tif', '.tiff')))
+
+def read_geotiff_source(job, domain_ds, halo=GEOTIFF_HALO):
+    '''
+    takes in GeoTIFF RegridJob, domain Dataset and a halo (degrees) and returns Dataset of the
+    part of the GeoTIFF within the crop box and the domain plus halo (windowed read)
+    '''
+    try:
+        from regridding.geotiff_grids import read_geotiff_window, domain_bounds, crop_bounds
+        from regridding.nearest_neighbour import parse_range
+    except ImportError:
+        from geotiff_grids import read_geotiff_window, domain_bounds, crop_bounds
+        from nearest_neighbour import parse_range
+    bounds = crop_bounds(domain_bounds(domain_ds, halo), parse_range(job.crop_box))
+    return(read_geotiff_window(job.source, job.variable, bounds))
+
+def stage_geotiff(job, domain, staging_dir, halo=GEOTIFF_HALO):
+    '''
+    takes in GeoTIFF RegridJob, path to the domain file, directory for the staged file and a halo
+    (degrees), writes the part of the GeoTIFF within the crop box and the domain plus halo to a
+    NetCDF file that CDO can read and returns the RegridJob of the staged file (already cropped)
+    and the wall time (s)
+    '''
+    import xarray as xr
+    start = time.time()
+    with xr.open_dataset(domain) as domain_ds:
+        source = read_geotiff_source(job, domain_ds, halo)
+    staged = os.path.join(staging_dir, os.path.splitext(os.path.basename(job.source))[0] + '.nc')
+    tmp_file = '%s.%d.tmp' % (staged, os.getpid())
+    try:
+        source.to_netcdf(tmp_file, encoding={var: {'dtype': 'float'} for var in source.data_vars},
+                         format='NETCDF4')
+        os.replace(tmp_file, staged)
+    finally:
+        if os.path.exists(tmp_file):
+            os.remove(tmp_file)
+    return(job._replace(source=staged, crop_box=None), time.time() - start)
+
+def grid_operators(job):
+    '''
+    takes in RegridJob and returns the chained CDO operators that select and crop the source,
+    these set the grid the file is remapped from
+    '''
+    operators = []
+    if job.crop_box is not None:
+        operators.append("-sellonlatbox,%s" % job.crop_box)
+    if job.variable is not None:
+        operators.append("-selname,%s" % job.variable)
+    return(" ".join(operators))
+
+def regrid_operators(job):
+    '''
+    takes in RegridJob and returns the chained CDO operators that feed the remapping,
+    innermost (applied first) last, e.g. "-setmisstonn -setvrange,0,100 -sellonlatbox,... -selname,X"
+    '''
+    operators = []
+    if job.valid_range is not None:
+        operators += ["-setmisstonn", "-setvrange,%s" % job.valid_range]
+    operators.append(grid_operators(job))
+    return(" ".join(operators).strip())
+
+def uses_weights(job):
+    '''
+    precomputed weights are only used for jobs with the missing value fill: without it the
+    missing values can differ between fields, and remapnn has to take them into account
+    '''
+    return(job.valid_range is not None)
+
+def weights_key(job, domain):
+    '''
+    takes in RegridJob and path to the domain file and returns a key for the nearest neighbour
+    weights from the grid of the source (CDO griddes), the select and crop operators and the
+    path, size and modification time of the domain file
+    '''
+    from cdo import Cdo
+    cdo = Cdo()
+    key = hashlib.sha1()
+    key.update("\n".join(cdo.griddes(input=job.source)).encode())
+    stat = os.stat(domain)
+    key.update(repr((grid_operators(job), os.path.abspath(domain), stat.st_size, stat.st_mtime_ns)).encode())
+    return(key.hexdigest()[:16])
+
+def weights_file(weights_dir, key):
+    return(os.path.join(weights_dir, 'remapnn_weights_%s.nc' % key))
+
+def generate_weights(job, domain, weights_file):
+    '''
+    takes in RegridJob, path to the domain file and the weights file, generates the nearest
+    neighbour weights from the grid of the job to the domain (CDO gennn) and returns the wall time (s)
+    '''
+    from cdo import Cdo
+    cdo = Cdo()
+    start = time.time()
+    tmp_file = '%s.%d.tmp' % (weights_file, os.getpid())
+    try:
+        cdo.gennn(domain, input=("%s %s" % (grid_operators(job), job.source)).strip(), output=tmp_file)
+        os.replace(tmp_file, weights_file)
+    finally:
+        if os.path.exists(tmp_file):
+            os.remove(tmp_file)
+    return(time.time() - start)
+
+def regrid_file(job, domain, weights_file=None):
+    '''
+    takes in RegridJob, path to the domain file and optionally precomputed weights for the grid
+    of the job, regrids the file of the job with one chained CDO call (no intermediate files) and
+    returns the output file and the wall time (s).
+    the output is written to a temporary name and only renamed to the output file on success
+    '''
+    from cdo import Cdo
+    cdo = Cdo()
+    start = time.time()
+
+    source = ("%s %s" % (regrid_operators(job), job.source)).strip()
+    tmp_file = '%s.%d.tmp' % (job.output, os.getpid())
+    try:
+        # remap both land and ocean gridcells so that coastal gridcells are assigned valid values
+        if weights_file is None:
+            cdo.remapnn(domain, input=source, output=tmp_file)
+        else:
+            cdo.remap(domain, weights_file, input=source, output=tmp_file)
+        os.replace(tmp_file, job.output)
+    finally:
+        if os.path.exists(tmp_file):
+            os.remove(tmp_file)
+    return(job.output, time.time() - start)
+
+def regrid_file_native(job, domain, halo=GEOTIFF_HALO):
+    '''
+    takes in RegridJob, path to the domain file and the halo of GeoTIFF sources, regrids the file of
+    the job in-process with `nearest_neighbour.regrid_nearest` (no CDO) and returns the output file
+    and the wall time (s). GeoTIFF sources are read windowed to the domain.
+    the output is written to a temporary name and only renamed to the output file on success
+    '''
+    import xarray as xr
+    try:
+        from regridding.nearest_neighbour import regrid_nearest, parse_range, LON_NAMES, LAT_NAMES
+    except ImportError:
+        from nearest_neighbour import regrid_nearest, parse_range, LON_NAMES, LAT_NAMES
+    start = time.time()
+
+    with xr.open_dataset(domain) as domain_ds:
+        if is_geotiff(job):
+            source = read_geotiff_source(job, domain_ds, halo)
+        else:
+            source = xr.open_dataset(job.source)
+        with source:
+            if job.variable is not None:
+                variables = [job.variable]
+            else:
+                variables = [var for var in source.data_vars
+                             if source[var].ndim >= 2 and var not in LON_NAMES + LAT_NAMES]
+            regridded = xr.Dataset()
+            for var in variables:
+                regridded[var] = regrid_nearest(source[var], domain_ds, parse_range(job.valid_range),
+                                                parse_range(job.crop_box))
+
+        tmp_file = '%s.%d.tmp' % (job.output, os.getpid())
+        try:
+            regridded.to_netcdf(tmp_file)
+            os.replace(tmp_file, job.output)
+        finally:
+            if os.path.exists(tmp_file):
+                os.remove(tmp_file)
+    return(job.output, time.time() - start)
+
+def run_pool(executor, func, args, name, report=None):
+    '''
+    submits func(*item) for every item in args to the executor and returns dict of
+    item index -> result for the items that succeeded. name(item) describes an item in
+    failure messages, report(item, result) is called as soon as an item is done
+    '''
+    futures = {executor.submit(func, *item): i for i, item in enumerate(args)}
+    results = {}
+    for future in as_completed(futures):
+        i = futures[future]
+        try:
+            results[i] = future.result()
+        except Exception as err:
+            print("   %s failed: %s" % (name(args[i]), err))
+            continue
+        if report is not None:
+            report(args[i], results[i])
+    return(results)
+
+def regrid_datasets(config, datasets=None, workers=None, weights_dir=None, engine=None,
+                    read_geotiffs=None, cache_dir=None, cache_size=None):
+    '''
+    takes in ConfigParser of regridding.cfg, names of REGRID_SPECS (all if None) and number
+    of worker processes (number of cpus if None), regrids all files of the datasets and
+    prints the wall time of every file. raises RuntimeError if any file fails.
+
+    `engine` is "cdo" or "native" (`regrid_engine` in [Parameter Specs], default "cdo").
+    with CDO nearest neighbour weights are generated once per source grid and domain and stored in
+    `weights_dir` (`weights_dir` in [Parameter Specs], default remap_weights/ in output_dir),
+    every file on that grid is then remapped with the stored weights.
+    the native engine regrids in-process with a KD-tree and doesn't need CDO.
+
+    with `read_geotiffs` (`read_geotiffs` in [Parameter Specs], default False) the SoilGrids and
+    WorldClim GeoTIFFs are read directly instead of their converted NetCDF files, only the part
+    within the crop box and the domain plus `geotiff_halo` degrees (default GEOTIFF_HALO) is read.
+    for CDO that part is staged to a NetCDF file in geotiff_windows/ in output_dir first.
+
+    with `cache_dir` (`regrid_cache_dir` in [Parameter Specs], no cache if not set) every file is
+    first looked up in the cache of regridded files, only the misses are regridded and then stored in
+    the cache. the cache is capped at `cache_size` GB (`regrid_cache_size`, default
+    DEFAULT_CACHE_SIZE_GB), least recently used files are evicted first. cache statistics are
+    printed at the end of the run
+    '''
+    domain = os.path.join(config['Parameter Specs']['domain_file_dir'],
+                          config['Parameter Specs']['domain_file'])
+    if engine is None:
+        engine = config['Parameter Specs'].get('regrid_engine', 'cdo')
+    if engine not in ("cdo", "native"):
+        raise ValueError("unknown regrid engine %s, use cdo or native" % engine)
+    if read_geotiffs is None:
+        read_geotiffs = config.getboolean('Parameter Specs', 'read_geotiffs', fallback=False)
+    halo = config.getfloat('Parameter Specs', 'geotiff_halo', fallback=GEOTIFF_HALO)
+    if cache_dir is None:
+        cache_dir = config['Parameter Specs'].get('regrid_cache_dir')
+    jobs = regrid_jobs(config, datasets, read_geotiffs)
+    total = len(jobs)
+
+    start = time.time()
+    if cache_dir is not None:
+        try:
+            from regridding import regrid_cache
+        except ImportError:
+            import regrid_cache
+        if cache_size is None:
+            cache_size = config.getfloat('Parameter Specs', 'regrid_cache_size',
+                                         fallback=regrid_cache.DEFAULT_CACHE_SIZE_GB)
+        os.makedirs(cache_dir, exist_ok=True)
+        stats = regrid_cache.cache_stats()
+        sources = regrid_cache.source_hashes(cache_dir, [job.source for job in jobs] + [domain])
+        keys = {job: regrid_cache.cache_key(job, sources[job.source], sources[domain], engine,
+                                            halo if is_geotiff(job) else None) for job in jobs}
+        jobs = [job for job in jobs if not regrid_cache.restore_cached(cache_dir, keys[job], job.output, stats)]
+        print("%d of %d files restored from the regrid cache" % (total - len(jobs), total))
+
+    if not jobs:
+        regridded = []
+    elif engine == "native":
+        regridded = regrid_datasets_native(jobs, domain, workers, halo)
+    else:
+        if weights_dir is None:
+            weights_dir = config['Parameter Specs'].get('weights_dir',
+                                                        os.path.join(config['Parameter Specs']['output_dir'],
+                                                                     'remap_weights'))
+        regridded = regrid_datasets_cdo(jobs, domain, workers, weights_dir,
+                                        os.path.join(config['Parameter Specs']['output_dir'], 'geotiff_windows'),
+                                        halo)
+
+    if cache_dir is not None:
+        for job in jobs:
+            if job.output in regridded:
+                regrid_cache.store_cached(cache_dir, keys[job], job.output, stats)
+        regrid_cache.evict_cached(cache_dir, cache_size * 1e9, stats)
+        regrid_cache.report_cache(cache_dir, stats)
+
+    failed = len(jobs) - len(regridded)
+    print("regridded %d files in %.1f s" % (len(regridded), time.time() - start))
+    if failed:
+        raise RuntimeError("regridding failed for %d of %d files" % (failed, total))
+
+def regrid_datasets_cdo(jobs, domain, workers, weights_dir, staging_dir, halo=GEOTIFF_HALO):
+    '''
+    regrids the RegridJobs with CDO on a pool of worker processes, GeoTIFF sources are staged to
+    `staging_dir` first, see `regrid_datasets`. returns list of the output files that were regridded
+    '''
+    os.makedirs(weights_dir, exist_ok=True)
+    print("regridding %d files with %s workers" % (len(jobs), workers or os.cpu_count()))
+
+    # the GeoTIFF windows staged for CDO are removed even if the run fails
+    staged_files = []
+    try:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            # read the domain part of every GeoTIFF into a file CDO can read
+            tiff_jobs = [job for job in jobs if is_geotiff(job)]
+            if tiff_jobs:
+                os.makedirs(staging_dir, exist_ok=True)
+                staged = run_pool(executor, stage_geotiff, [(job, domain, staging_dir, halo) for job in tiff_jobs],
+                                  lambda item: "reading %s" % item[0].source,
+                                  lambda item, result: print("   %s: read %s in %.1f s"
+                                                             % (item[0].name, os.path.basename(item[0].source),
+                                                                result[1])))
+                staged_files = [staged[i][0].source for i in sorted(staged)]
+                jobs = ([job for job in jobs if not is_geotiff(job)] +
+                        [staged[i][0] for i in sorted(staged)])
+
+            # key the weights of every job on its source grid
+            weight_jobs = [job for job in jobs if uses_weights(job)]
+            keys = run_pool(executor, weights_key, [(job, domain) for job in weight_jobs],
+                            lambda item: "grid description of %s" % item[0].source)
+            job_weights = {}
+            grid_jobs = collections.OrderedDict()
+            for i, key in keys.items():
+                job_weights[weight_jobs[i]] = weights_file(weights_dir, key)
+                grid_jobs.setdefault(job_weights[weight_jobs[i]], weight_jobs[i])
+
+            # generate the weights of every grid that has none yet
+            missing = [(job, domain, grid_weights) for grid_weights, job in grid_jobs.items()
+                       if not os.path.exists(grid_weights)]
+            generated = run_pool(executor, generate_weights, missing,
+                                 lambda item: "weights for %s" % item[0].source,
+                                 lambda item, elapsed: print("   %s: weights for %s in %.1f s"
+                                                             % (item[0].name, os.path.basename(item[2]),
+                                                                elapsed)))
+            print("%d source grids, %d weights generated" % (len(grid_jobs), len(generated)))
+
+            regrid_args = [(job, domain, job_weights.get(job)) for job in jobs
+                           if not uses_weights(job) or job_weights.get(job) in grid_jobs]
+            regridded = run_pool(executor, regrid_file, regrid_args,
+                                 lambda item: "regridding %s" % item[0].source,
+                                 lambda item, result: print("   %s: %s in %.1f s"
+                                                            % (item[0].name, os.path.basename(result[0]),
+                                                               result[1])))
+    finally:
+        for staged_file in staged_files:
+            if os.path.exists(staged_file):
+                os.remove(staged_file)
+    return([output for output, _ in regridded.values()])
+
+def regrid_datasets_native(jobs, domain, workers, halo=GEOTIFF_HALO):
+    '''
+    regrids the RegridJobs with `regrid_file_native` on a pool of worker processes,
+    see `regrid_datasets`. returns list of the output files that were regridded
+    '''
+    print("regridding %d files natively with %s workers" % (len(jobs), workers or os.cpu_count()))
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        regridded = run_pool(executor, regrid_file_native, [(job, domain, halo) for job in jobs],
+                             lambda item: "regridding %s" % item[0].source,
+                             lambda item, result: print("   %s: %s in %.1f s"
+                                                        % (item[0].name, os.path.basename(result[0]),
+                                                           result[1])))
+    return([output for output, _ in regridded.values()])
+
+def main():
+    parser = argparse.ArgumentParser(description="regrid input datasets to the domain")
+    parser.add_argument('datasets', nargs='*',
+                        help="datasets to regrid, any of %s (default: all)" % ", ".join(REGRID_SPECS))
+    parser.add_argument('--config', default='regridding.cfg', help="config file")
+    parser.add_argument('--workers', type=int, default=None,
+                        help="number of worker processes (default: number of cpus)")
+    parser.add_argument('--engine', choices=['cdo', 'native'], default=None,
+                        help="regrid with CDO or in-process (default: regrid_engine in config or cdo)")
+    parser.add_argument('--read-geotiffs', action='store_true', default=None,
+                        help="read the SoilGrids and WorldClim GeoTIFFs directly, windowed to the domain "
+                             "(default: read_geotiffs in config or False)")
+    parser.add_argument('--cache-dir', default=None,
+                        help="cache of regridded files, only files that are not cached are regridded "
+                             "(default: regrid_cache_dir in config, no cache if not set)")
+    parser.add_argument('--cache-size', type=float, default=None,
+                        help="size cap of the cache in GB, least recently used files are evicted first "
+                             "(default: regrid_cache_size in config or 100)")
+    args = parser.parse_args()
+    unknown = [name for name in args.datasets if name not in REGRID_SPECS]
+    if unknown:
+        parser.error("unknown datasets: %s" % ", ".join(unknown))
+
+    config = configparser.ConfigParser()
+    config.read(args.config)
+    regrid_datasets(config, args.datasets or None, workers=args.workers, engine=args.engine,
+                    read_geotiffs=args.read_geotiffs, cache_dir=args.cache_dir, cache_size=args.cache_size)
+
+if __name__ == "__main__":
+    main()
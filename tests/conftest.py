@@ -0,0 +1,29 @@
+import os
+import sys
+
+import numpy as np
+import pytest
+import xarray as xr
+
+# the modules are flat scripts at the root of the repo and in regridding/
+REPO_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir)
+sys.path.insert(0, REPO_DIR)
+sys.path.insert(0, os.path.join(REPO_DIR, 'regridding'))
+
+@pytest.fixture
+def domain():
+    '''
+    6 x 8 domain with a few ocean (mask 0) gridcells
+    '''
+    nj, ni = 6, 8
+    yc, xc = np.meshgrid(np.linspace(60, 65, nj), np.linspace(-150, -143, ni), indexing='ij')
+    mask = np.ones((nj, ni), dtype=np.int32)
+    mask[0, :3] = 0
+    mask[4, 5] = 0
+    return(xr.Dataset({'mask': (('nj', 'ni'), mask), 'xc': (('nj', 'ni'), xc), 'yc': (('nj', 'ni'), yc),
+                       'xv': (('nj', 'ni', 'nv'), np.stack([xc] * 4, axis=-1)),
+                       'yv': (('nj', 'ni', 'nv'), np.stack([yc] * 4, axis=-1))}))
+
+@pytest.fixture
+def old_params():
+    return(xr.Dataset({'month': ('month', np.arange(1, 13))}))
@@ -0,0 +1,85 @@
+import collections
+import configparser
+import hashlib
+import os
+
+import numpy as np
+import xarray as xr
+
+import build_parameters
+
+def input_hash(value):
+    key = hashlib.sha1()
+    build_parameters.update_input_hash(key, value)
+    return(key.hexdigest())
+
+def test_update_input_hash_values():
+    values = np.arange(4)
+    assert input_hash(values) == input_hash(np.arange(4))
+    assert input_hash(values) != input_hash(values.astype(np.float64))
+    assert input_hash(values) != input_hash(values.reshape(2, 2))
+    assert input_hash([(1, 2), 3]) != input_hash([1, (2, 3)])
+    assert input_hash({'a': 1}) != input_hash({'a': 2})
+
+def test_file_input_hash_ignores_global_attributes(tmp_path):
+    filename = os.path.join(str(tmp_path), 'input.nc')
+    ds = xr.Dataset({'LAI': (('nj', 'ni'), np.ones((2, 3)))}, attrs={'history': 'regridded at 10:00'})
+    ds.to_netcdf(filename)
+    key = build_parameters.file_input_hash(filename)
+
+    ds.attrs['history'] = 'regridded at 11:00'
+    ds.to_netcdf(filename)
+    assert build_parameters.file_input_hash(filename) == key
+
+    ds['LAI'][0, 0] = 2
+    ds.to_netcdf(filename)
+    assert build_parameters.file_input_hash(filename) != key
+
+def incremental_context(tmp_path, domain, monkeypatch):
+    '''
+    context with one input file per parameter stage, see `stage_keys`
+    '''
+    output_dir = str(tmp_path)
+    domain.to_netcdf(os.path.join(output_dir, 'domain.nc'))
+    config = configparser.ConfigParser()
+    config.read_dict({'Parameter Specs': {'domain_file_dir': output_dir, 'domain_file': 'domain.nc'}})
+    files = {}
+    for stage in build_parameters.PARAMETER_DEPENDENCIES:
+        files[stage] = os.path.join(output_dir, '%s.nc' % stage)
+        xr.Dataset({'values': ('x', np.zeros(3))}).to_netcdf(files[stage])
+
+    def stage_inputs(context):
+        return(collections.OrderedDict((stage, {'files': [filename], 'values': [('option', 1)]})
+                                       for stage, filename in files.items()))
+    monkeypatch.setattr(build_parameters, 'stage_inputs', stage_inputs)
+    context = {'config': config, 'organic_fract': True, 'max_snow_albedo': True,
+               'bulk_density_comb': True, 'compact': False}
+    return(context, files)
+
+def changed_stages(keys, new_keys):
+    return([stage for stage in keys if keys[stage] != new_keys[stage]])
+
+def test_stage_keys_follow_inputs_and_dependencies(tmp_path, domain, monkeypatch):
+    context, files = incremental_context(tmp_path, domain, monkeypatch)
+    keys = build_parameters.stage_keys(context)
+    assert list(keys) == list(build_parameters.PARAMETER_DEPENDENCIES) + ['layout']
+    assert build_parameters.stage_keys(context) == keys
+
+    # a new LAI climatology only changes the veg stage
+    xr.Dataset({'values': ('x', np.ones(3))}).to_netcdf(files['veg'])
+    veg_keys = build_parameters.stage_keys(context)
+    assert changed_stages(keys, veg_keys) == ['veg']
+
+    # the assemble stage depends on the soil parameters
+    xr.Dataset({'values': ('x', np.ones(3))}).to_netcdf(files['soil'])
+    assert changed_stages(veg_keys, build_parameters.stage_keys(context)) == ['soil', 'assemble']
+
+def test_stage_keys_layout(tmp_path, domain, monkeypatch):
+    context, _ = incremental_context(tmp_path, domain, monkeypatch)
+    keys = build_parameters.stage_keys(context)
+
+    context['compact'] = True
+    assert changed_stages(keys, build_parameters.stage_keys(context)) == ['layout']
+    context['compact'] = False
+    context['organic_fract'] = False
+    assert changed_stages(keys, build_parameters.stage_keys(context)) == ['layout']
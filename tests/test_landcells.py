@@ -0,0 +1,38 @@
+import numpy as np
+import xarray as xr
+
+from parameter_functions import landcell_index, gather_landcells, scatter_landcells
+
+def test_gather_scatter_round_trip(domain):
+    mask = domain['mask'].values
+    nj, ni = mask.shape
+    landcells = landcell_index(mask)
+    assert landcells[0].size == (mask == 1).sum()
+
+    values = np.random.default_rng(0).uniform(0, 1, (2, 12, nj, ni))
+    land = gather_landcells(values, landcells)
+    assert land.shape == (2, 12, landcells[0].size)
+
+    gridded = scatter_landcells(land, landcells, nj, ni)
+    np.testing.assert_array_equal(gridded, np.where(mask == 1, values, np.nan))
+
+def test_gather_dataarray_matches_numpy(domain):
+    mask = domain['mask'].values
+    landcells = landcell_index(mask)
+    values = xr.DataArray(np.random.default_rng(1).uniform(0, 1, (3,) + mask.shape),
+                          dims=('nlayer', 'nj', 'ni')).chunk({'nj': 2})
+
+    land = gather_landcells(values, landcells)
+    assert land.dims == ('nlayer', 'landcell')
+    assert land.chunks is not None
+    np.testing.assert_array_equal(land.values, gather_landcells(values.values, landcells))
+
+def test_scatter_integer_values_as_float(domain):
+    mask = domain['mask'].values
+    nj, ni = mask.shape
+    landcells = landcell_index(mask)
+
+    gridded = scatter_landcells(np.arange(landcells[0].size), landcells, nj, ni)
+    assert gridded.dtype == np.float64
+    assert np.isnan(gridded[mask != 1]).all()
+    np.testing.assert_array_equal(gridded[mask == 1], np.arange(landcells[0].size))
@@ -0,0 +1,63 @@
+import os
+
+import numpy as np
+import netCDF4
+from netCDF4 import default_fillvals
+
+from parameter_functions import (create_parameter_dataset, fill_parameter, compact_parameter_encoding,
+                                 write_parameters, create_parameter_file, write_parameter,
+                                 finalize_parameter_values, COMPACT_FLOAT32, PARAMETER_SCHEMA)
+
+def test_compact_encoding_keeps_f8_outside_of_allowlist(domain, old_params):
+    nj, ni = domain['mask'].shape
+    params = create_parameter_dataset(domain, old_params, nj, ni, 17, True, True, True)
+    # values whose float32 rounding matters: init_moist at saturation next to the maximum moisture
+    fill_parameter(params, 'init_moist', np.full(params['init_moist'].shape, 123.456789012345))
+    encoding = compact_parameter_encoding(params)
+
+    assert encoding['init_moist']['dtype'] == 'float64'
+    for name in ('Cv', 'depth', 'Wpwp_FRACT', 'Wcr_FRACT', 'resid_moist', 'lats', 'lons'):
+        assert encoding[name]['dtype'] == 'float64', name
+    for name in COMPACT_FLOAT32:
+        assert PARAMETER_SCHEMA[name].dtype == 'f8'
+        assert encoding[name]['dtype'] == 'float32', name
+        assert encoding[name]['_FillValue'] == default_fillvals['f4']
+    assert all(encoding[name]['zlib'] for name in params.data_vars if name in PARAMETER_SCHEMA)
+
+def test_compact_file_dtypes(domain, old_params, tmp_path):
+    nj, ni = domain['mask'].shape
+    params = create_parameter_dataset(domain, old_params, nj, ni, 17, True, True, True)
+    filename = os.path.join(str(tmp_path), 'params.nc')
+    write_parameters(params, filename, compact=True)
+    with netCDF4.Dataset(filename) as fh:
+        assert fh.variables['init_moist'].dtype == np.float64
+        assert fh.variables['LAI'].dtype == np.float32
+        assert fh.variables['LAI'].chunking() == [1, 1, nj, ni]
+
+def test_streamed_compact_file_matches_compact_file(domain, old_params, tmp_path):
+    nj, ni = domain['mask'].shape
+    mask = domain['mask'].values
+    params = create_parameter_dataset(domain, old_params, nj, ni, 17, True, True, True)
+    rng = np.random.default_rng(0)
+    for name in params.data_vars:
+        if name in PARAMETER_SCHEMA:
+            fill_parameter(params, name, rng.uniform(0, 10, params[name].shape))
+    streamed_values = {name: params[name].values.copy() for name in params.data_vars if name in PARAMETER_SCHEMA}
+    for name in streamed_values:
+        fill_parameter(params, name, finalize_parameter_values(name, params[name].values, mask))
+
+    compact_file = os.path.join(str(tmp_path), 'compact.nc')
+    streamed_file = os.path.join(str(tmp_path), 'streamed.nc')
+    write_parameters(params, compact_file, compact=True)
+    fh = create_parameter_file(streamed_file, domain, old_params, nj, ni, 17, True, True, True, compact=True)
+    for name, values in streamed_values.items():
+        write_parameter(fh, name, values, mask)
+    fh.close()
+
+    with netCDF4.Dataset(compact_file) as compact, netCDF4.Dataset(streamed_file) as streamed:
+        for name in params.data_vars:
+            if name not in PARAMETER_SCHEMA:
+                continue
+            assert streamed.variables[name].dtype == compact.variables[name].dtype, name
+            assert streamed.variables[name]._FillValue == compact.variables[name]._FillValue, name
+            np.testing.assert_array_equal(streamed.variables[name][:], compact.variables[name][:], err_msg=name)
@@ -0,0 +1,62 @@
+import os
+
+import regrid_cache
+from regrid_datasets import RegridJob
+
+def make_job(source='/data/pfts.nc', output='/out/pfts_tgrid.nc', variable='PCT_PFT', valid_range=None):
+    return(RegridJob('pfts', source, variable, valid_range, None, output))
+
+def write_file(filename, size, mtime):
+    with open(filename, 'wb') as f:
+        f.write(b'x' * size)
+    os.utime(filename, (mtime, mtime))
+
+def test_cache_key_ignores_paths():
+    key = regrid_cache.cache_key(make_job(), 'source', 'domain', 'cdo')
+    assert key == regrid_cache.cache_key(make_job(source='/scratch/pfts.nc', output='/other/pfts.nc'),
+                                         'source', 'domain', 'cdo')
+
+def test_cache_key_changes_with_inputs():
+    keys = set([regrid_cache.cache_key(make_job(), 'source', 'domain', 'cdo'),
+                regrid_cache.cache_key(make_job(), 'changed', 'domain', 'cdo'),
+                regrid_cache.cache_key(make_job(), 'source', 'changed', 'cdo'),
+                regrid_cache.cache_key(make_job(), 'source', 'domain', 'native'),
+                regrid_cache.cache_key(make_job(), 'source', 'domain', 'cdo', halo=1.0),
+                regrid_cache.cache_key(make_job(variable='Band1'), 'source', 'domain', 'cdo'),
+                regrid_cache.cache_key(make_job(valid_range='0,100'), 'source', 'domain', 'cdo')])
+    assert len(keys) == 7
+
+def test_source_hashes_follow_contents(tmp_path):
+    cache_dir = str(tmp_path)
+    source = os.path.join(cache_dir, 'source.nc')
+    write_file(source, 10, 1000)
+    first = regrid_cache.source_hashes(cache_dir, [source])[source]
+    assert os.path.exists(os.path.join(cache_dir, regrid_cache.SOURCE_HASHES))
+    assert regrid_cache.source_hashes(cache_dir, [source])[source] == first
+
+    with open(source, 'wb') as f:
+        f.write(b'y' * 10)
+    os.utime(source, (2000, 2000))
+    assert regrid_cache.source_hashes(cache_dir, [source])[source] == regrid_cache.file_hash(source) != first
+
+def test_evict_cached_least_recently_used(tmp_path):
+    cache_dir = str(tmp_path)
+    for i, key in enumerate(['a', 'b', 'c', 'd']):
+        write_file(regrid_cache.cached_file(cache_dir, key), 100, 1000 + i)
+    # other files in the cache directory are not counted or evicted
+    write_file(os.path.join(cache_dir, regrid_cache.SOURCE_HASHES), 1000, 0)
+
+    # using a file makes it the most recently used
+    stats = regrid_cache.cache_stats()
+    output = os.path.join(cache_dir, 'output.nc')
+    assert regrid_cache.restore_cached(cache_dir, 'a', output, stats)
+    assert not regrid_cache.restore_cached(cache_dir, 'e', output, stats)
+    assert (stats['hits'], stats['misses']) == (1, 1)
+
+    regrid_cache.evict_cached(cache_dir, 250, stats)
+    assert os.path.exists(regrid_cache.cached_file(cache_dir, 'a'))
+    assert not os.path.exists(regrid_cache.cached_file(cache_dir, 'b'))
+    assert not os.path.exists(regrid_cache.cached_file(cache_dir, 'c'))
+    assert os.path.exists(regrid_cache.cached_file(cache_dir, 'd'))
+    assert os.path.exists(os.path.join(cache_dir, regrid_cache.SOURCE_HASHES))
+    assert (stats['evicted'], stats['evicted_bytes'], stats['files'], stats['size']) == (2, 200, 2, 200)
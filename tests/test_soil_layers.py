@@ -0,0 +1,51 @@
+import os
+
+import numpy as np
+import pytest
+import xarray as xr
+
+import parameter_functions
+from parameter_functions import soil_layer_index, aggregate_soil_layers
+
+def scalar_soil_layers(sl, total_depth, mean):
+    '''
+    the three VIC layers of one gridcell from the calculate_*_layer_*_mean functions, NaN where
+    they raise "layer did not get assigned"
+    '''
+    layers = [getattr(parameter_functions, 'calculate_first_layer_%s_mean' % mean)(sl[0], sl[1])]
+    for layer in ('second', 'third'):
+        function = getattr(parameter_functions, 'calculate_%s_layer_%s_mean' % (layer, mean))
+        try:
+            layers.append(function(*sl[2:], total_depth))
+        except ValueError:
+            layers.append(np.nan)
+    return(layers)
+
+@pytest.mark.parametrize('mean', ['harmonic', 'arithmetic'])
+def test_aggregate_soil_layers_matches_scalar(mean):
+    # soil depths across every branch, including the bounds of the branches
+    total_depth = np.concatenate([np.arange(0.6, 3.3, 0.05), [0.9, 1.0, 1.2, 1.5, 1.6, 2.0, 2.6]])
+    rng = np.random.default_rng(0)
+    sl = rng.uniform(0.5, 50, (7, total_depth.size))
+    soil_layers = xr.DataArray(sl, dims=('nlayer', 'cell'))
+    vic_layers = aggregate_soil_layers(soil_layers, xr.DataArray(total_depth, dims='cell'), mean=mean)
+
+    assert vic_layers.dims == ('nlayer', 'cell')
+    expected = np.array([scalar_soil_layers(sl[:, i], depth, mean)
+                         for i, depth in enumerate(total_depth)]).T
+    np.testing.assert_allclose(vic_layers.values, expected, rtol=1e-12)
+
+def test_soil_layer_index_cache_keeps_current_index(tmp_path):
+    cache_dir = str(tmp_path)
+    first = soil_layer_index(xr.DataArray(np.full((3, 4), 1.0), dims=('nj', 'ni')), cache_dir=cache_dir)
+    assert len(os.listdir(cache_dir)) == 1
+
+    total_depth = xr.DataArray(np.full((3, 4), 2.0), dims=('nj', 'ni'))
+    second = soil_layer_index(total_depth, cache_dir=cache_dir)
+    cached = os.listdir(cache_dir)
+    assert len(cached) == 1 and cached[0].startswith('soil_layer_index_')
+
+    # read back from the cache
+    assert soil_layer_index(total_depth, cache_dir=cache_dir).identical(second)
+    assert os.listdir(cache_dir) == cached
+    assert not first.identical(second)
@@ -0,0 +1,50 @@
+import numpy as np
+import xarray as xr
+
+from parameter_functions import (classify_soil_texture, classify_soil_texture_array, soil_class_values,
+                                 soil_class_lookup, SOIL_PROPERTIES)
+
+def soil_fractions():
+    '''
+    percent sand, clay and silt on a 1 % grid of the texture triangle, with a few missing clay cells
+    '''
+    sand, clay = np.meshgrid(np.arange(0, 101, 1.0), np.arange(0, 101, 1.0), indexing='ij')
+    inside = sand + clay <= 100
+    sand, clay = sand[inside], clay[inside]
+    silt = 100 - sand - clay
+    clay[::97] = np.nan
+    return(sand, clay, silt)
+
+def test_classify_soil_texture_array_matches_scalar():
+    sand, clay, silt = soil_fractions()
+    expected = np.array([classify_soil_texture(*cell) for cell in zip(sand, clay, silt)])
+
+    classes = classify_soil_texture_array(sand, clay, silt)
+    assert classes.dtype == np.int8
+    np.testing.assert_array_equal(classes, expected)
+
+def test_classify_soil_texture_array_dask():
+    sand, clay, silt = soil_fractions()
+    expected = classify_soil_texture_array(sand, clay, silt)
+
+    def chunked(values):
+        return(xr.DataArray(values, dims='cell').chunk({'cell': 500}))
+    classes = classify_soil_texture_array(chunked(sand), chunked(clay), chunked(silt))
+    assert classes.chunks is not None
+    np.testing.assert_array_equal(classes.values, expected)
+
+def test_soil_class_lookup_matches_soil_class_values():
+    soil_class = xr.DataArray(np.array([[0, 1, 2, 3, 4, 5, 6], [7, 8, 9, 10, 11, 12, 13]], dtype=np.float64),
+                              dims=('nj', 'ni'))
+    properties = soil_class_lookup(soil_class)
+    assert sorted(properties.data_vars) == sorted(SOIL_PROPERTIES)
+    for name in SOIL_PROPERTIES:
+        expected = np.vectorize(soil_class_values)(soil_class.values, name)
+        np.testing.assert_allclose(properties[name].values, expected, err_msg=name)
+
+def test_soil_class_lookup_missing_class():
+    soil_class = xr.DataArray(np.array([np.nan, 1.0]), dims='cell').chunk({'cell': 1})
+    properties = soil_class_lookup(soil_class).compute()
+    for name in SOIL_PROPERTIES:
+        assert np.isnan(properties[name].values[0]), name
+        assert properties[name].values[1] == soil_class_values(1, name), name
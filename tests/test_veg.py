@@ -0,0 +1,63 @@
+import numpy as np
+import xarray as xr
+
+from parameter_functions import (calculate_veg_parameters, calc_root_fract, calc_root_depth_rz1,
+                                 calc_root_depth_rz2, map_pft_to_nldas_class, is_overstory,
+                                 calculate_nveg, calculate_nveg_pfts, NLDAS_ALBEDO, NLDAS_MAX_SNOW_ALBEDO)
+
+def pft_cover(nj=3, ni=4):
+    '''
+    Cv of the 17 PFTs with bare, vegetated and missing gridcells
+    '''
+    rng = np.random.default_rng(0)
+    cv = rng.uniform(0, 1, (17, nj, ni))
+    cv[rng.uniform(0, 1, cv.shape) < 0.4] = 0
+    cv[:, 0, 0] = np.nan
+    return(xr.DataArray(cv, dims=('veg_class', 'nj', 'ni')))
+
+def test_calculate_veg_parameters_matches_scalar():
+    cv = pft_cover()
+    veg_params = calculate_veg_parameters(cv)
+
+    assert veg_params['root_fract'].dims == ('veg_class', 'root_zone', 'nj', 'ni')
+    assert veg_params['albedo'].dims == ('veg_class', 'month', 'nj', 'ni')
+    root_depth = [calc_root_depth_rz1, calc_root_depth_rz2]
+    for pft in range(17):
+        nldas = map_pft_to_nldas_class(pft)
+        for j, i in np.ndindex(cv.shape[1:]):
+            value = float(cv.values[pft, j, i])
+            for zone in range(2):
+                np.testing.assert_equal(veg_params['root_fract'].values[pft, zone, j, i],
+                                        calc_root_fract(value, pft, str(zone + 1)))
+                assert veg_params['root_depth'].values[pft, zone, j, i] == root_depth[zone](value)
+        assert (veg_params['overstory'].values[pft] == is_overstory(nldas)).all()
+        assert (veg_params['max_snow_albedo'].values[pft] == NLDAS_MAX_SNOW_ALBEDO[nldas]).all()
+        assert (veg_params['albedo'].values[pft] == NLDAS_ALBEDO[nldas]).all()
+
+def test_calculate_veg_parameters_old_params():
+    cv = pft_cover()
+    dims = ('veg_class', 'nj', 'ni')
+    old_params = xr.Dataset({'rmin': (dims, np.broadcast_to(np.arange(12.0)[:, None, None], (12, 2, 2))),
+                             'wind_h': (dims, np.full((12, 2, 2), 2.0))})
+    veg_params = calculate_veg_parameters(cv.rename({'veg_class': 'pft'}), old_params, veg_dim='pft')
+
+    # temperate needleleaf trees (NLDAS class 0) and C3 grass (NLDAS class 9)
+    assert (veg_params['rmin'].values[1] == 0).all()
+    assert (veg_params['rmin'].values[13] == 9).all()
+    assert (veg_params['wind_h'].values == 2).all()
+
+def test_calculate_nveg_matches_calculate_nveg_pfts():
+    rng = np.random.default_rng(1)
+    pct_pft = rng.uniform(0, 100, (17, 4, 5))
+    pct_pft[rng.uniform(0, 1, pct_pft.shape) < 0.6] = 0
+    # pure bare soil, bare soil with a rounding error and a missing PFT
+    pct_pft[:, 0, 0] = 0
+    pct_pft[0, 0, 0] = 100
+    pct_pft[0, 0, 1] = 100
+    pct_pft[3, 0, 1] = 1e-6
+    pct_pft[5, 1, 1] = np.nan
+    pct_pft = xr.DataArray(pct_pft, dims=('pft', 'nj', 'ni'))
+
+    expected = np.apply_along_axis(calculate_nveg_pfts, 0, pct_pft.values)
+    np.testing.assert_array_equal(calculate_nveg(pct_pft).values, expected)
+    np.testing.assert_array_equal(calculate_nveg(pct_pft.chunk({'nj': 2})).values, expected)